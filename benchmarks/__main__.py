@@ -0,0 +1,59 @@
+import argparse
+import json
+import sys
+
+from benchmarks.environment import offscreen_app
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Offscreen performance benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", help="registry sizes to generate")
+    parser.add_argument("--check", action="store_true", help="exit with an error when a metric regressed")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=2.0,
+        help="allowed slowdown factor against the baseline, after scaling by the reference workload",
+    )
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    app, app_folder = offscreen_app("dmq-bench-")
+
+    from benchmarks.suite import (
+        SIZES,
+        Suite,
+        compare,
+        load_baseline,
+        peak_rss,
+        save_baseline,
+    )
+
+    results = Suite(app).run(args.sizes or SIZES)
+
+    for metric, value in sorted(results.items()):
+        print(f"{metric:<48}{value:16.6g}")
+    rss = peak_rss()
+    if rss is not None:
+        print(f"{'process/peak_rss_bytes':<48}{rss:16.6g}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(results, indent=2, sort_keys=True))
+    if args.update_baseline:
+        save_baseline(results)
+
+    regressions = compare(results, load_baseline(), args.tolerance)
+    for metric, expected, value in regressions:
+        print(f"REGRESSION {metric}: expected {expected:.6g} on this machine, now {value:.6g}", file=sys.stderr)
+    app_folder.cleanup()
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
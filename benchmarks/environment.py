@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+
+def offscreen_app(prefix):
+    """Starts an offscreen QApplication over an empty app folder, returns both.
+
+    Must run before anything imports widgets.constants or Qt, they read the environment on import.
+    The folder is a TemporaryDirectory for the caller to clean up.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app_folder = tempfile.TemporaryDirectory(prefix=prefix)
+    os.environ["DMQ_APP_FOLDER"] = app_folder.name
+
+    from PyQt6.QtWidgets import QApplication
+
+    from widgets.storage import get_store
+
+    app = QApplication(sys.argv[:1])
+    get_store().ensure()
+    return app, app_folder
@@ -0,0 +1,108 @@
+import argparse
+import gc
+import os
+import random
+import sys
+
+from benchmarks.environment import offscreen_app
+
+# Answers before the reference sample, so caches and lazily built screens are in place
+WARMUP_SHARE = 0.1
+# Answers per substance before it as well, the journal and the samplers keep statistics per item
+WARMUP_PER_ITEM = 8
+SAMPLES = 10
+# Allowed growth from the reference sample to the last one
+MAX_OBJECT_GROWTH = 0.01
+MAX_RSS_GROWTH = 16 * 1024 * 1024
+
+
+def current_rss():
+    # The resident set right now, unlike peak_rss which never goes down
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        from benchmarks.suite import peak_rss
+
+        return peak_rss()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.soak", description="Answer many questions offscreen and check memory stays flat"
+    )
+    parser.add_argument("--answers", type=int, default=10000, help="number of questions to answer")
+    parser.add_argument("--size", type=int, default=200, help="number of substances in the generated registry")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    app, app_folder = offscreen_app("dmq-soak-")
+
+    from PyQt6.QtCore import QCoreApplication, QEvent
+
+    from benchmarks.suite import generate_registry
+    from main import MainWindow
+    from widgets.constants import units
+    from widgets.pipeline import start_pipeline
+    from widgets.storage import get_store
+
+    store = get_store()
+    drugs, situations = generate_registry(args.size)
+    store.save_drugs(drugs)
+    store.save_situations(situations)
+    start_pipeline(0)
+    rng = random.Random(0)
+
+    window = MainWindow()
+    window.show()
+    interval = max(1, args.answers // SAMPLES)
+    warmup = min(max(int(args.answers * WARMUP_SHARE), WARMUP_PER_ITEM * args.size), args.answers // 2)
+    samples = []
+
+    for answer in range(1, args.answers + 1):
+        if answer % 4 == 0:
+            window.draw_situation_quiz_screen()
+            quiz = window.screens["situation_quiz"]
+            quiz.drugs_box.setCheckedData(rng.sample(list(drugs), 3))
+            window.check_situation_answer(quiz)
+        else:
+            window.random_quiz()
+            quiz = window.screens["drug_quiz"]
+            quiz.dose.setText(f"{rng.uniform(0, 500):.2f}")
+            quiz.unit.setCurrentIndex(rng.randrange(len(units)))
+            window.check_drug_answer(quiz)
+        # The screens that reload their models on every visit, all opened once during the warm-up
+        if answer % 100 == 0:
+            window.draw_stats_screen()
+        if answer % 1000 == 0 or answer == warmup // 2:
+            window.draw_register_drug_screen()
+            window.draw_register_situation_screen()
+        app.processEvents()
+
+        if answer % interval == 0 or answer == warmup:
+            # Objects released with deleteLater go on the next event loop pass, run it now
+            QCoreApplication.sendPostedEvents(None, QEvent.Type.DeferredDelete.value)
+            gc.collect()
+            samples.append((answer, len(gc.get_objects()), current_rss()))
+            print(f"{answer:>8} answers {samples[-1][1]:>10} objects {samples[-1][2] or 0:>14} bytes", file=sys.stderr)
+
+    window.close()
+    app_folder.cleanup()
+
+    reference = next(sample for sample in samples if sample[0] >= warmup)
+    _, objects, rss = samples[-1]
+    failures = []
+    if objects > reference[1] * (1 + MAX_OBJECT_GROWTH):
+        failures.append(f"Python objects grew from {reference[1]} to {objects}")
+    if rss is not None and reference[2] is not None and rss - reference[2] > MAX_RSS_GROWTH:
+        failures.append(f"RSS grew from {reference[2]} to {rss} bytes")
+    for failure in failures:
+        print(f"LEAK {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
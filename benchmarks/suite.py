@@ -0,0 +1,263 @@
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SIZES = [100, 1000, 10000, 50000]
+MAX_LINKED_DRUGS = 200
+# Generated names are made of these, so they start with letters all over the alphabet
+SYLLABLES = ["a", "ba", "ce", "di", "fo", "gu", "he", "i", "jo", "ka", "lu", "me", "ni", "o", "pa", "qui", "ro"]
+SYLLABLES += ["sa", "te", "u", "vi", "wo", "xa", "ye", "zo", "dro", "phen", "tra", "zol", "mab", "cil", "pril"]
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Metrics where a larger value is better, every other metric is a cost
+HIGHER_IS_BETTER = {"answers_per_s"}
+# Timings below this are dominated by noise and are compared as if they took this long
+MIN_SECONDS = 0.005
+# Time of a fixed workload measured in the same run, timings and rates are compared relative to it
+REFERENCE = "reference/run_s"
+
+
+def generate_registry(size, seed=0):
+    rng = random.Random(seed)
+    drugs = {}
+    for i in range(size):
+        min_dose = round(rng.uniform(0.01, 5), 2)
+        name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        drugs[f"{name} {i:05d}"] = {
+            "unit": rng.choice(["mg", "µg", "mg/kgKG", "µg/kgKG", "mg/kgKG/h", "ml"]),
+            "min_dose": min_dose,
+            "max_dose": round(min_dose * rng.uniform(1.1, 3), 2),
+        }
+    names = list(drugs)
+    situations = []
+    for i in range(max(1, size // 10)):
+        linked = rng.sample(names, rng.randint(1, min(MAX_LINKED_DRUGS, size)))
+        situations.append([f"Situation {i:05d}: patient presenting with case {rng.random():.6f}", linked])
+    return drugs, situations
+
+
+def measure(function, repeat=3):
+    # Best wall time over a few runs, peak traced allocation of the first run
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    best = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    for _ in range(repeat - 1):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best, peak
+
+
+def reference_workload():
+    # Plain interpreter work, roughly the mix of the app: strings, lists, sorting and JSON
+    rng = random.Random(0)
+    rows = [[f"Substance {rng.randrange(10**6):06d}", rng.random()] for _ in range(20000)]
+    rows.sort()
+    json.loads(json.dumps(rows))
+
+
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Suite:
+    def __init__(self, app):
+        from widgets.storage import get_store
+
+        self.app = app
+        self.store = get_store()
+        self.results = {}
+
+    def record(self, name, size, kind, value):
+        self.results[f"{name}/{size}/{kind}"] = value
+
+    def show_screen(self, layout):
+        from PyQt6.QtWidgets import QWidget
+
+        page = QWidget()
+        page.setLayout(layout)
+        layout.reset()
+        page.show()
+        self.app.processEvents()
+        return page
+
+    def construct(self, name, size, factory):
+        pages = []
+
+        def build():
+            pages.append(self.show_screen(factory()))
+
+        seconds, peak = measure(build)
+        self.record(name, size, "construct_s", seconds)
+        self.record(name, size, "peak_bytes", peak)
+        for page in pages:
+            page.close()
+            page.deleteLater()
+        self.app.processEvents()
+
+    def run_size(self, size):
+        from widgets.cache import registry_cache
+        from widgets.editors import RegisterDrugs, RegisterSituation
+        from widgets.engine import QuizEngine
+        from widgets.helpers import check_answer
+        from widgets.screens import SituationQuiz
+
+        drugs, situations = generate_registry(size)
+
+        def save_all():
+            self.store.save_drugs(drugs)
+            self.store.flush()
+
+        seconds, _ = measure(save_all)
+        self.record("registry", size, "save_all_s", seconds)
+        self.store.save_situations(situations)
+        self.store.flush()
+
+        def cold_load():
+            registry_cache.invalidate()
+            self.store.load_drugs()
+            self.store.load_situations()
+
+        seconds, peak = measure(cold_load)
+        self.record("registry", size, "load_s", seconds)
+        self.record("registry", size, "peak_bytes", peak)
+
+        # What the quizzes load, served from the compiled snapshot once it is up to date
+        registry_cache.invalidate()
+        snapshot = self.store.snapshot()
+        if snapshot is not None:
+            snapshot.close()
+        lookups = random.Random(size).sample(list(drugs), min(100, size))
+
+        def cold_engine():
+            registry_cache.invalidate()
+            engine = QuizEngine.from_store(self.store)
+            # A snapshot is only read where it is used, so every column is read once to count that too
+            for name in lookups:
+                engine.index[name]
+            sum(len(name) for name in engine.names)
+            sum(engine.min_doses) + sum(engine.max_doses)
+            list(engine.units), list(engine.concentrations)
+            sum(len(drugs) for _, drugs in engine.situations)
+            engine.close()
+
+        seconds, peak = measure(cold_engine)
+        self.record("engine", size, "load_s", seconds)
+        self.record("engine", size, "peak_bytes", peak)
+        # The editors parse the registries themselves, measured above, so their own cost is measured below
+        self.store.load_drugs()
+        self.store.load_situations()
+
+        self.construct("register_drugs", size, RegisterDrugs)
+        self.construct("register_situation", size, RegisterSituation)
+        self.construct("situation_quiz", size, SituationQuiz)
+
+        editor = RegisterDrugs()
+        page = self.show_screen(editor)
+
+        def save_one_row():
+            index = editor.model.index(0, editor.model.MAX_DOSE)
+            editor.model.setData(index, str(time.perf_counter() % 1 + 10))
+            editor.save()
+            self.store.flush()
+
+        seconds, _ = measure(save_one_row)
+        self.record("register_drugs", size, "save_row_s", seconds)
+        page.close()
+        page.deleteLater()
+
+        rng = random.Random(size)
+        names = list(drugs)
+        answers = [
+            (rng.choice(names), rng.randint(40, 160), f"{rng.uniform(0, 500):.2f}", rng.choice(["mg", "µg"]))
+            for _ in range(2000)
+        ]
+        start = time.perf_counter()
+        for answer in answers:
+            check_answer(*answer)
+        self.record("check_answer", size, "answers_per_s", len(answers) / (time.perf_counter() - start))
+
+        engine = QuizEngine(drugs, situations)
+        batch = answers * 50
+        engine.grade_many(answers[:1])
+        start = time.perf_counter()
+        engine.grade_many(batch)
+        self.record("grade_many", size, "answers_per_s", len(batch) / (time.perf_counter() - start))
+
+        start = time.perf_counter()
+        engine.search_index
+        self.record("drug_search", size, "build_s", time.perf_counter() - start)
+        # Prefixes of names from all over the alphabet, and a piece from inside each name
+        queries = [
+            query for name in rng.sample(names, min(50, size)) for query in (name[:1], name[:3], name[:12], name[1:5])
+        ]
+        start = time.perf_counter()
+        for query in queries:
+            engine.search_index.search(query, 200)
+        self.record("drug_search", size, "keystroke_s", (time.perf_counter() - start) / len(queries))
+
+    def run(self, sizes):
+        # A throwaway pass so one-time imports and Qt setup are not charged to the first size
+        self.run_size(10)
+        self.results = {}
+        reference, _ = measure(reference_workload)
+        for size in sizes:
+            print(f"Running size {size}", file=sys.stderr)
+            self.run_size(size)
+        # Measured again at the end, so a machine that slows down halfway is not taken for a regression
+        self.results[REFERENCE] = max(reference, measure(reference_workload)[0])
+        return self.results
+
+
+def compare(results, baseline, tolerance):
+    # How much slower this machine is than the one that recorded the baseline, memory is not scaled
+    slowdown = 1.0
+    if results.get(REFERENCE) and baseline.get(REFERENCE):
+        slowdown = results[REFERENCE] / baseline[REFERENCE]
+    regressions = []
+    for metric, value in sorted(results.items()):
+        expected = baseline.get(metric)
+        if expected is None or metric == REFERENCE:
+            continue
+        kind = metric.rsplit("/", 1)[1]
+        if kind in HIGHER_IS_BETTER:
+            expected /= slowdown
+            regressed = value < expected / tolerance
+        elif kind.endswith("_s"):
+            expected *= slowdown
+            regressed = max(value, MIN_SECONDS) > max(expected, MIN_SECONDS) * tolerance
+        else:
+            regressed = value > expected * tolerance
+        if regressed:
+            regressions.append((metric, expected, value))
+    return regressions
+
+
+def load_baseline(path=BASELINE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.loads(f.read())
+
+
+def save_baseline(results, path=BASELINE):
+    with open(path, "w") as f:
+        f.write(json.dumps(results, indent=2, sort_keys=True) + "\n")
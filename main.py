@@ -1,177 +1,460 @@
+import time
+
+# Taken before the heavy imports so --profile-startup covers them
+STARTED = time.perf_counter()
+
+import argparse
+import multiprocessing
 import os
-import random
 import sys
 
+from PyQt6.QtCore import QEvent, QObject, QTimer
 from PyQt6.QtWidgets import (
     QApplication,
+    QHBoxLayout,
     QLabel,
     QMainWindow,
-    QPushButton,
-    QStatusBar,
+    QStackedWidget,
     QVBoxLayout,
     QWidget,
 )
 
-from widgets.constants import APP_FOLDER, DRUGS_REGISTRY, SITUATIONS_REGISTRY
-from widgets.helpers import ensure_file, read_current_drugs
+from widgets.adaptive import flush_samplers, get_sampler
+from widgets.autosave import autosaver
+from widgets.constants import APP_FOLDER
+from widgets.engine import get_engine
+from widgets.exam import Exam
+from widgets.helpers import (
+    PendingWritesLabel,
+    RegistryWatcher,
+    TraceOverlay,
+    WidgetCounter,
+    drug_message,
+    situation_message,
+)
+from widgets.journal import close_journal
+from widgets.pipeline import get_pipeline, start_pipeline
+from widgets.scheduler import flush_schedulers, get_scheduler
 from widgets.screens import (
     ChooseDrugQuiz,
     DrugQuiz,
-    RegisterDrugs,
-    RegisterSituation,
+    ExamSummary,
+    ResultPanel,
     SituationQuiz,
     StartMenu,
+    StatsScreen,
 )
-
-os.makedirs(APP_FOLDER, exist_ok=True)
-ensure_file(DRUGS_REGISTRY, {})
-ensure_file(SITUATIONS_REGISTRY, [])
-
-
-class AnswerWindow(QWidget):
-    def __init__(self, message):
-        super().__init__()
-        self.layout = QVBoxLayout()
-        self.setLayout(self.layout)
-        self.label = QLabel(message)
-        self.layout.addWidget(self.label)
-        self.button = QPushButton("OK")
-        self.button.clicked.connect(self.close)
-        self.layout.addWidget(self.button)
+from widgets.shared import SharedStore
+from widgets.storage import get_store
+from widgets.tracing import DEFAULT_TRACE_FILE, TRACE_ENV, span, tracer
 
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
 
+        # Every screen is built once, on first navigation, and reset with new data afterwards
+        self.screens = {}
+        self.pages = {}
+        self.button_bars = {}
+        self.drill = []
+        self.drill_position = 0
+        self.current_screen = None
+        # The seed is shown so a drill session can be replayed with --seed
+        self.setWindowTitle(f"Drugs Quiz (session {get_pipeline().seed})")
+        self.stack = QStackedWidget()
+        # One result panel for the whole session instead of a new window per answer
+        self.result_panel = ResultPanel()
+        central = QWidget()
+        central_layout = QVBoxLayout(central)
+        central_layout.setContentsMargins(0, 0, 0, 0)
+        central_layout.addWidget(self.stack, 1)
+        central_layout.addWidget(self.result_panel)
+        self.setCentralWidget(central)
+        self.button_stack = QStackedWidget()
+        self.statusBar().addWidget(self.button_stack)
+        self.statusBar().addPermanentWidget(PendingWritesLabel())
+        self.exam = None
+        self.exam_clock = QLabel()
+        self.exam_clock.hide()
+        self.statusBar().addPermanentWidget(self.exam_clock)
+        self.exam_timer = QTimer(self)
+        self.exam_timer.setSingleShot(True)
+        self.exam_timer.timeout.connect(self.finish_exam)
+        self.exam_clock_timer = QTimer(self)
+        self.exam_clock_timer.timeout.connect(self.update_exam_clock)
+        if tracer.enabled:
+            self.statusBar().addPermanentWidget(TraceOverlay())
+        # Open screens follow the changes other workstations make to a shared registry
+        self.registry_label = QLabel()
+        if isinstance(get_store(), SharedStore):
+            self.registry_watcher = RegistryWatcher(get_store(), self)
+            self.registry_watcher.changed.connect(self.registry_changed)
+            self.statusBar().addPermanentWidget(self.registry_label)
+
         self.start_screen()
 
-    def _draw_screen(self, layout, buttons=None):
-        buttons = buttons or []
-        widget = QWidget()
-        self.setCentralWidget(widget)
-        widget.setLayout(layout)
-        statusBar = QStatusBar()
-        self.setStatusBar(statusBar)
+    def _screen(self, name, factory, buttons=()):
+        if name not in self.screens:
+            with span("screen build", screen=name):
+                self._build_screen(name, factory, buttons)
+        return self.screens[name]
+
+    def _build_screen(self, name, factory, buttons):
+        layout = factory()
+        page = QWidget()
+        page.setLayout(layout)
+        self.stack.addWidget(page)
 
-        for button in buttons:
-            statusBar.addWidget(button)
-        statusBar.show()
+        bar = QWidget()
+        bar_layout = QHBoxLayout(bar)
+        bar_layout.setContentsMargins(0, 0, 0, 0)
+        for button in buttons(layout) if buttons else ():
+            bar_layout.addWidget(button)
+        self.button_stack.addWidget(bar)
+
+        self.screens[name] = layout
+        self.pages[name] = page
+        self.button_bars[name] = bar
+
+    def _show(self, name):
+        tracer.count("navigations")
+        self.result_panel.hide()
+        self.current_screen = name
+        self.stack.setCurrentWidget(self.pages[name])
+        self.button_stack.setCurrentWidget(self.button_bars[name])
 
     def start_screen(self):
-        self.start_widget = StartMenu()
-        self.connect_start_screen_buttons()
-        self._draw_screen(self.start_widget)
+        # Review progress is written when leaving a quiz instead of after every answer
+        flush_schedulers()
+        flush_samplers()
+        self.stop_exam()
+        if "start" not in self.screens:
+            self.start_widget = self._screen("start", StartMenu)
+            self.connect_start_screen_buttons()
+        self._show("start")
 
     def connect_start_screen_buttons(self):
+        self.start_widget.stats.clicked.connect(self.draw_stats_screen)
         self.start_widget.register_drug.clicked.connect(self.draw_register_drug_screen)
         self.start_widget.register_situation.clicked.connect(self.draw_register_situation_screen)
-        self.start_widget.situation_quiz.clicked.connect(self.draw_situation_quiz_screen)
+        self.start_widget.situation_quiz.clicked.connect(lambda: self.draw_situation_quiz_screen())
         self.start_widget.random_quiz.clicked.connect(self.random_quiz)
+        self.start_widget.review_quiz.clicked.connect(self.review_quiz)
+        self.start_widget.review_situation_quiz.clicked.connect(lambda: self.draw_situation_quiz_screen("review"))
+        self.start_widget.weak_quiz.clicked.connect(self.weak_quiz)
+        self.start_widget.weak_situation_quiz.clicked.connect(lambda: self.draw_situation_quiz_screen("weak"))
         self.start_widget.choice_quiz.clicked.connect(self.draw_choose_quiz_screen)
+        self.start_widget.exam.clicked.connect(self.start_exam)
+
+    def _editor_buttons(self, widget):
+        widget.cancel_button.clicked.connect(self.start_screen)
+        widget.save_button.clicked.connect(lambda: self.save_content(widget))
+        return [widget.cancel_button, widget.save_button, widget.add_new_line_button]
+
+    def _drug_editor_buttons(self, widget):
+        return self._editor_buttons(widget) + [widget.import_button, widget.export_button]
 
     def draw_register_drug_screen(self):
-        self.register_drug_widget = RegisterDrugs()
-        self.register_drug_widget.cancel_button.clicked.connect(self.start_screen)
-        self.register_drug_widget.save_button.clicked.connect(lambda: self.save_content(self.register_drug_widget))
-        buttons = [
-            self.register_drug_widget.cancel_button,
-            self.register_drug_widget.save_button,
-            self.register_drug_widget.add_new_line_button,
-        ]
-        self._draw_screen(self.register_drug_widget, buttons)
+        # The editors pull in the table models, so they are only imported when first opened
+        from widgets.editors import RegisterDrugs
+
+        self.register_drug_widget = self._screen("register_drug", RegisterDrugs, self._drug_editor_buttons)
+        with span("screen reset", screen="register_drug"):
+            self.register_drug_widget.reset()
+        self._show("register_drug")
 
     def draw_register_situation_screen(self):
-        self.register_situation_widget = RegisterSituation()
-        self.register_situation_widget.cancel_button.clicked.connect(self.start_screen)
-        self.register_situation_widget.save_button.clicked.connect(
-            lambda: self.save_content(self.register_situation_widget)
-        )
-        buttons = [
-            self.register_situation_widget.cancel_button,
-            self.register_situation_widget.save_button,
-            self.register_situation_widget.add_new_line_button,
-        ]
-
-        self._draw_screen(self.register_situation_widget, buttons)
-
-    def draw_situation_quiz_screen(self):
-        self.situation_quiz_widget = SituationQuiz()
-        self.situation_quiz_widget.cancel_button.clicked.connect(self.start_screen)
-        buttons = [self.situation_quiz_widget.cancel_button]
-        if hasattr(self.situation_quiz_widget, "answer_button"):
-            self.situation_quiz_widget.answer_button.clicked.connect(
-                lambda: self.check_situation_answer(self.situation_quiz_widget)
-            )
-            buttons.append(self.situation_quiz_widget.answer_button)
-        self._draw_screen(self.situation_quiz_widget, buttons)
+        from widgets.editors import RegisterSituation
+
+        self.register_situation_widget = self._screen("register_situation", RegisterSituation, self._editor_buttons)
+        with span("screen reset", screen="register_situation"):
+            self.register_situation_widget.reset()
+        self._show("register_situation")
+
+    def _situation_quiz_buttons(self, widget):
+        widget.cancel_button.clicked.connect(self.start_screen)
+        widget.answer_button.clicked.connect(lambda: self.check_situation_answer(widget))
+        widget.next_button.clicked.connect(lambda: self.draw_situation_quiz_screen(widget.mode))
+        return [widget.cancel_button, widget.answer_button, widget.next_button]
+
+    def draw_situation_quiz_screen(self, mode="random", question=None):
+        self.situation_quiz_widget = self._screen("situation_quiz", SituationQuiz, self._situation_quiz_buttons)
+        with span("screen reset", screen="situation_quiz"):
+            self.situation_quiz_widget.reset(mode, question)
+        self._show("situation_quiz")
+
+    def _choose_quiz_buttons(self, widget):
+        widget.cancel_button.clicked.connect(self.start_screen)
+        widget.start_button.clicked.connect(lambda: self.start_drill(widget.chosen()))
+        widget.search_box.returnPressed.connect(lambda: self.start_drill(widget.chosen()))
+        return [widget.cancel_button, widget.start_button]
 
     def draw_choose_quiz_screen(self):
-        self.choose_drug_widget = ChooseDrugQuiz()
-        self.choose_drug_widget.cancel_button.clicked.connect(self.start_screen)
-        buttons = [self.choose_drug_widget.cancel_button]
-        if hasattr(self.choose_drug_widget, "start_button"):
-            self.choose_drug_widget.start_button.clicked.connect(
-                lambda: self.draw_quiz_screen(
-                    self.choose_drug_widget.combo_options.currentText(),
-                    quiz_type="choose"
+        self.choose_drug_widget = self._screen("choose_quiz", ChooseDrugQuiz, self._choose_quiz_buttons)
+        with span("screen reset", screen="choose_quiz"):
+            self.choose_drug_widget.reset()
+        self._show("choose_quiz")
+
+    def start_drill(self, drugs):
+        # A drill goes round the chosen substances until the quiz is left
+        if not drugs:
+            return
+        self.drill = drugs
+        self.drill_position = 0
+        self.draw_quiz_screen(drugs[0], quiz_type="choose")
+
+    def _drug_quiz_buttons(self, widget):
+        widget.cancel_button.clicked.connect(self.start_screen)
+        widget.answer_button.clicked.connect(lambda: self.check_drug_answer(widget))
+        widget.next_button.clicked.connect(lambda: self.next_drug_question(widget))
+        return [widget.cancel_button, widget.answer_button, widget.next_button]
+
+    def draw_quiz_screen(self, drug, quiz_type, weigth=None):
+        quiz_widget = self._screen("drug_quiz", DrugQuiz, self._drug_quiz_buttons)
+        with span("screen reset", screen="drug_quiz"):
+            quiz_widget.rebind(drug, quiz_type, weigth)
+        self._show("drug_quiz")
+
+    def next_drug_question(self, widget):
+        if widget.quiz_type == "random":
+            self.random_quiz()
+        elif widget.quiz_type == "review":
+            self.review_quiz()
+        elif widget.quiz_type == "weak":
+            self.weak_quiz()
+        else:
+            self.drill_position = (self.drill_position + 1) % len(self.drill)
+            self.draw_quiz_screen(self.drill[self.drill_position], widget.quiz_type)
+
+    def _stats_buttons(self, widget):
+        widget.cancel_button.clicked.connect(self.start_screen)
+        return [widget.cancel_button]
+
+    def draw_stats_screen(self):
+        self.stats_widget = self._screen("stats", StatsScreen, self._stats_buttons)
+        with span("screen reset", screen="stats"):
+            self.stats_widget.reset()
+        self._show("stats")
+
+    def registry_changed(self):
+        # Quizzes pick the changes up with the next question, lists and editors are reloaded now
+        self.registry_label.setText(f"Registry updated from {get_store().changed_by}")
+        if self.current_screen == "choose_quiz":
+            self.choose_drug_widget.reset()
+        elif self.current_screen in ("register_drug", "register_situation"):
+            editor = self.screens[self.current_screen]
+            if editor.model.is_modified():
+                self.registry_label.setText(
+                    f"Registry updated from {get_store().changed_by}, reopen the editor after saving to see the changes"
                 )
-            )
-            buttons.append(self.choose_drug_widget.answer_button)
-        
-        self._draw_screen(self.choose_drug_widget, buttons)
-
-    def draw_quiz_screen(self, drug, quiz_type):
-        quiz_widget = DrugQuiz(drug, quiz_type)
-        quiz_widget.cancel_button.clicked.connect(self.start_screen)
-        quiz_widget.answer_button.clicked.connect(lambda: self.check_drug_answer(quiz_widget))
-        buttons = [quiz_widget.cancel_button, quiz_widget.answer_button]
-        self._draw_screen(quiz_widget, buttons)
+                return
+            search = getattr(editor, "search_box", None)
+            text = search.text() if search is not None else ""
+            editor.reset()
+            if text:
+                search.setText(text)
 
     def save_content(self, widget):
-        widget.save()
-        self.start_screen()
+        # The editor stays open when saving was called off
+        if widget.save():
+            self.start_screen()
 
     def random_quiz(self):
-        current_content = read_current_drugs()
-        if not current_content:
-            self.answer_window = AnswerWindow("No substances registered. Please register some substances first.")
-            self.answer_window.show()
+        question = get_pipeline().next_drug()
+        if question is None:
+            self.show_result("No substances registered. Please register some substances first.")
+            return
+        self.draw_quiz_screen(question.drug, "random", question.weight)
+        # The following questions are drawn while this one is being answered
+        QTimer.singleShot(0, lambda: get_pipeline().fill("drugs"))
+
+    def review_quiz(self):
+        engine = get_engine()
+        if not engine.names:
+            self.show_result("No substances registered. Please register some substances first.")
+            return
+        scheduler = get_scheduler("drugs")
+        scheduler.sync(engine.names)
+        self.draw_quiz_screen(scheduler.next(), "review")
+
+    def weak_quiz(self):
+        # Substances answered wrong or slowly lately come up more often
+        engine = get_engine()
+        if not engine.names:
+            self.show_result("No substances registered. Please register some substances first.")
             return
-        random_item = random.choice(list(current_content.keys()))
-        self.draw_quiz_screen(random_item, "random")
+        sampler = get_sampler("drugs")
+        sampler.sync(engine.names)
+        self.draw_quiz_screen(get_pipeline().weighted("drugs", sampler), "weak")
+
+    def closeEvent(self, event):
+        flush_schedulers()
+        flush_samplers()
+        close_journal()
+        get_store().flush()
+        autosaver.flush()
+        super().closeEvent(event)
+
+    def show_result(self, message):
+        with span("result shown"):
+            self.result_panel.show_message(message)
 
     def check_drug_answer(self, widget):
-        widget.answer()
-        next_button = QPushButton("Next question")
-        cancel_button = QPushButton("Cancel")
-        cancel_button.clicked.connect(self.start_screen)
-        if widget.quiz_type == "random":
-            next_button.clicked.connect(self.random_quiz)
-        else:
-            next_button.clicked.connect(lambda: self.draw_quiz_screen(widget.drug, widget.quiz_type))
-        statusBar = QStatusBar()
-        self.setStatusBar(statusBar)
-        statusBar.addWidget(next_button)
-        statusBar.addWidget(cancel_button)
-        statusBar.show()
+        if widget.quiz_type == "exam":
+            self.exam.answer(widget.current_answer())
+            self.show_exam_question()
+            return
+        self.show_result(drug_message(widget.answer()))
+        widget.show_answered()
 
     def check_situation_answer(self, widget):
-        widget.answer()
-        next_button = QPushButton("Next question")
-        cancel_button = QPushButton("Cancel")
-        cancel_button.clicked.connect(self.start_screen)
-        next_button.clicked.connect(self.draw_situation_quiz_screen)
-        statusBar = QStatusBar()
-        self.setStatusBar(statusBar)
-        statusBar.addWidget(next_button)
-        statusBar.addWidget(cancel_button)
-        statusBar.show()
+        if widget.mode == "exam":
+            self.exam.answer(widget.current_answer())
+            self.show_exam_question()
+            return
+        self.show_result(situation_message(widget.answer()))
+        widget.show_answered()
+
+    def start_exam(self):
+        exam = Exam(get_pipeline().seed)
+        if not exam.questions:
+            self.show_result("No substances registered. Please register some substances first.")
+            return
+        self.exam = exam
+        exam.start()
+        # One timer ends the exam, the other only refreshes the clock in the status bar
+        self.exam_timer.start(int(exam.time_limit * 1000))
+        self.exam_clock_timer.start(1000)
+        self.update_exam_clock()
+        self.exam_clock.show()
+        self.show_exam_question()
+
+    def show_exam_question(self):
+        question = self.exam.current()
+        if question is None:
+            self.finish_exam()
+        elif question.kind == "drug":
+            self.draw_quiz_screen(question.item, "exam", question.weight)
+        else:
+            self.draw_situation_quiz_screen("exam", (question.item, question.expected))
+
+    def update_exam_clock(self):
+        remaining = int(self.exam.remaining())
+        position = min(self.exam.position + 1, len(self.exam.questions))
+        self.exam_clock.setText(
+            f"Question {position}/{len(self.exam.questions)}, {remaining // 60}:{remaining % 60:02d} left"
+        )
+
+    def stop_exam(self):
+        self.exam_timer.stop()
+        self.exam_clock_timer.stop()
+        self.exam_clock.hide()
+
+    def finish_exam(self):
+        if self.exam is None or self.exam.rows is not None:
+            return
+        self.stop_exam()
+        with span("exam grading", questions=len(self.exam.questions)):
+            self.exam.grade()
+        summary = self._screen("exam_summary", ExamSummary, self._stats_buttons)
+        summary.reset(self.exam)
+        self._show("exam_summary")
+
+
+class StartupProfiler(QObject):
+    """Reports how long it took from process start until the window was first painted."""
+
+    def __init__(self):
+        super().__init__()
+        self.marks = []
+
+    def watch(self, window):
+        window.installEventFilter(self)
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter()))
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint:
+            obj.removeEventFilter(self)
+            self.mark("first paint")
+            self.report()
+            QTimer.singleShot(0, QApplication.instance().quit)
+        return False
+
+    def report(self):
+        previous = STARTED
+        for name, moment in self.marks:
+            print(f"{name:<16}{(moment - previous) * 1000:8.1f} ms", file=sys.stderr)
+            previous = moment
+        print(f"{'total':<16}{(previous - STARTED) * 1000:8.1f} ms", file=sys.stderr)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Drug dosing quiz", epilog="Printable quiz sheets: main.py sheets --help"
+    )
+    parser.add_argument(
+        "--trace",
+        nargs="?",
+        const=DEFAULT_TRACE_FILE,
+        metavar="FILE",
+        help=f"record timing spans to a Chrome trace file (default {DEFAULT_TRACE_FILE}), same as {TRACE_ENV}=FILE",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="seed for the questions, replays the session that was shown with this number",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="print the time to first paint and exit",
+    )
+    return parser.parse_known_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv if argv is None else argv
+    if argv[1:2] == ["sheets"]:
+        # Headless, no window is opened
+        from widgets.sheets import main as sheets_main
+
+        return sheets_main(argv[2:])
+    args, qt_args = parse_args(argv[1:])
+
+    profiler = None
+    if args.profile_startup:
+        profiler = StartupProfiler()
+        profiler.mark("imports")
+
+    if args.trace:
+        tracer.enable(args.trace)
+    start_pipeline(args.seed)
+
+    app = QApplication(argv[:1] + qt_args)
+    if tracer.enabled:
+        widget_counter = WidgetCounter(app)
+        app.installEventFilter(widget_counter)
+    if profiler is not None:
+        profiler.mark("application")
+
+    os.makedirs(APP_FOLDER, exist_ok=True)
+    get_store().ensure()
 
+    window = MainWindow()
+    if profiler is not None:
+        profiler.watch(window)
+        profiler.mark("main window")
+    window.show()
 
-app = QApplication(sys.argv)
+    exit_code = app.exec()
+    tracer.write()
+    return exit_code
 
-window = MainWindow()
-window.show()
 
-app.exec()
+if __name__ == "__main__":
+    # The sheet workers start from this module in packaged builds
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# widgets.constants reads these on import, the tests must not touch a real registry
+os.environ["DMQ_APP_FOLDER"] = tempfile.mkdtemp(prefix="dmq-tests-")
+os.environ.pop("DMQ_SHARED_FOLDER", None)
+os.environ.pop("DMQ_STORAGE", None)
+# The widget tests run without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
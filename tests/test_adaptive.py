@@ -0,0 +1,49 @@
+import random
+from collections import Counter
+
+import pytest
+
+from widgets.adaptive import AliasTable, WeakSpotSampler
+
+
+def test_alias_table_probabilities():
+    weights = [0.1, 2.5, 1, 0.4, 6, 3]
+    table = AliasTable(weights)
+    # Chance of i: its own column kept, plus what the other columns hand over to it
+    chances = [table.probability[i] for i in range(len(weights))]
+    for i, alias in enumerate(table.alias):
+        if alias != i:
+            chances[alias] += 1 - table.probability[i]
+    assert [chance / len(weights) for chance in chances] == pytest.approx([w / sum(weights) for w in weights])
+
+
+def test_sampler_draws_in_proportion_to_the_weights(tmp_path):
+    sampler = WeakSpotSampler("drugs", str(tmp_path / "weak_drugs.json"))
+    items = [f"Drug {i}" for i in range(200)]
+    sampler.sync(items)
+    rng = random.Random(0)
+    for item in items[:100]:
+        sampler.record(item, rng.random() < 0.7, rng.uniform(2, 30))
+    sampler.draw(rng)
+    # Changes after the table was built, drawn through the pending list and by rejection
+    sampler.record(items[150], False, 60)
+    sampler.record(items[151], False, 45)
+    sampler.record(items[0], True, 1)
+    assert sampler._pending
+
+    draws = 200000
+    counts = Counter(sampler.draw(rng) for _ in range(draws))
+    assert sampler._pending, "the table was built again, the pending draws went untested"
+    total = sum(sampler.weight(item) for item in items)
+    for item in items:
+        expected = sampler.weight(item) / total
+        assert abs(counts[item] / draws - expected) < 4 * (expected / draws) ** 0.5 + 1e-4, item
+
+
+def test_sampler_follows_the_registry(tmp_path):
+    sampler = WeakSpotSampler("drugs", str(tmp_path / "weak_drugs.json"))
+    assert sampler.draw(random.Random(0)) is None
+    sampler.record("Removed", False, 10)
+    sampler.sync(["Kept"])
+    assert {sampler.draw(random.Random(seed)) for seed in range(20)} == {"Kept"}
+    assert "Removed" in sampler.state
@@ -0,0 +1,123 @@
+import json
+import os
+import stat
+import time
+
+import pytest
+
+from widgets import autosave
+from widgets.autosave import AutoSaver, atomic_write, rotate_backups
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_atomic_write_syncs_before_replacing(tmp_path, monkeypatch):
+    target = tmp_path / "drugs.json"
+    target.write_text("old")
+    events = []
+    fsync, replace = os.fsync, os.replace
+    monkeypatch.setattr(os, "fsync", lambda fd: events.append("fsync") or fsync(fd))
+    monkeypatch.setattr(os, "replace", lambda *paths: events.append(("replace", target.read_text())) or replace(*paths))
+
+    atomic_write(str(target), "new")
+
+    # The data is on disk before the rename, then the folder entry is synced
+    assert events[:2] == ["fsync", ("replace", "old")]
+    assert target.read_text() == "new"
+    assert os.listdir(tmp_path) == ["drugs.json"]
+
+
+def test_atomic_write_leaves_the_target_alone_on_failure(tmp_path, monkeypatch):
+    target = tmp_path / "drugs.json"
+    target.write_text("old")
+    monkeypatch.setattr(os, "replace", lambda *paths: (_ for _ in ()).throw(OSError("disk full")))
+
+    with pytest.raises(OSError):
+        atomic_write(str(target), b"new")
+    assert target.read_text() == "old"
+    assert os.listdir(tmp_path) == ["drugs.json"]
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permissions")
+def test_atomic_write_file_modes(tmp_path):
+    new = tmp_path / "new.json"
+    atomic_write(str(new), "{}")
+    assert mode(new) == 0o666 & ~autosave._UMASK
+
+    existing = tmp_path / "existing.json"
+    existing.write_text("{}")
+    os.chmod(existing, 0o640)
+    atomic_write(str(existing), "[]")
+    assert mode(existing) == 0o640
+
+
+def test_rotate_backups_keeps_the_latest_versions(tmp_path):
+    target, backups = tmp_path / "drugs.json", tmp_path / "backups"
+    for version in range(5):
+        target.write_text(str(version))
+        rotate_backups(str(target), str(backups), count=3)
+        atomic_write(str(target), str(version + 1))
+
+    assert sorted(os.listdir(backups)) == ["drugs.json.1", "drugs.json.2", "drugs.json.3"]
+    assert [(backups / f"drugs.json.{number}").read_text() for number in (1, 2, 3)] == ["4", "3", "2"]
+    # The hard link must not follow the live file to its new contents
+    assert target.read_text() == "5"
+
+
+def test_rotate_backups_without_a_file(tmp_path):
+    rotate_backups(str(tmp_path / "missing.json"), str(tmp_path / "backups"))
+    assert not (tmp_path / "backups").exists()
+
+
+@pytest.fixture
+def saver(tmp_path):
+    saver = AutoSaver(delay=0.2, backup_folder=str(tmp_path / "backups"), backups=2)
+    yield saver
+    saver.flush()
+
+
+def test_changes_are_debounced(saver, tmp_path):
+    target = str(tmp_path / "drugs.json")
+    written = []
+    for version in range(3):
+        saver.schedule(target, {"version": version}, lambda path, content: written.append(content))
+    assert saver.pending() == 1
+    assert not os.path.exists(target)
+
+    deadline = time.monotonic() + 5
+    while saver.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # Only the latest document was written, and only once
+    assert written == [{"version": 2}]
+    with open(target) as f:
+        assert json.loads(f.read()) == {"version": 2}
+
+
+def test_flush_writes_right_away(saver, tmp_path):
+    saver.delay = 60
+    target = tmp_path / "drugs.json"
+    target.write_text("{}")
+    saver.schedule(str(target), {"Adrenaline": {}})
+    saver.schedule(str(tmp_path / "state.json"), {"box": 1}, backup=False)
+
+    started = time.monotonic()
+    saver.flush()
+
+    assert time.monotonic() - started < 5
+    assert saver.pending() == 0
+    assert json.loads(target.read_text()) == {"Adrenaline": {}}
+    assert json.loads((tmp_path / "state.json").read_text()) == {"box": 1}
+    assert os.listdir(tmp_path / "backups") == ["drugs.json.1"]
+
+
+def test_a_failed_write_is_reported(saver, tmp_path):
+    saver.schedule(str(tmp_path / "missing" / "drugs.json"), {})
+    saver.flush()
+    assert "drugs.json" in saver.error
+
+    saver.schedule(str(tmp_path / "drugs.json"), {})
+    saver.flush()
+    assert saver.error is None
@@ -0,0 +1,101 @@
+import json
+import os
+
+import pytest
+
+from widgets.autosave import atomic_write, autosaver
+from widgets.cache import RegistryCache, registry_cache
+from widgets.storage import JsonStore
+
+
+@pytest.fixture
+def registry(tmp_path):
+    path = tmp_path / "drugs.json"
+    path.write_text(json.dumps({"Adrenaline": {}}))
+    return str(path)
+
+
+def test_unchanged_file_is_served_from_memory(registry):
+    cache = RegistryCache()
+    first = cache.load(registry)
+    assert cache.load(registry) is first
+    assert cache.version(registry) == cache.version(registry) == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "files": 1}
+
+
+def test_changed_mtime_or_size_is_reloaded(registry):
+    cache = RegistryCache()
+    cache.load(registry)
+
+    # Same size, only the modification time moved
+    stat = os.stat(registry)
+    with open(registry, "w") as f:
+        f.write(json.dumps({"Amiodarone": {}}))
+    os.utime(registry, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert cache.load(registry) == {"Amiodarone": {}}
+    assert cache.version(registry) == 2
+
+    # Same modification time, other size
+    stat = os.stat(registry)
+    with open(registry, "w") as f:
+        f.write(json.dumps({"Ketamine": {}}))
+    os.utime(registry, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.version(registry) == 3
+    assert cache.load(registry) == {"Ketamine": {}}
+    assert cache.misses == 3
+
+
+def test_put_is_served_until_settled(registry):
+    cache = RegistryCache()
+    cache.load(registry)
+    content = {"Fentanyl": {}}
+
+    cache.put(registry, content)
+    assert cache.pinned(registry)
+    assert cache.version(registry) == 2
+    # The older file on disk is not looked at while the document waits to be written
+    assert cache.load(registry) is content
+
+    atomic_write(registry, json.dumps(content))
+    cache.settle(registry, content)
+    assert not cache.pinned(registry)
+    # The file now holds what was served, neither the version nor the document change
+    assert cache.version(registry) == 2
+    assert cache.load(registry) is content
+    assert cache.misses == 1
+
+
+def test_settling_an_outdated_document_keeps_the_newer_one(registry):
+    cache = RegistryCache()
+    older, newer = {"Fentanyl": {}}, {"Ketamine": {}}
+    cache.put(registry, older)
+    cache.put(registry, newer)
+
+    atomic_write(registry, json.dumps(older))
+    cache.settle(registry, older)
+    assert cache.pinned(registry)
+    assert cache.load(registry) is newer
+
+    cache.invalidate()
+    assert cache.load(registry) is newer
+
+
+def test_store_writes_go_through_the_cache(tmp_path):
+    store = JsonStore(str(tmp_path / "drugs.json"), str(tmp_path / "situations.json"), str(tmp_path / "registry.snap"))
+    store.ensure()
+    store.load_drugs()
+    version = store.version()
+
+    store.upsert_drug("Adrenaline", {"unit": "mg", "min_dose": 1, "max_dose": 2})
+    assert registry_cache.pinned(store.drugs_file)
+    assert store.version() != version
+    assert "Adrenaline" in store.load_drugs()
+
+    store.flush()
+    assert not registry_cache.pinned(store.drugs_file)
+    with open(store.drugs_file) as f:
+        assert "Adrenaline" in json.loads(f.read())
+    misses = registry_cache.misses
+    assert "Adrenaline" in store.load_drugs()
+    assert registry_cache.misses == misses
+    assert autosaver.pending() == 0
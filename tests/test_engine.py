@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from widgets.constants import units
+from widgets.engine import QuizEngine
+from widgets.units import UNITS, conversion_factor, parse_unit
+
+DRUGS = {
+    "Adrenaline": {"unit": "mg", "min_dose": 0.5, "max_dose": 1},
+    "Fentanyl": {"unit": "µg/kgKG", "min_dose": 1, "max_dose": 2, "concentration": 0.05},
+    "Ketamine": {"unit": "mg/kgKG", "min_dose": "0,5", "max_dose": "2"},
+    "Propofol": {"unit": "mg/kgKG/h", "min_dose": 4, "max_dose": 12, "concentration": 10},
+    "Saline": {"unit": "ml/kgKG", "min_dose": 10, "max_dose": 20},
+    "Noradrenaline": {"unit": "µg/kgKG/h", "min_dose": 3, "max_dose": 60},
+}
+
+
+def test_parse_unit():
+    assert parse_unit("µg/kgKG/h") == ("µg/kgKG/h", "mass", 1e-3, True, True)
+    assert parse_unit("ml") == ("ml", "volume", 1.0, False, False)
+    with pytest.raises(ValueError):
+        parse_unit("g")
+
+
+def test_conversion_factor():
+    assert conversion_factor(UNITS["µg"], UNITS["mg"]) == 1.0
+    assert conversion_factor(UNITS["ml"], UNITS["mg"], 10) == 10
+    assert conversion_factor(UNITS["mg"], UNITS["ml"], 10) == 0.1
+    assert conversion_factor(UNITS["ml"], UNITS["mg"]) is None
+    assert conversion_factor(UNITS["mg/kgKG/h"], UNITS["mg"]) is None
+
+
+@pytest.mark.parametrize(
+    "drug, weight, dose, unit, correct",
+    [
+        ("Adrenaline", 70, "0.5", "mg", True),
+        ("Adrenaline", 70, "500", "µg", True),
+        ("Adrenaline", 70, "1001", "µg", False),
+        # Per kg doses are answered as the amount for the patient
+        ("Ketamine", 80, "40", "mg", True),
+        ("Ketamine", 80, "0,2", "mg/kgKG", False),
+        ("Fentanyl", 100, "150", "µg", True),
+        # 150 µg at 0.05 mg/ml
+        ("Fentanyl", 100, "3", "ml", True),
+        ("Propofol", 50, "8", "mg/kgKG/h", True),
+        ("Propofol", 50, "20", "mg/kgKG/h", False),
+        # A rate cannot be answered as an amount
+        ("Propofol", 50, "400", "mg", False),
+        ("Saline", 60, "900", "ml", True),
+        ("Saline", 60, "900", "mg", False),
+        ("Adrenaline", 70, "half", "mg", False),
+    ],
+)
+def test_grade(drug, weight, dose, unit, correct):
+    assert QuizEngine(DRUGS).grade(drug, weight, dose, unit).correct is correct
+
+
+def test_grade_many_matches_grade():
+    engine = QuizEngine(DRUGS)
+    rng = random.Random(0)
+    answers = []
+    for drug in DRUGS:
+        for unit in units + ["g", "mg/h"]:
+            weight = rng.randint(40, 160)
+            low, high = engine.dose_range(drug, weight)
+            for dose in (low, high, (low + high) / 2, low * 0.9, high * 1.1, rng.uniform(0, 3 * high), "", "x"):
+                answers.append((drug, weight, str(dose), unit))
+
+    batch = engine.grade_many(answers)
+    for answer, row in zip(answers, batch):
+        result = engine.grade(*answer)
+        assert engine.names[row["drug"]] == result.drug
+        assert row["min_dose"] == pytest.approx(result.min_dose)
+        assert row["max_dose"] == pytest.approx(result.max_dose)
+        assert (bool(row["unit_ok"]), bool(row["dose_ok"]), bool(row["correct"])) == (
+            result.unit_ok,
+            result.dose_ok,
+            result.correct,
+        ), answer
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from widgets import exam
+from widgets.engine import QuizEngine
+from widgets.exam import Exam
+from widgets.journal import AttemptJournal
+
+DRUGS = {
+    "Adrenaline": {"unit": "mg", "min_dose": 0.5, "max_dose": 1},
+    "Atropine": {"unit": "mg", "min_dose": 0.5, "max_dose": 3},
+    "Ketamine": {"unit": "mg/kgKG", "min_dose": 0.5, "max_dose": 2},
+    "Fentanyl": {"unit": "µg/kgKG", "min_dose": 1, "max_dose": 2, "concentration": 0.05},
+}
+SITUATIONS = [["Anaphylaxis", ["Adrenaline"]], ["Bradycardia", ["Atropine", "Adrenaline"]], ["Analgesia", ["Fentanyl"]]]
+
+
+@pytest.fixture
+def engine():
+    return QuizEngine(DRUGS, SITUATIONS)
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    journal = AttemptJournal(str(tmp_path / "attempts.jsonl"), str(tmp_path / "attempts_summary.json"))
+    monkeypatch.setattr(exam, "get_journal", lambda: journal)
+    yield journal
+    journal.close()
+
+
+def test_question_set_is_fixed_by_the_seed(engine):
+    first = Exam(7, drug_questions=3, situation_questions=2, engine=engine)
+    assert first.questions == Exam(7, drug_questions=3, situation_questions=2, engine=engine).questions
+    assert first.questions != Exam(8, drug_questions=3, situation_questions=2, engine=engine).questions
+    # No repetition while the registry is large enough
+    assert sorted(question.kind for question in first.questions) == ["drug"] * 3 + ["situation"] * 2
+    assert len({question.item for question in first.questions}) == 5
+    assert len(Exam(7, drug_questions=10, situation_questions=0, engine=engine).questions) == 10
+
+
+def test_time_limit(engine):
+    timed = Exam(1, drug_questions=4, situation_questions=0, time_limit=60, engine=engine)
+    # current() asks the clock itself
+    start = time.monotonic()
+    timed.start(now=start)
+    assert timed.remaining(now=start + 30) == 30
+    assert timed.answer(("1", "mg"), now=start + 10) is timed.questions[1]
+    assert timed.latencies[0] == 10
+    assert timed.remaining(now=start + 61) == 0
+    # Out of time, the questions left are not shown any more
+    timed.start(now=start - 61)
+    assert timed.current() is None
+    assert timed.answer(("1", "mg")) is None
+
+
+def test_grading_matches_single_answers(engine, journal):
+    timed = Exam(3, drug_questions=4, situation_questions=3, engine=engine)
+    timed.start(now=0)
+    for i, question in enumerate(timed.questions):
+        if i == 1:
+            answer = None
+        elif question.kind == "drug":
+            low, high = engine.dose_range(question.item, question.weight)
+            answer = (f"{low if i % 2 else high * 2:g}", engine.correct_units[engine.index[question.item]])
+        else:
+            answer = question.expected[:1]
+        if answer is None:
+            timed.position += 1
+        else:
+            timed.answer(answer, now=i + 1)
+
+    rows = timed.grade()
+    journal.flush()
+
+    for i, (question, row) in enumerate(zip(timed.questions, rows)):
+        answer = timed.answers[i]
+        if answer is None:
+            assert (row.correct, row.error) == (False, "Not answered")
+        elif question.kind == "drug":
+            assert row.correct == engine.grade(question.item, question.weight, *answer).correct
+        else:
+            assert row.correct == engine.grade_situation(question.expected, answer).correct
+    assert 0 < timed.score == sum(row.correct for row in rows) < len(rows) - 1
+    # Unanswered questions are not journaled
+    attempts = sum(entry[0] for kind in ("drugs", "situations") for entry in journal.aggregates[kind].values())
+    assert attempts == len(rows) - 1
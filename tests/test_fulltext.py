@@ -0,0 +1,89 @@
+import math
+import random
+
+import pytest
+
+from widgets.fulltext import K1, B, FullTextIndex, tokenize
+
+DOCUMENTS = [
+    "Anaphylaxis with hypotension after antibiotics",
+    "Anaphylactic shock in a child",
+    "Cardiac arrest, shockable rhythm",
+    "Cardiac arrest, asystole",
+    "Bradycardia with hypotension",
+    "Severe pain after trauma",
+    "Status epilepticus",
+    "Status epilepticus in a child",
+]
+
+
+def bm25(documents, terms):
+    # Straight from the formula, over the whole collection every time
+    tokenized = {document: tokenize(document) for document in documents}
+    average = sum(map(len, tokenized.values())) / len(documents)
+    scores = {}
+    for term in set(terms):
+        containing = [document for document, tokens in tokenized.items() if term in tokens]
+        if not containing:
+            continue
+        idf = math.log(1 + (len(documents) - len(containing) + 0.5) / (len(containing) + 0.5))
+        for document in containing:
+            frequency = tokenized[document].count(term)
+            norm = K1 * (1 - B + B * len(tokenized[document]) / average)
+            scores[document] = scores.get(document, 0.0) + idf * frequency * (K1 + 1) / (frequency + norm)
+    return scores
+
+
+def index_of(documents):
+    index = FullTextIndex()
+    for document in documents:
+        index.add(document)
+    return index
+
+
+@pytest.mark.parametrize(
+    "query", ["hypotension", "cardiac arrest", "child shock", "status", "trauma pain pain", "nothing"]
+)
+def test_scores_follow_bm25(query):
+    results = index_of(DOCUMENTS).search(query, limit=None, prefix=False)
+    expected = bm25(DOCUMENTS, tokenize(query))
+    assert dict(results) == pytest.approx(expected)
+    assert [score for _, score in results] == sorted(expected.values(), reverse=True)
+
+
+def test_rarer_and_repeated_terms_rank_higher():
+    index = index_of(DOCUMENTS + ["Pain, pain and more pain"])
+    assert index.search("pain", limit=1, prefix=False)[0][0] == "Pain, pain and more pain"
+    # "asystole" occurs once, "cardiac" twice
+    assert index.search("cardiac asystole", limit=1)[0][0] == "Cardiac arrest, asystole"
+
+
+def test_last_word_matches_as_a_prefix():
+    index = index_of(DOCUMENTS)
+    assert {document for document, _ in index.search("anaph", limit=None)} == set(DOCUMENTS[:2])
+    assert index.search("anaph", prefix=False) == []
+    # A finished word is not a prefix any more
+    assert index.search("status ", limit=None) == index.search("status", limit=None, prefix=False)
+
+
+def test_incremental_changes_match_a_fresh_index():
+    rng = random.Random(5)
+    index = index_of(DOCUMENTS)
+    documents = list(DOCUMENTS)
+    for step in range(40):
+        if documents and rng.random() < 0.4:
+            document = documents.pop(rng.randrange(len(documents)))
+            index.remove(document)
+        else:
+            document = f"{rng.choice(DOCUMENTS)} {step}"
+            documents.append(document)
+            index.add(document)
+        fresh = index_of(documents)
+        for query in ("cardiac", "child", "status epilepticus", "shock"):
+            assert dict(index.search(query, limit=None)) == pytest.approx(dict(fresh.search(query, limit=None)))
+
+    assert index.sync(DOCUMENTS)
+    assert not index.sync(DOCUMENTS)
+    restored = FullTextIndex.from_json(index.to_json())
+    assert restored.lengths == index_of(DOCUMENTS).lengths
+    assert restored.search("shock", limit=None) == index.search("shock", limit=None)
@@ -0,0 +1,43 @@
+import pytest
+from PyQt6.QtWidgets import QApplication
+
+from widgets.helpers import CheckableComboBox
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+def test_items_added_while_the_popup_is_shown_appear_in_it(app):
+    combo = CheckableComboBox()
+    combo.resize(400, 30)
+    combo.addItems(["Adrenaline", "Atropine"], [True])
+    combo.show()
+    combo.showPopup()
+    app.processEvents()
+
+    combo.addItems(["Fentanyl", "Ketamine"], [False, True])
+    app.processEvents()
+
+    view = combo.view()
+    for row in range(4):
+        rect = view.visualRect(combo.model().index(row, 0))
+        assert view.indexAt(rect.center()).row() == row
+    assert combo.count() == 4
+    assert combo.currentData() == ["Adrenaline", "Ketamine"]
+    assert combo.lineEdit().text() == "Adrenaline, Ketamine"
+    combo.hidePopup()
+
+
+def test_checked_data_follows_toggles_and_restores(app):
+    combo = CheckableComboBox()
+    combo.resize(400, 30)
+    combo.addItems(["Adrenaline", "Atropine", "Fentanyl"])
+
+    combo.setCheckedData(["Fentanyl", "Adrenaline", "Unknown"])
+    assert combo.currentData() == ["Adrenaline", "Fentanyl"]
+
+    combo._set_checked(0, False)
+    combo._set_checked(1, True)
+    assert combo.currentData() == ["Atropine", "Fentanyl"]
@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from widgets.engine import QuizEngine
+from widgets.index import SituationIndex
+from widgets.storage import JsonStore
+
+INFO = {"unit": "mg", "min_dose": 1, "max_dose": 2}
+
+
+def assert_matches_scan(index, situations):
+    lookup = dict(situations)
+    for description, drugs in situations:
+        assert sorted(index.drugs(description)) == sorted(drugs)
+    for drug in {drug for _, drugs in situations for drug in drugs} | {"Unknown"}:
+        assert index.situations_using(drug) == [description for description, drugs in situations if drug in drugs]
+    rng = random.Random(0)
+    names = sorted({drug for drugs in lookup.values() for drug in drugs})
+    for description, drugs in situations:
+        answer = rng.sample(names, rng.randint(0, len(names)))
+        missed, extra, score = index.compare(drugs, answer)
+        assert sorted(missed) == sorted(set(drugs) - set(answer))
+        assert sorted(extra) == sorted(set(answer) - set(drugs))
+        union = set(drugs) | set(answer)
+        assert score == pytest.approx(len(set(drugs) & set(answer)) / len(union) if union else 1.0)
+
+
+def test_index_matches_a_scan():
+    rng = random.Random(1)
+    drugs = [f"Drug {i}" for i in range(80)]
+    situations = [[f"Situation {i}", rng.sample(drugs, rng.randint(1, 6))] for i in range(200)]
+    # Referenced but no longer registered, still reported
+    situations.append(["Orphaned", ["Drug 3", "Withdrawn"]])
+    index = SituationIndex(drugs, situations)
+    assert_matches_scan(index, situations)
+
+
+@pytest.mark.parametrize("snapshot", [False, True], ids=["lists", "snapshot"])
+def test_index_follows_store_changes(tmp_path, snapshot):
+    store = JsonStore(str(tmp_path / "drugs.json"), str(tmp_path / "situations.json"), str(tmp_path / "registry.snap"))
+    store.ensure()
+    for name in ("Adrenaline", "Atropine", "Amiodarone", "Fentanyl"):
+        store.upsert_drug(name, INFO)
+    changes = [
+        lambda: store.upsert_situation("Anaphylaxis", ["Adrenaline"]),
+        lambda: store.upsert_situation("Cardiac arrest", ["Adrenaline", "Amiodarone"]),
+        lambda: store.upsert_situation("Bradycardia", ["Atropine", "Adrenaline"]),
+        lambda: store.upsert_situation("Analgesia", ["Fentanyl"]),
+        lambda: store.upsert_situation("Anaphylactic shock", ["Adrenaline"], previous="Anaphylaxis"),
+        lambda: store.upsert_drug("Epinephrine", INFO, previous="Adrenaline"),
+        lambda: store.upsert_situation("Cardiac arrest", ["Epinephrine", "Amiodarone", "Atropine"]),
+        lambda: store.delete_situation("Bradycardia"),
+        lambda: store.delete_drug("Fentanyl"),
+    ]
+    for change in changes:
+        change()
+        if snapshot:
+            store.flush()
+        engine = QuizEngine.from_store(store)
+        assert (engine.snapshot is not None) == snapshot
+        assert_matches_scan(engine.situation_index, store.load_situations())
+        engine.close()
+    store.flush()
@@ -0,0 +1,82 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from widgets.journal import AttemptJournal
+
+
+@pytest.fixture
+def files(tmp_path):
+    return str(tmp_path / "attempts.jsonl"), str(tmp_path / "attempts_summary.json")
+
+
+def record(item, correct, latency):
+    return json.dumps({"kind": "situations", "item": item, "answer": [], "correct": correct, "latency": latency})
+
+
+def test_incomplete_last_record_is_dropped(files):
+    log_file, summary_file = files
+    with open(log_file, "w") as f:
+        f.write(record("Anaphylaxis", True, 2.0) + "\n" + record("Anaphylaxis", False, 4.0) + "\n")
+        f.write(record("Asystole", True, 1.0)[:20])
+
+    journal = AttemptJournal(log_file, summary_file)
+    assert journal.stats("situations") == {"Anaphylaxis": (2, 0.5, 3.0)}
+
+    # The next record starts on a line of its own
+    journal.record_situation("Asystole", ["Adrenaline"], True, 5.0)
+    journal.close()
+    with open(log_file) as f:
+        assert [json.loads(line)["item"] for line in f] == ["Anaphylaxis", "Anaphylaxis", "Asystole"]
+
+    os.remove(summary_file)
+    reopened = AttemptJournal(log_file, summary_file)
+    assert reopened.stats("situations") == {"Anaphylaxis": (2, 0.5, 3.0), "Asystole": (1, 1.0, 5.0)}
+
+
+def test_close_writes_everything_and_the_summary(files):
+    log_file, summary_file = files
+    journal = AttemptJournal(log_file, summary_file)
+    result = SimpleNamespace(drug="Adrenaline", weight=70, dose=0.5, unit="mg", correct=True)
+    for latency in (1.0, 2.0, 3.0):
+        journal.record_drug(result, latency)
+    journal.record_situation("Asystole", ["Adrenaline"], False, 4.0)
+    journal.close()
+
+    with open(log_file) as f:
+        assert len(f.readlines()) == 4
+    with open(summary_file) as f:
+        summary = json.loads(f.read())
+    assert summary["offset"] == os.path.getsize(log_file)
+    assert summary["aggregates"]["drugs"] == {"Adrenaline": [3, 3, 6.0]}
+
+    # Opening again starts from the summary, there is no tail left to read
+    reopened = AttemptJournal(log_file, summary_file)
+    assert reopened.stats("drugs") == {"Adrenaline": (3, 1.0, 2.0)}
+    assert reopened.stats("situations") == {"Asystole": (1, 0.0, 4.0)}
+
+
+def test_flush_waits_for_the_writer(files):
+    log_file, summary_file = files
+    journal = AttemptJournal(log_file, summary_file)
+    for i in range(50):
+        journal.record_situation("Asystole", [], i % 2 == 0, 1.0)
+    journal.flush()
+    with open(log_file) as f:
+        assert len(f.readlines()) == 50
+    journal.close()
+
+
+def test_replaced_log_is_read_from_the_start(files):
+    log_file, summary_file = files
+    journal = AttemptJournal(log_file, summary_file)
+    for _ in range(3):
+        journal.record_situation("Asystole", [], True, 1.0)
+    journal.close()
+
+    # Shorter than the offset the summary covers
+    with open(log_file, "w") as f:
+        f.write(record("Anaphylaxis", False, 2.0) + "\n")
+    assert AttemptJournal(log_file, summary_file).stats("situations") == {"Anaphylaxis": (1, 0.0, 2.0)}
@@ -0,0 +1,49 @@
+import pytest
+
+from widgets import pipeline
+from widgets.engine import QuizEngine
+from widgets.pipeline import QuestionPipeline
+
+INFO = {"unit": "mg", "min_dose": 1, "max_dose": 2}
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    drugs = {f"Drug {i}": INFO for i in range(50)}
+    situations = [[f"Situation {i}", [f"Drug {i}", f"Drug {i + 1}"]] for i in range(20)]
+    engine = QuizEngine(drugs, situations)
+    monkeypatch.setattr(pipeline, "get_engine", lambda: engine)
+    return engine
+
+
+def session(seed, order):
+    questions = QuestionPipeline(seed)
+    return [questions.next(kind) for kind in order]
+
+
+def test_same_seed_replays_the_session(engine):
+    order = ["drugs", "situations", "weights"] * 20
+    assert session(1234, order) == session(1234, order)
+
+    # Each kind draws from its own generator, mixing the quizzes differently does not matter
+    mixed = ["weights"] * 20 + ["situations"] * 20 + ["drugs"] * 20
+    replayed = session(1234, mixed)
+    for kind in QuestionPipeline.KINDS:
+        first = [question for question, asked in zip(session(1234, order), order) if asked == kind]
+        assert first == [question for question, asked in zip(replayed, mixed) if asked == kind]
+
+
+def test_other_seed_gives_another_session(engine):
+    order = ["drugs", "situations", "weights"] * 20
+    assert session(1234, order) != session(4321, order)
+
+
+def test_prepared_questions_are_dropped_with_the_registry(engine, monkeypatch):
+    questions = QuestionPipeline(1)
+    questions.fill("drugs")
+    assert len(questions.queues["drugs"]) == questions.depth
+
+    replacement = QuizEngine({"Adrenaline": INFO})
+    monkeypatch.setattr(pipeline, "get_engine", lambda: replacement)
+    assert {questions.next_drug().drug for _ in range(10)} == {"Adrenaline"}
+    assert questions.next_situation() is None
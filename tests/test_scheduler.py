@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from widgets.autosave import autosaver
+from widgets.scheduler import INTERVALS, ReviewScheduler
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    scheduler = ReviewScheduler("drugs", str(tmp_path / "review_drugs.json"))
+    scheduler.sync(["Adrenaline", "Atropine", "Fentanyl"])
+    return scheduler
+
+
+def test_boxes_move_up_on_right_and_back_on_wrong_answers(scheduler):
+    for box in range(1, len(INTERVALS) + 2):
+        scheduler.record("Adrenaline", True, now=1000)
+        assert scheduler.state["Adrenaline"] == (
+            min(box, len(INTERVALS) - 1),
+            1000 + INTERVALS[min(box, len(INTERVALS) - 1)],
+        )
+
+    scheduler.record("Adrenaline", False, now=2000)
+    assert scheduler.state["Adrenaline"] == (0, 2000 + INTERVALS[0])
+
+
+def test_items_come_due_earliest_first(scheduler):
+    # New items are due right away
+    assert scheduler.next() in {"Adrenaline", "Atropine", "Fentanyl"}
+
+    scheduler.record("Adrenaline", True, now=1000)
+    scheduler.record("Atropine", False, now=1000)
+    scheduler.record("Fentanyl", True, now=1000)
+    scheduler.record("Fentanyl", True, now=1000)
+    order = []
+    for _ in range(3):
+        key = scheduler.next()
+        order.append(key)
+        # Answered again much later, it goes to the back
+        scheduler.record(key, True, now=10**9)
+    assert order == ["Atropine", "Adrenaline", "Fentanyl"]
+
+
+def test_answered_item_is_not_served_again_from_its_old_entry(scheduler):
+    served = []
+    for _ in range(3):
+        key = scheduler.next()
+        served.append(key)
+        scheduler.record(key, True, now=1000)
+    assert sorted(served) == ["Adrenaline", "Atropine", "Fentanyl"]
+
+    # Many answers to the same item leave outdated entries behind, they are skipped and pruned
+    for _ in range(100):
+        scheduler.record("Atropine", False, now=1000)
+    assert scheduler.next() == "Atropine"
+    assert len(scheduler._heap) <= 2 * len(scheduler.state) + 16
+    scheduler.record("Atropine", True, now=3000)
+    assert scheduler.next() != "Atropine"
+
+
+def test_sync_forgets_removed_items_and_state_survives_a_restart(scheduler, tmp_path):
+    scheduler.record("Adrenaline", True, now=1000)
+    scheduler.record("Atropine", True, now=1000)
+    scheduler.sync(["Adrenaline", "Ketamine"])
+    assert set(scheduler.state) == {"Adrenaline", "Ketamine"}
+    assert scheduler.next() == "Ketamine"
+
+    scheduler.flush()
+    autosaver.flush()
+    with open(scheduler.state_file) as f:
+        assert set(json.loads(f.read())) == {"Adrenaline", "Ketamine"}
+    restarted = ReviewScheduler("drugs", scheduler.state_file)
+    assert restarted.state == scheduler.state
+    assert restarted.next() == "Ketamine"
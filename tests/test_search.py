@@ -0,0 +1,107 @@
+import random
+import re
+
+import pytest
+
+from widgets.search import SearchIndex
+
+NAMES = [
+    "Adrenaline",
+    "Noradrenaline",
+    "Adrénaline",
+    "Äthanol 96%",
+    "Ésmolol",
+    "Atropine",
+    "Amiodarone",
+    "Natriumhydrogencarbonat 8,4%",
+    "Ca-Glukonat 10%",
+    "Glucose 40%",
+    "Glukose 5%",
+    "Midazolam",
+    "Ketamine S",
+    "ß-Acetyldigoxin",
+]
+SYLLABLES = ["ka", "me", "dol", "ri", "zan", "tro", "pin", "äl", "é", "xo", "lam", "fen", "ta", "nyl"]
+
+
+def fold(text):
+    return " ".join(re.findall(r"\w+", text.casefold()))
+
+
+def naive(names, query):
+    # Short queries only match the start of a word, longer ones anywhere
+    query = fold(query)
+    if len(query) < 3:
+        return {name for name in names if any(word.startswith(query) for word in fold(name).split(" "))}
+    return {name for name in names if query in fold(name)}
+
+
+@pytest.fixture(scope="module")
+def names():
+    rng = random.Random(3)
+    generated = {
+        " ".join("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))).capitalize() for _ in range(rng.randint(1, 2)))
+        for _ in range(2000)
+    }
+    return NAMES + sorted(generated - set(NAMES))
+
+
+QUERIES = [
+    "a",
+    "ä",
+    "É",
+    "ß",
+    "ad",
+    "Gl",
+    "8",
+    "adr",
+    "ADREN",
+    "drenal",
+    "rénal",
+    "äth",
+    "glu",
+    "ko",
+    "4%",
+    "zol",
+    "Ketamine S",
+]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_results_match_a_scan(names, query):
+    index = SearchIndex(names)
+    results = index.search(query)
+    assert len(results) == len(set(results))
+    assert set(results) == naive(names, query)
+
+    # Names starting with the query come first, in order
+    folded = fold(query)
+    starting = [name for name in results if fold(name).startswith(folded)]
+    assert results[: len(starting)] == sorted(starting, key=fold)
+    assert index.search(query, limit=5) == results[:5]
+
+
+def test_random_queries_match_a_scan(names):
+    rng = random.Random(4)
+    index = SearchIndex(names)
+    for _ in range(300):
+        name = fold(rng.choice(names))
+        start = rng.randrange(len(name))
+        query = name[start : start + rng.randint(1, 6)].strip()
+        if len(query) >= 3 or query.isalnum():
+            assert set(index.search(query)) == naive(names, query), query
+
+
+def test_typos_fall_back_to_fuzzy_matches():
+    index = SearchIndex(NAMES)
+    assert naive(NAMES, "Amiodaron3") == set()
+    assert index.search("Amiodaron3")[0] == "Amiodarone"
+    assert index.search("") == NAMES
+    assert index.search("  ", limit=2) == NAMES[:2]
+
+
+def test_names_starting_with_the_query_come_in_order():
+    # The second word of "Ab Aa" sorts before "Aa", it must not pull the name ahead
+    index = SearchIndex(["Ab Aa", "Aa"])
+    assert index.search("a", limit=1) == ["Aa"]
+    assert index.search("a") == ["Aa", "Ab Aa"]
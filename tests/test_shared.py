@@ -0,0 +1,89 @@
+import os
+import stat
+
+import pytest
+
+from widgets import autosave, shared
+from widgets.errors import RegistryConflict
+from widgets.shared import SharedStore
+
+INFO = {"unit": "mg", "min_dose": 1, "max_dose": 2}
+
+
+@pytest.fixture
+def station(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared, "COMPACT_AFTER", 5)
+    folder = str(tmp_path / "shared")
+
+    def station():
+        store = SharedStore(folder, str(tmp_path / "drugs.json"), str(tmp_path / "situations.json"))
+        store.ensure()
+        return store
+
+    return station
+
+
+def logs(store):
+    return sorted(name for name in os.listdir(store.folder) if name.startswith("changes-"))
+
+
+def test_compaction_keeps_the_registry(station):
+    first, second = station(), station()
+    for i in range(12):
+        first.upsert_drug(f"Drug {i}", INFO)
+    with first.transaction():
+        first.upsert_situation("Anaphylaxis", ["Drug 0", "Drug 1"])
+        first.upsert_situation("Asystole", ["Drug 2"])
+    first.upsert_situation("Cardiac arrest", ["Drug 0"], previous="Anaphylaxis")
+    first.delete_drug("Drug 11")
+
+    # Folded into a snapshot every 5 changes, only the current log and the one before it are kept
+    assert first.generation == 15
+    assert logs(first) == ["changes-10.jsonl", "changes-15.jsonl"]
+    assert first.applied == 16
+
+    # A station left behind on a removed log starts over from the snapshot, a new one from scratch
+    for other in (second, station()):
+        other.pull()
+        assert other.applied == first.applied
+        assert other.load_drugs() == first.load_drugs()
+        assert other.load_situations() == [["Cardiac arrest", ["Drug 0"]], ["Asystole", ["Drug 2"]]]
+    assert "Drug 11" not in second.load_drugs()
+
+
+def test_station_follows_the_log_into_the_next_generation(station):
+    first, second = station(), station()
+    for i in range(4):
+        first.upsert_drug(f"Drug {i}", INFO)
+    second.pull()
+    for i in range(4, 7):
+        first.upsert_drug(f"Drug {i}", INFO)
+
+    assert first.generation == 5
+    assert second.pull()
+    assert second.generation == 5
+    assert second.load_drugs() == first.load_drugs()
+
+
+def test_rename_onto_an_existing_name_is_refused(station):
+    first = station()
+    first.upsert_drug("Adrenaline", INFO)
+    first.upsert_drug("Atropine", INFO)
+    with pytest.raises(RegistryConflict):
+        first.upsert_drug("Atropine", INFO, previous="Adrenaline")
+
+    assert first.applied == 2
+    assert sorted(station().load_drugs()) == ["Adrenaline", "Atropine"]
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permissions")
+def test_snapshot_is_readable_by_the_other_stations(station):
+    first = station()
+    for i in range(6):
+        first.upsert_drug(f"Drug {i}", INFO)
+
+    # Written anew by the compaction, it gets the same mode as the change logs next to it
+    expected = 0o666 & ~autosave._UMASK
+    assert stat.S_IMODE(os.stat(first.snapshot_file).st_mode) == expected
+    for name in logs(first):
+        assert stat.S_IMODE(os.stat(os.path.join(first.folder, name)).st_mode) == expected
@@ -0,0 +1,90 @@
+import re
+
+import pytest
+
+from widgets import helpers, sheets
+from widgets.engine import QuizEngine, make_float
+from widgets.helpers import check_answer
+from widgets.sheets import make_sheets, render_sheet
+
+DRUGS = {
+    "Adrenaline": {"unit": "mg", "min_dose": 0.5, "max_dose": 1},
+    "Amiodarone": {"unit": "mg", "min_dose": 300, "max_dose": 300},
+    "Ketamine": {"unit": "mg/kgKG", "min_dose": "0,5", "max_dose": "2"},
+    "Fentanyl": {"unit": "µg/kgKG", "min_dose": 1, "max_dose": 2, "concentration": 0.05},
+    "Propofol": {"unit": "mg/kgKG/h", "min_dose": 4, "max_dose": 12, "concentration": 10},
+    "Saline": {"unit": "ml/kgKG", "min_dose": 10, "max_dose": 20},
+}
+# Unit each drug is answered in, and whether the registered dose is multiplied by the weight for it
+ANSWERED = {
+    "Adrenaline": ("mg", False),
+    "Amiodarone": ("mg", False),
+    "Ketamine": ("mg", True),
+    "Fentanyl": ("µg", True),
+    "Propofol": ("mg/kgKG/h", False),
+    "Saline": ("ml", True),
+}
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = QuizEngine(DRUGS)
+    monkeypatch.setattr(helpers, "get_engine", lambda: engine)
+    monkeypatch.setattr(sheets, "get_engine", lambda: engine)
+    return engine
+
+
+def accepted(question, dose):
+    message = check_answer(question.drug, question.weight, f"{dose!r}", question.unit)
+    return message == "Correct dose!"
+
+
+def test_answer_keys_are_graded_like_the_quiz(engine):
+    drawn = [question for sheet in make_sheets(20, 11, questions=20) for question in sheet.questions]
+    assert {question.drug for question in drawn} == set(DRUGS)
+    for question in drawn:
+        # The registered range, times the weight where the dose is per kg and answered for the patient
+        unit, per_patient = ANSWERED[question.drug]
+        scale = question.weight if per_patient else 1
+        info = DRUGS[question.drug]
+        assert question.unit == unit
+        assert question.min_dose == pytest.approx(make_float(info["min_dose"]) * scale)
+        assert question.max_dose == pytest.approx(make_float(info["max_dose"]) * scale)
+        assert accepted(question, question.min_dose)
+        assert accepted(question, question.max_dose)
+        assert not accepted(question, question.min_dose * 0.99)
+        assert not accepted(question, question.max_dose * 1.01)
+
+
+def test_answer_key_prints_the_range(engine):
+    sheet = make_sheets(1, 3, questions=len(DRUGS) * 3)[0]
+    page, key = render_sheet(sheet)
+    lines = re.findall(rb"\((\d+\. .*?)\) Tj", key)
+    assert len(lines) == len(sheet.questions)
+    for line, question in zip(lines, sheet.questions):
+        text = line.decode("cp1252")
+        assert f"{question.drug}, patient of {question.weight} kg:" in text
+        assert text.endswith(f" {question.unit}")
+        if question.min_dose == question.max_dose:
+            assert f":  {question.min_dose:.4g} " in text
+        else:
+            assert f":  {question.min_dose:.4g} to {question.max_dose:.4g} " in text
+    assert page.count(b"____________ ") == len(sheet.questions)
+
+
+def test_same_seed_prints_the_same_sheets_in_any_number_of_processes(engine, tmp_path):
+    assert make_sheets(3, 5) == make_sheets(3, 5)
+    assert make_sheets(3, 5) != make_sheets(3, 6)
+
+    serial = sheets.generate(60, 5, str(tmp_path / "serial"), jobs=1)
+    parallel = sheets.generate(60, 5, str(tmp_path / "parallel"), jobs=2)
+    for serial_path, parallel_path in zip(serial, parallel):
+        with open(serial_path, "rb") as f, open(parallel_path, "rb") as g:
+            assert f.read() == g.read()
+
+
+def test_limits(engine):
+    with pytest.raises(ValueError):
+        make_sheets(1, 1, questions=sheets.MAX_QUESTIONS + 1)
+    with pytest.raises(ValueError):
+        make_sheets(1, 1, engine=QuizEngine({}))
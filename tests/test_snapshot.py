@@ -0,0 +1,98 @@
+import json
+import random
+
+import pytest
+
+from widgets.autosave import atomic_write
+from widgets.engine import QuizEngine
+from widgets.snapshot import RegistrySnapshot, compile_snapshot, load_snapshot
+
+DRUGS = {
+    "Noradrenaline": {"unit": "µg/kgKG/h", "min_dose": 3, "max_dose": 60},
+    "Adrenaline": {"unit": "mg", "min_dose": "0,5", "max_dose": 1},
+    "Fentanyl": {"unit": "µg/kgKG", "min_dose": 1, "max_dose": 2, "concentration": 0.05},
+    "Ketamine": {"unit": "mg/kgKG", "min_dose": 0.5, "max_dose": 2, "concentration": ""},
+}
+SITUATIONS = [
+    ["Anaphylaxis", ["Adrenaline", "Ketamine"]],
+    ["Septic shock", ["Noradrenaline"]],
+    # A drug that is no longer registered, and a description given twice
+    ["Analgesia", ["Fentanyl", "Metamizole"]],
+    ["Anaphylaxis", ["Adrenaline"]],
+]
+SOURCES = ((1, 2), (3, 4))
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    file_path = str(tmp_path / "registry.snap")
+    atomic_write(file_path, compile_snapshot(DRUGS, SITUATIONS, SOURCES))
+    snapshot = RegistrySnapshot(file_path)
+    yield snapshot
+    snapshot.close()
+
+
+def test_round_trip(snapshot):
+    assert snapshot.sources == SOURCES
+    assert list(snapshot.names) == list(DRUGS)
+    assert snapshot.names[-1] == "Ketamine"
+    assert list(snapshot.all_names) == list(DRUGS) + ["Metamizole"]
+    assert {name: snapshot.index[name] for name in DRUGS} == {name: i for i, name in enumerate(DRUGS)}
+    assert "Metamizole" not in snapshot.index
+    assert snapshot.index.get("Propofol") is None
+    assert [(description, drugs) for description, drugs in snapshot.situations] == [
+        (description, drugs) for description, drugs in SITUATIONS
+    ]
+    # The last of repeated descriptions wins, as in a dict
+    assert snapshot.situation_lookup["Anaphylaxis"] == ["Adrenaline"]
+    assert len(random.Random(0).sample(snapshot.names, 2)) == 2
+
+
+def test_engine_from_snapshot_grades_alike(snapshot):
+    parsed = QuizEngine(DRUGS, SITUATIONS)
+    mapped = QuizEngine.from_snapshot(snapshot)
+    assert list(mapped.concentrations) == parsed.concentrations
+    answers = [
+        (drug, weight, dose, unit)
+        for drug in DRUGS
+        for weight in (40, 95)
+        for dose in ("0.5", "40", "120", "3,5")
+        for unit in ("mg", "µg", "ml", "mg/kgKG", "µg/kgKG/h")
+    ]
+    assert [mapped.grade(*answer) for answer in answers] == [parsed.grade(*answer) for answer in answers]
+    assert (mapped.grade_many(answers) == parsed.grade_many(answers)).all()
+    assert mapped.situation_index.situations_using("Adrenaline") == parsed.situation_index.situations_using(
+        "Adrenaline"
+    )
+
+
+def test_closed_snapshot_can_be_replaced(snapshot, tmp_path):
+    engine = QuizEngine.from_snapshot(snapshot)
+    engine.grade_many([("Adrenaline", 70, "1", "mg")])
+    engine.close()
+    with pytest.raises(ValueError):
+        list(snapshot.names)
+    atomic_write(str(tmp_path / "registry.snap"), b"")
+
+
+def test_load_compiles_again_when_the_registry_changed(tmp_path):
+    drugs_file, situations_file = str(tmp_path / "drugs.json"), str(tmp_path / "situations.json")
+    snapshot_file = str(tmp_path / "registry.snap")
+
+    def load(file_path):
+        with open(file_path, "r") as f:
+            return json.loads(f.read())
+
+    atomic_write(drugs_file, json.dumps(DRUGS))
+    atomic_write(situations_file, json.dumps(SITUATIONS))
+    first = load_snapshot(snapshot_file, drugs_file, situations_file, load)
+    assert list(first.names) == list(DRUGS)
+    first.close()
+
+    atomic_write(drugs_file, json.dumps({"Propofol": {"unit": "mg/kgKG/h", "min_dose": 4, "max_dose": 12}}))
+    second = load_snapshot(snapshot_file, drugs_file, situations_file, load)
+    assert list(second.names) == ["Propofol"]
+    second.close()
+
+    atomic_write(drugs_file, "{")
+    assert load_snapshot(snapshot_file, drugs_file, situations_file, load) is None
@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from widgets.errors import RegistryConflict
+from widgets.storage import JsonStore, SqliteStore
+
+INFO = {"unit": "mg", "min_dose": 1, "max_dose": 2}
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path):
+    drugs_file, situations_file = str(tmp_path / "drugs.json"), str(tmp_path / "situations.json")
+    if request.param == "json":
+        store = JsonStore(drugs_file, situations_file, str(tmp_path / "registry.snap"))
+    else:
+        store = SqliteStore(str(tmp_path / "registry.sqlite3"), drugs_file, situations_file)
+    store.ensure()
+    yield store
+    store.flush()
+    if request.param == "sqlite":
+        store.close()
+
+
+def test_rename_onto_an_existing_name_is_refused(store):
+    store.upsert_drug("Adrenaline", INFO)
+    store.upsert_drug("Atropine", dict(INFO, max_dose=3))
+    store.upsert_situation("Anaphylaxis", ["Adrenaline"])
+    store.upsert_situation("Bradycardia", ["Atropine"])
+
+    with pytest.raises(RegistryConflict):
+        store.upsert_drug("Atropine", INFO, previous="Adrenaline")
+    with pytest.raises(RegistryConflict):
+        store.upsert_situation("Bradycardia", ["Adrenaline"], previous="Anaphylaxis")
+
+    assert store.load_drugs()["Atropine"]["max_dose"] == 3
+    assert store.load_situations() == [["Anaphylaxis", ["Adrenaline"]], ["Bradycardia", ["Atropine"]]]
+
+
+def test_rename_and_delete(store):
+    store.upsert_drug("Adrenaline", INFO)
+    store.upsert_drug("Atropine", INFO)
+    store.upsert_situation("Anaphylaxis", ["Adrenaline"])
+    store.upsert_situation("Bradycardia", ["Atropine"])
+
+    store.upsert_drug("Epinephrine", INFO, previous="Adrenaline")
+    store.upsert_situation("Anaphylactic shock", ["Epinephrine"], previous="Anaphylaxis")
+    store.delete_drug("Atropine")
+    store.delete_situation("Bradycardia")
+
+    assert list(store.load_drugs()) == ["Epinephrine"]
+    assert store.load_situations() == [["Anaphylactic shock", ["Epinephrine"]]]
+
+
+def write_registries(tmp_path, drugs, situations):
+    (tmp_path / "drugs.json").write_text(json.dumps(drugs))
+    (tmp_path / "situations.json").write_text(json.dumps(situations))
+
+
+def sqlite_store(tmp_path):
+    return SqliteStore(
+        str(tmp_path / "registry.sqlite3"), str(tmp_path / "drugs.json"), str(tmp_path / "situations.json")
+    )
+
+
+def test_sqlite_migrates_the_json_registries(tmp_path):
+    write_registries(
+        tmp_path,
+        {
+            "Adrenaline": {"unit": "mg", "min_dose": "0,5", "max_dose": "1"},
+            "Fentanyl": {"unit": "µg/kgKG", "min_dose": 1, "max_dose": 2, "concentration": "0,05"},
+            "Ketamine": {"unit": "mg/kgKG", "min_dose": 0.5, "max_dose": 2, "concentration": ""},
+        },
+        [["Anaphylaxis", ["Adrenaline"]], ["Analgesia", ["Fentanyl", "Ketamine"]]],
+    )
+    store = sqlite_store(tmp_path)
+    store.ensure()
+
+    assert store.load_drugs() == {
+        "Adrenaline": {"unit": "mg", "min_dose": 0.5, "max_dose": 1.0},
+        "Fentanyl": {"unit": "µg/kgKG", "min_dose": 1.0, "max_dose": 2.0, "concentration": 0.05},
+        "Ketamine": {"unit": "mg/kgKG", "min_dose": 0.5, "max_dose": 2.0},
+    }
+    assert store.load_situations() == [["Anaphylaxis", ["Adrenaline"]], ["Analgesia", ["Fentanyl", "Ketamine"]]]
+    store.close()
+
+    # Only once, later changes to the JSON files are not taken over
+    write_registries(tmp_path, {}, [])
+    store = sqlite_store(tmp_path)
+    assert len(store.load_drugs()) == 3
+    store.close()
+
+
+def test_failed_migration_leaves_no_connection_behind(tmp_path):
+    write_registries(tmp_path, {"Adrenaline": {"unit": "mg", "min_dose": "half", "max_dose": 1}}, [])
+    store = sqlite_store(tmp_path)
+    with pytest.raises(ValueError):
+        store.ensure()
+    assert store._connection is None
+
+    # Nothing of the failed attempt was kept, the next start migrates the repaired registry
+    write_registries(tmp_path, {"Adrenaline": {"unit": "mg", "min_dose": "0,5", "max_dose": 1}}, [])
+    store.ensure()
+    assert store.load_drugs() == {"Adrenaline": {"unit": "mg", "min_dose": 0.5, "max_dose": 1.0}}
+    store.close()
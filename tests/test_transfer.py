@@ -0,0 +1,103 @@
+import pytest
+
+from widgets import storage, transfer
+from widgets.storage import JsonStore
+from widgets.transfer import ImportWorker, validate_row
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = JsonStore(str(tmp_path / "drugs.json"), str(tmp_path / "situations.json"), str(tmp_path / "registry.snap"))
+    store.ensure()
+    monkeypatch.setattr(storage, "_store", store)
+    yield store
+    store.flush()
+
+
+def run_import(file_path):
+    worker = ImportWorker(str(file_path))
+    errors, done, failed = [], [], []
+    worker.signals.row_error.connect(lambda line, error: errors.append((line, error)))
+    worker.signals.done.connect(lambda imported, rejected: done.append((imported, rejected)))
+    worker.signals.failed.connect(failed.append)
+    worker.run()
+    return errors, done, failed
+
+
+@pytest.mark.parametrize(
+    "row, error",
+    [
+        ({"name": " ", "unit": "mg", "min_dose": "1", "max_dose": "2"}, "missing substance name"),
+        ({"name": "Adrenaline", "unit": "mcg", "min_dose": "1", "max_dose": "2"}, "unknown unit 'mcg'"),
+        ({"name": "Adrenaline", "unit": "mg", "min_dose": "one", "max_dose": "2"}, "doses must be numbers"),
+        ({"name": "Adrenaline", "unit": "mg", "min_dose": "1"}, "doses must be numbers"),
+        ({"name": "Adrenaline", "unit": "mg", "min_dose": "3", "max_dose": "2"}, "minimum dose is larger"),
+        (
+            {"name": "Adrenaline", "unit": "mg", "min_dose": "1", "max_dose": "2", "concentration": "x"},
+            "concentration must be a number",
+        ),
+        (
+            {"name": "Adrenaline", "unit": "mg", "min_dose": "1", "max_dose": "2", "concentration": "0"},
+            "concentration must be positive",
+        ),
+    ],
+)
+def test_malformed_rows_are_rejected(row, error):
+    with pytest.raises(ValueError, match=error):
+        validate_row(row)
+
+
+def test_valid_rows_are_normalized():
+    assert validate_row({"name": " Adrenaline ", "unit": "mg", "min_dose": "0,5", "max_dose": 1}) == (
+        "Adrenaline",
+        {"unit": "mg", "min_dose": 0.5, "max_dose": 1.0},
+    )
+    assert validate_row(
+        {"name": "Fentanyl", "unit": "µg/kgKG", "min_dose": "1", "max_dose": "2", "concentration": "0,05"}
+    )[1]["concentration"] == pytest.approx(0.05)
+
+
+def test_import_reports_bad_rows_and_keeps_the_good_ones(store, tmp_path, monkeypatch):
+    # Small chunks, so rejected rows land in different transactions than the ones around them
+    monkeypatch.setattr(transfer, "CHUNK_SIZE", 2)
+    source = tmp_path / "formulary.csv"
+    source.write_text(
+        "Substance name,Unit,Minimum dose,Maximum dose,Concentration (mg/ml)\n"
+        'Adrenaline,mg,"0,5",1,\n'
+        "Atropine,mg,3,1,\n"
+        "Ketamine,mg/kgKG,0.5,2,10\n"
+        ",mg,1,2,\n"
+        "Amiodarone,g,150,300,\n"
+        "Fentanyl,µg/kgKG,1,2,0.05\n",
+        encoding="utf-8",
+    )
+
+    errors, done, failed = run_import(source)
+
+    assert failed == []
+    assert done == [(3, 3)]
+    assert [line for line, _ in errors] == [3, 5, 6]
+    assert "minimum dose is larger" in errors[0][1]
+    assert "missing substance name" in errors[1][1]
+    assert "unknown unit 'g'" in errors[2][1]
+    assert store.load_drugs() == {
+        "Adrenaline": {"unit": "mg", "min_dose": 0.5, "max_dose": 1.0},
+        "Ketamine": {"unit": "mg/kgKG", "min_dose": 0.5, "max_dose": 2.0, "concentration": 10.0},
+        "Fentanyl": {"unit": "µg/kgKG", "min_dose": 1.0, "max_dose": 2.0, "concentration": 0.05},
+    }
+
+
+def test_import_reads_windows_csv(store, tmp_path):
+    source = tmp_path / "formulary.csv"
+    source.write_bytes("name,unit,min_dose,max_dose\nFentanyl,µg,50,100\n".encode("cp1252"))
+
+    errors, done, failed = run_import(source)
+
+    assert (errors, done, failed) == ([], [(1, 0)], [])
+    assert store.load_drugs() == {"Fentanyl": {"unit": "µg", "min_dose": 50.0, "max_dose": 100.0}}
+
+
+def test_unreadable_file_fails_the_import(store, tmp_path):
+    errors, done, failed = run_import(tmp_path / "missing.csv")
+    assert done == [] and len(failed) == 1
+    assert store.load_drugs() == {}
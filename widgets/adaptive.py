@@ -0,0 +1,202 @@
+import json
+import math
+import os
+
+from .autosave import autosaver
+from .constants import WEAK_DRUGS, WEAK_SITUATIONS
+from .journal import get_journal
+
+# Share of the latest answer in the running error rate and response time of an item
+DECAY = 0.3
+# Weight of an item that is always answered right and fast, so it still comes up now and then
+BASE_WEIGHT = 0.1
+# Share of the weight that comes from being slow rather than wrong
+LATENCY_SHARE = 0.5
+# Assumed error rate of an item never answered, its response time is taken to be the usual pace
+PRIOR_ERROR = 0.5
+# Response time in seconds taken as the usual pace when the journal has none yet
+DEFAULT_PACE = 15.0
+# Items that got heavier since the table was built are drawn apart, up to this many or the square
+# root of the item count if larger, so rebuilding costs less than linear time per answer
+MAX_PENDING = 64
+# Share of the weight that may have moved since the table was built before it is built again
+MAX_CHANGE = 0.1
+
+
+class AliasTable:
+    """Walker's alias method, O(n) to build and O(1) per draw."""
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = sum(weights)
+        self.probability = [1.0] * count
+        self.alias = list(range(count))
+        scaled = [weight * count / total for weight in weights]
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less, more = small.pop(), large[-1]
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(large.pop())
+        # Whatever is left only differs from 1 by rounding errors
+
+    def __len__(self):
+        return len(self.alias)
+
+    def draw(self, rng):
+        position = rng.random() * len(self.alias)
+        i = int(position)
+        return i if position - i < self.probability[i] else self.alias[i]
+
+
+class WeakSpotSampler:
+    """Draws items with a weight from their recent error rate and response time.
+
+    Every answer updates the running averages of its item and the item's weight in constant
+    time. Draws come from an alias table over the weights as they were when it was built:
+    items that got lighter since are rejected in proportion and drawn again, items that got
+    heavier have their extra weight drawn from a short list. Draws stay exact, and the table
+    is only built again once that list grows long or enough of the weight has moved.
+    """
+
+    def __init__(self, kind, state_file):
+        self.kind = kind
+        self.state_file = state_file
+        # item -> [error rate, response time], both running averages
+        self.state = {}
+        self.keys = []
+        self.ids = {}
+        self.weights = []
+        self.table = None
+        self._table_weights = []
+        self._items = None
+        # Item id -> weight gained since the table was built
+        self._pending = {}
+        self._kept = 0.0
+        self._extra = 0.0
+        self._table_total = 0.0
+        self._max_pending = MAX_PENDING
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file, "r") as f:
+                self.state = json.loads(f.read())
+        else:
+            # Starts from the whole history, recent answers take over from there
+            self.state = {
+                item: [1 - accuracy, latency] for item, (_, accuracy, latency) in get_journal().stats(self.kind).items()
+            }
+        latencies = [latency for _, latency in self.state.values()]
+        self.pace = sum(latencies) / len(latencies) if latencies else DEFAULT_PACE
+
+    def flush(self):
+        if not self._dirty:
+            return
+        autosaver.schedule(self.state_file, dict(self.state), backup=False)
+        self._dirty = False
+
+    def weight(self, key):
+        error, latency = self.state.get(key, (PRIOR_ERROR, self.pace))
+        return BASE_WEIGHT + error + LATENCY_SHARE * latency / (latency + self.pace)
+
+    def sync(self, items):
+        # Follows the registry, the state of items that left it is kept in case they come back
+        if items is self._items:
+            return
+        self._items = items
+        self.keys = list(items)
+        self.ids = {key: i for i, key in enumerate(self.keys)}
+        self.weights = [self.weight(key) for key in self.keys]
+        self._max_pending = max(MAX_PENDING, math.isqrt(len(self.keys)))
+        self.table = None
+
+    def _build(self):
+        self.table = AliasTable(self.weights) if self.weights else None
+        self._table_weights = list(self.weights)
+        self._table_total = self._kept = sum(self.weights)
+        self._extra = 0.0
+        self._pending = {}
+
+    def record(self, key, correct, latency):
+        error, previous = self.state.get(key, (PRIOR_ERROR, self.pace))
+        self.state[key] = [
+            (1 - DECAY) * error + DECAY * (0.0 if correct else 1.0),
+            (1 - DECAY) * previous + DECAY * latency,
+        ]
+        self._dirty = True
+        i = self.ids.get(key)
+        if i is None:
+            return
+        old, new = self.weights[i], self.weight(key)
+        self.weights[i] = new
+        if self.table is None:
+            return
+        built = self._table_weights[i]
+        self._kept += min(new, built) - min(old, built)
+        self._extra -= self._pending.pop(i, 0.0)
+        if new > built:
+            self._pending[i] = new - built
+            self._extra += new - built
+
+    def draw(self, rng):
+        # Returns None when there is nothing to draw from
+        if not self.keys:
+            return None
+        if (
+            self.table is None
+            or len(self._pending) > self._max_pending
+            or self._kept < (1 - MAX_CHANGE) * self._table_total
+            or self._extra > MAX_CHANGE * self._table_total
+        ):
+            self._build()
+        while True:
+            # The list is only walked for the rare draws that land on the extra weight
+            position = rng.random() * (self._table_total + self._extra)
+            if position < self._extra:
+                for i, gained in self._pending.items():
+                    position -= gained
+                    if position < 0:
+                        return self.keys[i]
+                continue
+            i = self.table.draw(rng)
+            built = self._table_weights[i]
+            if self.weights[i] >= built or rng.random() * built < self.weights[i]:
+                return self.keys[i]
+
+
+class PerKind:
+    """One object per kind of question, "drugs" or "situations", made when first asked for.
+
+    factory(kind, state_file) makes it, flush() has every one made so far hand its state to the
+    autosaver.
+    """
+
+    def __init__(self, factory, state_files):
+        self.factory = factory
+        self.state_files = state_files
+        self.made = {}
+
+    def get(self, kind):
+        if kind not in self.made:
+            self.made[kind] = self.factory(kind, self.state_files[kind])
+        return self.made[kind]
+
+    def flush(self):
+        for made in self.made.values():
+            made.flush()
+
+
+_samplers = PerKind(WeakSpotSampler, {"drugs": WEAK_DRUGS, "situations": WEAK_SITUATIONS})
+
+
+def get_sampler(kind):
+    return _samplers.get(kind)
+
+
+def flush_samplers():
+    _samplers.flush()
@@ -0,0 +1,180 @@
+import atexit
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from .constants import BACKUP_FOLDER
+from .tracing import span
+
+# Seconds without a newer change before a document is written
+DEBOUNCE_SECONDS = 1.0
+# Previous versions kept per file, file.json.1 being the most recent one
+BACKUP_COUNT = 5
+
+log = logging.getLogger(__name__)
+
+# Read once, setting it is the only way to read it and would race with other threads creating files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _sync_folder(folder):
+    # Makes the rename itself durable, not supported on every platform
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    try:
+        fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(file_path, text):
+    """Replaces file_path with text, or bytes, so that readers and crashes only ever see a complete file."""
+    folder = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix=f".{os.path.basename(file_path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(text, bytes) else "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temp_path)
+        else:
+            # mkstemp keeps temporary files private, a new file gets the mode open() would give it
+            os.chmod(temp_path, 0o666 & ~_UMASK)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    _sync_folder(folder)
+
+
+def rotate_backups(file_path, folder=BACKUP_FOLDER, count=BACKUP_COUNT):
+    if count <= 0 or not os.path.exists(file_path):
+        return
+    os.makedirs(folder, exist_ok=True)
+    name = os.path.basename(file_path)
+    for number in range(count - 1, 0, -1):
+        older = os.path.join(folder, f"{name}.{number}")
+        if os.path.exists(older):
+            os.replace(older, os.path.join(folder, f"{name}.{number + 1}"))
+    latest = os.path.join(folder, f"{name}.1")
+    try:
+        # The live file is about to be renamed over, so a hard link keeps the old contents for free
+        os.link(file_path, latest)
+    except OSError:
+        shutil.copy2(file_path, latest)
+
+
+class AutoSaver:
+    """Debounced background writer for whole JSON documents.
+
+    Only the latest document handed over per file is kept. It is serialized and written by a
+    daemon thread once no newer change arrived for `delay` seconds, after the previous version
+    of the file has been moved into the backups.
+    """
+
+    def __init__(self, delay=DEBOUNCE_SECONDS, backup_folder=BACKUP_FOLDER, backups=BACKUP_COUNT):
+        self.delay = delay
+        self.backup_folder = backup_folder
+        self.backups = backups
+        self.error = None
+        # file path -> (content, callback once written, keep a backup, deadline)
+        self._pending = {}
+        self._writing = 0
+        self._flushing = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="registry-autosave", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def schedule(self, file_path, content, on_written=None, backup=True):
+        # content must not be mutated afterwards, it is serialized on the writer thread
+        with self._condition:
+            self._pending[file_path] = (content, on_written, backup, time.monotonic() + self.delay)
+            self._start()
+            self._condition.notify_all()
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending) + self._writing
+
+    def _due(self):
+        # Called with the condition held, returns the documents to write now
+        while True:
+            while not self._pending:
+                self._condition.wait()
+            if self._flushing:
+                due = list(self._pending.items())
+            else:
+                now = time.monotonic()
+                due = [(path, entry) for path, entry in self._pending.items() if entry[-1] <= now]
+            if due:
+                for path, _ in due:
+                    del self._pending[path]
+                self._writing += len(due)
+                return due
+            self._condition.wait(min(entry[-1] for entry in self._pending.values()) - now)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                due = self._due()
+            for file_path, entry in due:
+                try:
+                    self._write(file_path, *entry[:3])
+                except Exception:
+                    # The thread has to outlive any one document, flush() waits for it
+                    log.exception("Could not save %s", file_path)
+                    self.error = f"Could not save {os.path.basename(file_path)}, see the log"
+                finally:
+                    with self._condition:
+                        self._writing -= 1
+                        self._condition.notify_all()
+
+    def _write(self, file_path, content, on_written, backup):
+        try:
+            with span("registry save", file=os.path.basename(file_path)):
+                text = json.dumps(content)
+                if backup:
+                    rotate_backups(file_path, self.backup_folder, self.backups)
+                atomic_write(file_path, text)
+        except OSError as error:
+            self.error = f"Could not save {os.path.basename(file_path)}: {error}"
+            return
+        self.error = None
+        if on_written is not None:
+            on_written(file_path, content)
+
+    def flush(self):
+        # Writes everything that is still pending right away and waits for it
+        with self._condition:
+            if self._thread is None:
+                return
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                while self._pending or self._writing:
+                    self._condition.wait()
+            finally:
+                self._flushing -= 1
+
+
+autosaver = AutoSaver()
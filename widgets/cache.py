@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+
+from .tracing import span
+
+
+class RegistryCache:
+    """Keeps parsed registry files in memory and revalidates them with stat().
+
+    Documents handed over with put() are served without looking at the file until settle()
+    confirms they were written, so readers never see the older contents still on disk.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._versions = {}
+        # Signature of each file when its version last moved
+        self._seen = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _signature(file_path):
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _observe(self, file_path, signature):
+        # Called with the lock held
+        if self._seen.get(file_path) != signature:
+            self._seen[file_path] = signature
+            self._versions[file_path] = self._versions.get(file_path, 0) + 1
+
+    def load(self, file_path):
+        # The returned object is shared between callers, treat it as read-only
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None and (entry[0] is None or entry[0] == self._signature(file_path)):
+                self.hits += 1
+                return entry[1]
+            signature = self._signature(file_path)
+
+            self.misses += 1
+            with span("registry load", file=os.path.basename(file_path)):
+                with open(file_path, "r") as f:
+                    content = json.loads(f.read())
+            self._entries[file_path] = (signature, content)
+            self._observe(file_path, signature)
+            return content
+
+    def version(self, file_path):
+        # Moves whenever the file changes or a document is put, used to key derived indexes.
+        # Only stat() is needed, so asking does not parse the file
+        with self._lock:
+            if not self.pinned(file_path):
+                self._observe(file_path, self._signature(file_path))
+            return self._versions[file_path]
+
+    def pinned(self, file_path):
+        # Whether a document put here is not on disk yet
+        entry = self._entries.get(file_path)
+        return entry is not None and entry[0] is None
+
+    def put(self, file_path, content):
+        with self._lock:
+            self._entries[file_path] = (None, content)
+            self._versions[file_path] = self._versions.get(file_path, 0) + 1
+
+    def settle(self, file_path, content):
+        # The file now holds content, unless a newer document was put in the meantime
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None and entry[0] is None and entry[1] is content:
+                signature = self._signature(file_path)
+                self._entries[file_path] = (signature, content)
+                # Same contents as served since put(), so the version stays
+                self._seen[file_path] = signature
+
+    def invalidate(self, file_path=None):
+        # Writers call this so a rewrite within the same mtime tick is never missed,
+        # documents that are not written yet are kept
+        with self._lock:
+            paths = list(self._entries) if file_path is None else [file_path]
+            for path in paths:
+                entry = self._entries.get(path)
+                if entry is not None and entry[0] is not None:
+                    del self._entries[path]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "files": len(self._entries)}
+
+
+registry_cache = RegistryCache()
@@ -1,6 +1,24 @@
+import os
 from pathlib import Path
 
 HOME = Path.home()
-APP_FOLDER = f"{HOME}/Library/DrugsQuiz"
+APP_FOLDER = os.environ.get("DMQ_APP_FOLDER", f"{HOME}/Library/DrugsQuiz")
 DRUGS_REGISTRY = f"{APP_FOLDER}/drugs.json"
 SITUATIONS_REGISTRY = f"{APP_FOLDER}/situations.json"
+SITUATIONS_TEXT_INDEX = f"{APP_FOLDER}/situations_index.json"
+REGISTRY_SNAPSHOT = f"{APP_FOLDER}/registry.snap"
+REGISTRY_DATABASE = f"{APP_FOLDER}/registry.sqlite3"
+REVIEW_DRUGS = f"{APP_FOLDER}/review_drugs.json"
+REVIEW_SITUATIONS = f"{APP_FOLDER}/review_situations.json"
+WEAK_DRUGS = f"{APP_FOLDER}/weak_drugs.json"
+WEAK_SITUATIONS = f"{APP_FOLDER}/weak_situations.json"
+ATTEMPTS_LOG = f"{APP_FOLDER}/attempts.jsonl"
+ATTEMPTS_SUMMARY = f"{APP_FOLDER}/attempts_summary.json"
+BACKUP_FOLDER = f"{APP_FOLDER}/backups"
+
+units = ["mg", "µg", "mg/kgKG", "µg/kgKG", "mg/kgKG/h", "µg/kgKG/h", "ml", "ml/kgKG"]
+
+# Folder several workstations share the registries through, see widgets.shared
+SHARED_FOLDER = os.environ.get("DMQ_SHARED_FOLDER")
+# Storage engine for the registries, "json", "sqlite" or "shared" (default when a shared folder is set)
+STORAGE_ENGINE = os.environ.get("DMQ_STORAGE", "shared" if SHARED_FOLDER else "json")
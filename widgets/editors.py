@@ -0,0 +1,312 @@
+from PyQt6.QtCore import QThreadPool
+from PyQt6.QtWidgets import (
+    QFileDialog,
+    QHeaderView,
+    QLabel,
+    QLineEdit,
+    QMessageBox,
+    QProgressBar,
+    QPushButton,
+    QTableView,
+    QVBoxLayout,
+)
+
+from .engine import get_engine
+from .errors import RegistryConflict
+from .fulltext import get_text_index
+from .helpers import read_current_drugs, read_current_situations, set_view_model
+from .models import (
+    DescriptionDelegate,
+    DoseDelegate,
+    DrugListModel,
+    DrugSelectionDelegate,
+    DrugTableModel,
+    SituationTableModel,
+    UnitDelegate,
+)
+from .storage import get_store
+from .transfer import COLUMNS, ExportWorker, ImportWorker, validate_row
+
+FORMULARY_FILTER = "Formulary (*.csv *.xlsx)"
+# Row errors listed after an import, the rest are only counted
+SHOWN_ERRORS = 20
+
+
+class RegisterDrugs(QVBoxLayout):
+    def __init__(self):
+        super().__init__()
+        self.model = None
+
+        # The view only paints the rows that are scrolled into sight
+        self.view = QTableView()
+        self.view.setItemDelegateForColumn(DrugTableModel.UNIT, UnitDelegate(self.view))
+        self.view.setItemDelegateForColumn(DrugTableModel.MIN_DOSE, DoseDelegate(self.view))
+        self.view.setItemDelegateForColumn(DrugTableModel.MAX_DOSE, DoseDelegate(self.view))
+        self.view.setItemDelegateForColumn(DrugTableModel.CONCENTRATION, DoseDelegate(self.view))
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.addWidget(self.view)
+
+        self.transfer_label = QLabel()
+        self.progress = QProgressBar()
+        self.transfer_label.setVisible(False)
+        self.progress.setVisible(False)
+        self.addWidget(self.transfer_label)
+        self.addWidget(self.progress)
+        self.worker = None
+        self.errors = []
+
+        self.save_button = QPushButton("Save")
+        self.add_new_line_button = QPushButton("Add new line")
+        self.add_new_line_button.clicked.connect(self._add_line)
+        self.import_button = QPushButton("Import...")
+        self.import_button.clicked.connect(self.import_file)
+        self.export_button = QPushButton("Export...")
+        self.export_button.clicked.connect(self.export_file)
+        self.cancel_button = QPushButton("Cancel")
+
+    def reset(self):
+        # Reload the registry into a fresh model, unsaved edits are dropped
+        model = DrugTableModel(read_current_drugs(), self.view)
+        model.add_row()
+        set_view_model(self.view, model)
+        self.model = model
+
+    def _add_line(self):
+        row = self.model.add_row()
+        index = self.model.index(row, DrugTableModel.NAME)
+        self.view.scrollTo(index)
+        self.view.setCurrentIndex(index)
+        self.view.edit(index)
+
+    def save(self):
+        # Commit the editor that is still open, if any
+        self.view.setCurrentIndex(self.model.index(-1, -1))
+
+        # Rows are checked like imported ones, nothing is saved while a cell is invalid
+        changes, problems = [], []
+        for row, previous, values in self.model.edited_rows():
+            if not values[DrugTableModel.NAME]:
+                changes.append((previous, None, None))
+                continue
+            try:
+                changes.append((previous, *validate_row(dict(zip(COLUMNS, values)))))
+            except ValueError as error:
+                problems.append((row, f"Row {row + 1}, {values[DrugTableModel.NAME]}: {error}"))
+        if problems:
+            index = self.model.index(problems[0][0], DrugTableModel.NAME)
+            self.view.scrollTo(index)
+            self.view.setCurrentIndex(index)
+            listed = "\n".join(message for _, message in problems[:SHOWN_ERRORS])
+            QMessageBox.warning(self.parentWidget(), "Save substances", f"Nothing was saved:\n\n{listed}")
+            return False
+
+        store = get_store()
+        engine = get_engine()
+        renamed = {}
+        try:
+            with store.transaction():
+                for previous, name, info in changes:
+                    if name is None:
+                        if previous:
+                            store.delete_drug(previous)
+                        continue
+                    store.upsert_drug(name, info, previous=previous)
+                    if previous and previous != name:
+                        renamed[previous] = name
+
+                # Situations follow renamed drugs, the reverse index gives just the affected ones
+                affected = {
+                    description
+                    for previous in renamed
+                    for description in engine.situation_index.situations_using(previous)
+                }
+                for description in affected:
+                    drugs = [renamed.get(drug, drug) for drug in engine.situation_lookup[description]]
+                    store.upsert_situation(description, drugs)
+        except RegistryConflict as error:
+            # Nothing of this save was stored, the edits stay in the table to be fixed
+            QMessageBox.warning(self.parentWidget(), "Save substances", str(error))
+            return False
+        self.model.mark_clean()
+        return True
+
+    def import_file(self):
+        file_path, _ = QFileDialog.getOpenFileName(self.parentWidget(), "Import substances", "", FORMULARY_FILTER)
+        if not file_path:
+            return
+        # Pending edits are kept, the table is reloaded from the registry once the import is done
+        if not self.save():
+            return
+        self.errors = []
+        self._start(ImportWorker(file_path), "Importing")
+
+    def export_file(self):
+        file_path, _ = QFileDialog.getSaveFileName(self.parentWidget(), "Export substances", "", FORMULARY_FILTER)
+        if not file_path:
+            return
+        if not self.save():
+            return
+        self._start(ExportWorker(file_path), "Exporting")
+
+    def _start(self, worker, action):
+        # The file is parsed and written on a pool thread, the window keeps repainting meanwhile
+        self.worker = worker
+        worker.signals.progress.connect(self._show_progress)
+        worker.signals.row_error.connect(lambda line, message: self.errors.append(f"Line {line}: {message}"))
+        worker.signals.done.connect(self._finish)
+        worker.signals.failed.connect(self._fail)
+        for button in (self.import_button, self.export_button, self.save_button):
+            button.setEnabled(False)
+        self.transfer_label.setText(f"{action} {worker.file_path}")
+        self.transfer_label.setVisible(True)
+        self.progress.setRange(0, 0)
+        self.progress.setVisible(True)
+        QThreadPool.globalInstance().start(worker)
+
+    def _show_progress(self, done, total):
+        self.progress.setRange(0, total)
+        self.progress.setValue(done)
+
+    def _stop(self):
+        self.worker = None
+        for button in (self.import_button, self.export_button, self.save_button):
+            button.setEnabled(True)
+        self.transfer_label.setVisible(False)
+        self.progress.setVisible(False)
+
+    def _finish(self, count, failed):
+        importing = isinstance(self.worker, ImportWorker)
+        self._stop()
+        if not importing:
+            QMessageBox.information(self.parentWidget(), "Export", f"Exported {count} substances.")
+            return
+
+        self.reset()
+        message = f"Imported {count} substances."
+        if failed:
+            message += f" {failed} rows were skipped:\n\n" + "\n".join(self.errors[:SHOWN_ERRORS])
+            if failed > SHOWN_ERRORS:
+                message += f"\n... and {failed - SHOWN_ERRORS} more"
+        QMessageBox.information(self.parentWidget(), "Import", message)
+
+    def _fail(self, message):
+        importing = isinstance(self.worker, ImportWorker)
+        self._stop()
+        if importing:
+            # Chunks committed before the failure stay in the registry
+            self.reset()
+        QMessageBox.warning(self.parentWidget(), "Import" if importing else "Export", message)
+
+
+class RegisterSituation(QVBoxLayout):
+    def __init__(self):
+        super().__init__()
+        self.drug_list = None
+        self.model = None
+        self.hidden_rows = set()
+
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("Search situations")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textChanged.connect(self.filter)
+        self.addWidget(self.search_box)
+
+        self.view = QTableView()
+        self.drug_delegate = DrugSelectionDelegate(None, self.view)
+        self.view.setItemDelegateForColumn(SituationTableModel.DESCRIPTION, DescriptionDelegate(self.view))
+        self.view.setItemDelegateForColumn(SituationTableModel.DRUGS, self.drug_delegate)
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.addWidget(self.view)
+
+        self.save_button = QPushButton("Save")
+        self.add_new_line_button = QPushButton("Add new line")
+        self.add_new_line_button.clicked.connect(self.add_line)
+        self.cancel_button = QPushButton("Cancel")
+
+    def reset(self):
+        # Reload the registries into fresh models, unsaved edits are dropped
+        if self.drug_list is not None:
+            self.drug_list.deleteLater()
+        self.drug_list = DrugListModel(read_current_drugs(), self.view)
+        self.drug_delegate.drug_list = self.drug_list
+        model = SituationTableModel(read_current_situations(), self.drug_list, self.view)
+        model.add_row()
+        set_view_model(self.view, model)
+        self.model = model
+        self.hidden_rows = set()
+        self.search_box.clear()
+
+    def filter(self, text):
+        # Hides the rows the saved registry does not match, rows edited since then stay visible
+        ranked = get_text_index().search(text, limit=None) if text.strip() else None
+        hidden = set()
+        if ranked is not None:
+            matches = {description for description, _ in ranked}
+            hidden = {
+                row
+                for row in range(self.model.rowCount())
+                if not self.model.is_dirty(row) and self.model.key(row) and self.model.key(row) not in matches
+            }
+        # Only the rows whose visibility changes are touched, the view relayouts on each call
+        for row in hidden - self.hidden_rows:
+            self.view.setRowHidden(row, True)
+        for row in self.hidden_rows - hidden:
+            self.view.setRowHidden(row, False)
+        self.hidden_rows = hidden
+        if ranked:
+            best = ranked[0][0]
+            for row in range(self.model.rowCount()):
+                if self.model.key(row) == best:
+                    index = self.model.index(row, SituationTableModel.DESCRIPTION)
+                    self.view.scrollTo(index)
+                    self.view.setCurrentIndex(index)
+                    break
+
+    def similar_situations(self):
+        # Near-duplicates of the descriptions written since the last save, among the saved ones
+        index = get_text_index()
+        similar = []
+        for previous, (description, _) in self.model.dirty_rows():
+            if description and description != previous:
+                similar += [(description, other) for other in index.similar(description, exclude={previous})]
+        return similar
+
+    def add_line(self):
+        row = self.model.add_row()
+        index = self.model.index(row, SituationTableModel.DESCRIPTION)
+        self.view.scrollTo(index)
+        self.view.setCurrentIndex(index)
+        self.view.edit(index)
+
+    def save(self):
+        # Commit the editor that is still open, if any
+        self.view.setCurrentIndex(self.model.index(-1, -1))
+
+        similar = self.similar_situations()
+        if similar:
+            listed = "\n".join(f'"{description}" looks like "{other}"' for description, other in similar[:SHOWN_ERRORS])
+            answer = QMessageBox.question(
+                self.parentWidget(),
+                "Similar situations",
+                f"{listed}\n\nSave anyway?",
+                defaultButton=QMessageBox.StandardButton.No,
+            )
+            if answer != QMessageBox.StandardButton.Yes:
+                return False
+
+        store = get_store()
+        try:
+            with store.transaction():
+                for previous, (description, drugs) in self.model.dirty_rows():
+                    if not description:
+                        if previous:
+                            store.delete_situation(previous)
+                        continue
+                    store.upsert_situation(description, drugs, previous=previous)
+        except RegistryConflict as error:
+            QMessageBox.warning(self.parentWidget(), "Save situations", str(error))
+            return False
+        self.model.mark_clean()
+        return True
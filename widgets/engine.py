@@ -0,0 +1,297 @@
+import random
+from collections import namedtuple
+
+from .constants import units
+from .index import SituationIndex
+from .search import SearchIndex
+from .snapshot import CodedColumn, OptionalColumn
+from .storage import get_store
+from .tracing import tracer
+from .units import UNITS, answer_unit, conversion_factor
+
+MIN_WEIGHT = 40
+MAX_WEIGHT = 160
+# Relative slack on the range limits, so 0.5 mg and 500 µg grade alike despite rounding
+TOLERANCE = 1e-9
+
+# Layout of the records returned by QuizEngine.grade_many
+GRADE_FIELDS = [
+    ("drug", "i8"),
+    ("weight", "f8"),
+    ("dose", "f8"),
+    ("min_dose", "f8"),
+    ("max_dose", "f8"),
+    ("unit_ok", "?"),
+    ("dose_ok", "?"),
+    ("correct", "?"),
+]
+
+
+def make_float(string):
+    if isinstance(string, str):
+        string = string.replace(",", ".")
+    return float(string)
+
+
+class DrugResult(namedtuple("DrugResult", "drug weight dose unit correct_unit min_dose max_dose unit_ok dose_ok")):
+    __slots__ = ()
+
+    @property
+    def correct(self):
+        return self.unit_ok and self.dose_ok
+
+
+class SituationResult(namedtuple("SituationResult", "expected answer missed extra score")):
+    __slots__ = ()
+
+    @property
+    def correct(self):
+        # The order in which the drugs were picked does not matter
+        return not self.missed and not self.extra
+
+
+class QuizEngine:
+    """Dose grading and question generation, independent from the GUI."""
+
+    def __init__(self, drugs, situations=(), rng=None):
+        self.rng = rng or random.Random()
+        self.situations = list(situations)
+        self.situation_lookup = {description: drugs for description, drugs in self.situations}
+        self.situation_names = list(self.situation_lookup)
+        self._situation_index = None
+        self._search_index = None
+        self.snapshot = None
+        self.closed = False
+        self.names = list(drugs)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        infos = list(drugs.values())
+        self.units = [UNITS[info["unit"]] for info in infos]
+        self.correct_units = [answer_unit(info["unit"]) for info in infos]
+        self.concentrations = [_concentration(info) for info in infos]
+        # Ranges in canonical units (mg or ml), still per kg where the registered unit is
+        self.min_doses = [make_float(info["min_dose"]) * unit.scale for info, unit in zip(infos, self.units)]
+        self.max_doses = [make_float(info["max_dose"]) * unit.scale for info, unit in zip(infos, self.units)]
+        self._arrays = None
+
+    @classmethod
+    def from_snapshot(cls, snapshot, rng=None):
+        # The columns stay in the mapped file and are only read where they are used
+        engine = cls({}, rng=rng)
+        engine.snapshot = snapshot
+        engine.situations = snapshot.situations
+        engine.situation_lookup = snapshot.situation_lookup
+        engine.situation_names = snapshot.situations.descriptions
+        engine.names = snapshot.names
+        engine.index = snapshot.index
+        codes = snapshot.sections["unit_codes"]
+        engine.units = CodedColumn(codes, [UNITS[unit] for unit in snapshot.unit_names])
+        engine.correct_units = CodedColumn(codes, [answer_unit(unit) for unit in snapshot.unit_names])
+        engine.concentrations = OptionalColumn(snapshot.sections["concentrations"])
+        engine.min_doses = snapshot.sections["min_doses"]
+        engine.max_doses = snapshot.sections["max_doses"]
+        return engine
+
+    @classmethod
+    def from_store(cls, store=None, rng=None):
+        if store is None:
+            store = get_store()
+        snapshot = store.snapshot()
+        if snapshot is not None:
+            return cls.from_snapshot(snapshot, rng=rng)
+        return cls(store.load_drugs(), store.load_situations(), rng=rng)
+
+    def close(self):
+        # Releases the mapped snapshot, if any, the engine must not be used afterwards
+        self.closed = True
+        if self.snapshot is not None:
+            # NumPy views over the mapping would keep it from being released
+            self._arrays = None
+            self.snapshot.close()
+
+    def random_weight(self):
+        return self.rng.randint(MIN_WEIGHT, MAX_WEIGHT)
+
+    def random_drug(self):
+        return self.rng.choice(self.names)
+
+    def random_situation(self):
+        return self.rng.choice(self.situations)
+
+    def _canonical_range(self, i, weight):
+        scale = weight if self.units[i].per_weight else 1
+        return self.min_doses[i] * scale, self.max_doses[i] * scale
+
+    def dose_range(self, drug, weight, unit=None):
+        # Accepted doses for the patient expressed in unit, the expected answer unit by default
+        return self._dose_range(self.index[drug], weight, unit)
+
+    def _dose_range(self, i, weight, unit=None):
+        target = UNITS[unit or self.correct_units[i]]
+        factor = conversion_factor(self.units[i], target, self.concentrations[i])
+        if factor is None:
+            raise ValueError(f"A dose of {self.names[i]} cannot be given in {target.name}")
+        min_dose, max_dose = self._canonical_range(i, weight)
+        return target.from_canonical(min_dose * factor, weight), target.from_canonical(max_dose * factor, weight)
+
+    @tracer.traced("answer grading")
+    def grade(self, drug, weight, dose, unit):
+        i = self.index[drug]
+        dose = _parse_dose(dose)
+        min_dose, max_dose = self._dose_range(i, weight)
+        answered = UNITS.get(unit)
+        factor = None if answered is None else conversion_factor(answered, self.units[i], self.concentrations[i])
+        if factor is None:
+            # Without a conversion the number is compared as if it was given in the expected unit
+            value, low, high = dose, min_dose, max_dose
+        else:
+            value = answered.to_canonical(dose, weight) * factor
+            low, high = self._canonical_range(i, weight)
+        return DrugResult(
+            drug,
+            weight,
+            dose,
+            unit,
+            self.correct_units[i],
+            min_dose,
+            max_dose,
+            factor is not None,
+            low * (1 - TOLERANCE) <= value <= high * (1 + TOLERANCE),
+        )
+
+    def _unit_codes(self, unit_names):
+        import numpy as np
+
+        codes = {unit: code for code, unit in enumerate(units)}
+        return np.array([codes.get(unit, len(units)) for unit in unit_names], dtype=np.int64)
+
+    @staticmethod
+    def _unit_table(parsed):
+        # Columns scale, per kg, volume and per hour for a list of parsed units
+        import numpy as np
+
+        return (
+            np.array([unit.scale for unit in parsed], dtype=np.float64),
+            np.array([unit.per_weight for unit in parsed], dtype=np.bool_),
+            np.array([unit.quantity == "volume" for unit in parsed], dtype=np.bool_),
+            np.array([unit.per_hour for unit in parsed], dtype=np.bool_),
+        )
+
+    def arrays(self):
+        # Column arrays over the registry, built on the first batch and reused afterwards
+        # NumPy is only needed for batches, so the GUI does not pay for importing it at startup
+        import numpy as np
+
+        if self._arrays is None:
+            concentrations = [concentration or np.nan for concentration in self.concentrations]
+            self._arrays = {
+                "min": np.asarray(self.min_doses, dtype=np.float64),
+                "max": np.asarray(self.max_doses, dtype=np.float64),
+                "concentration": np.array(concentrations, dtype=np.float64),
+                "expected": self._unit_table(self.units),
+                "correct": self._unit_table([UNITS[unit] for unit in self.correct_units]),
+                # One row per entry of constants.units plus a last one for anything unknown
+                "answered": self._unit_table(list(UNITS.values()) + [UNITS[units[0]]]),
+            }
+        return self._arrays
+
+    @tracer.traced("batch grading")
+    def grade_many(self, answers):
+        """Grade (drug, weight, dose, unit) answers at once, returns a GRADE_FIELDS record array."""
+        import numpy as np
+
+        answers = list(answers)
+        arrays = self.arrays()
+        results = np.zeros(len(answers), dtype=GRADE_FIELDS)
+        if not answers:
+            return results
+
+        drugs, weights, doses, answered_units = zip(*answers)
+        drug_index = np.array([self.index[drug] for drug in drugs], dtype=np.int64)
+        weight = np.array(weights, dtype=np.float64)
+        dose = np.array([_parse_dose(value) for value in doses], dtype=np.float64)
+        unit_code = self._unit_codes(answered_units)
+
+        _, per_weight, volume, per_hour = (column[drug_index] for column in arrays["expected"])
+        correct_scale, correct_per_weight, _, _ = (column[drug_index] for column in arrays["correct"])
+        answered_scale, answered_per_weight, answered_volume, answered_per_hour = (
+            column[unit_code] for column in arrays["answered"]
+        )
+        concentration = arrays["concentration"][drug_index]
+
+        low = arrays["min"][drug_index] * np.where(per_weight, weight, 1.0)
+        high = arrays["max"][drug_index] * np.where(per_weight, weight, 1.0)
+        correct_divisor = correct_scale * np.where(correct_per_weight, weight, 1.0)
+        results["drug"] = drug_index
+        results["weight"] = weight
+        results["dose"] = dose
+        results["min_dose"] = low / correct_divisor
+        results["max_dose"] = high / correct_divisor
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            factor = np.where(
+                answered_volume == volume, 1.0, np.where(answered_volume, concentration, 1 / concentration)
+            )
+            compatible = (unit_code < len(units)) & (answered_per_hour == per_hour) & np.isfinite(factor)
+            converted = dose * answered_scale * np.where(answered_per_weight, weight, 1.0) * factor
+        value = np.where(compatible, converted, dose)
+        low = np.where(compatible, low, results["min_dose"])
+        high = np.where(compatible, high, results["max_dose"])
+        results["unit_ok"] = compatible
+        # Comparisons against NaN are False, so unreadable doses are graded as wrong
+        results["dose_ok"] = (low * (1 - TOLERANCE) <= value) & (value <= high * (1 + TOLERANCE))
+        results["correct"] = results["unit_ok"] & results["dose_ok"]
+        return results
+
+    @property
+    def situation_index(self):
+        if self._situation_index is None:
+            if self.snapshot is not None:
+                self._situation_index = self.snapshot.situation_index()
+            else:
+                self._situation_index = SituationIndex(self.names, self.situations)
+        return self._situation_index
+
+    @property
+    def search_index(self):
+        # Rebuilt along with the engine, so once per registry version
+        if self._search_index is None:
+            self._search_index = SearchIndex(self.names)
+        return self._search_index
+
+    def grade_situation(self, expected, answer):
+        missed, extra, score = self.situation_index.compare(expected, answer)
+        return SituationResult(list(expected), list(answer), missed, extra, score)
+
+
+def _concentration(info):
+    # Optional mg/ml of the preparation, lets doses be answered in ml and mg alike
+    concentration = info.get("concentration")
+    if concentration in (None, ""):
+        return None
+    return make_float(concentration) or None
+
+
+def _parse_dose(value):
+    try:
+        return make_float(value)
+    except ValueError:
+        return float("nan")
+
+
+_engine = None
+_engine_version = None
+
+
+def get_engine():
+    # Shared engine for the GUI, rebuilt only when the registry changed on disk
+    global _engine, _engine_version
+    store = get_store()
+    version = store.version()
+    if _engine is None or version != _engine_version:
+        rng = _engine.rng if _engine else None
+        if _engine is not None:
+            # Its snapshot may be the file about to be compiled again
+            _engine.close()
+        _engine = QuizEngine.from_store(store, rng=rng)
+        _engine_version = version
+    return _engine
@@ -0,0 +1,2 @@
+class RegistryConflict(ValueError):
+    """A change would give a substance or situation the name of another registered one."""
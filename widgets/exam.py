@@ -0,0 +1,145 @@
+import random
+import time
+from collections import namedtuple
+
+from .engine import MAX_WEIGHT, MIN_WEIGHT, DrugResult, get_engine
+from .journal import get_journal
+
+DRUG_QUESTIONS = 20
+SITUATION_QUESTIONS = 5
+# Seconds for the whole exam
+TIME_LIMIT = 20 * 60
+
+ExamQuestion = namedtuple("ExamQuestion", "kind item weight expected")
+ExamRow = namedtuple("ExamRow", "question answer correct latency error")
+
+
+def _sample(rng, items, count):
+    # Without repetition as long as the registry is large enough
+    if len(items) >= count:
+        return rng.sample(items, count)
+    return [rng.choice(items) for _ in range(count)]
+
+
+class Exam:
+    """A fixed, seeded question set answered without feedback and graded in one batch at the end.
+
+    Answers are only kept in memory while the exam runs; the journal gets them all at once
+    when the exam is graded.
+    """
+
+    def __init__(
+        self,
+        seed,
+        drug_questions=DRUG_QUESTIONS,
+        situation_questions=SITUATION_QUESTIONS,
+        time_limit=TIME_LIMIT,
+        engine=None,
+    ):
+        self.engine = engine or get_engine()
+        self.seed = seed
+        self.time_limit = time_limit
+        rng = random.Random(f"{seed}:exam")
+        questions = []
+        if self.engine.names:
+            questions += [
+                ExamQuestion("drug", name, rng.randint(MIN_WEIGHT, MAX_WEIGHT), None)
+                for name in _sample(rng, self.engine.names, drug_questions)
+            ]
+        if self.engine.situations and self.engine.names:
+            questions += [
+                ExamQuestion("situation", description, None, drugs)
+                for description, drugs in _sample(rng, self.engine.situations, situation_questions)
+            ]
+        rng.shuffle(questions)
+        self.questions = questions
+        self.answers = [None] * len(questions)
+        self.latencies = [0.0] * len(questions)
+        self.position = 0
+        self.started = None
+        self.shown_at = None
+        self.rows = None
+        self.elapsed = None
+
+    def start(self, now=None):
+        self.started = self.shown_at = time.monotonic() if now is None else now
+
+    def remaining(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.time_limit - (now - self.started))
+
+    def current(self):
+        if self.position >= len(self.questions) or not self.remaining():
+            return None
+        return self.questions[self.position]
+
+    def answer(self, answer, now=None):
+        # Stores the raw answer and moves on, returns the next question or None at the end
+        now = time.monotonic() if now is None else now
+        self.answers[self.position] = answer
+        self.latencies[self.position] = now - self.shown_at
+        self.position += 1
+        self.shown_at = now
+        return self.current()
+
+    def grade(self):
+        """Grades every answer at once, returns one ExamRow per question in the order asked."""
+        # The shared engine is closed when the registry changed during the exam, its successor grades
+        engine = get_engine() if self.engine.closed else self.engine
+        self.elapsed = self.time_limit - self.remaining()
+        rows = [None] * len(self.questions)
+        journal = get_journal()
+
+        drug_positions = [i for i, question in enumerate(self.questions) if question.kind == "drug"]
+        batch = [
+            (self.questions[i].item, self.questions[i].weight, *(self.answers[i] or ("", ""))) for i in drug_positions
+        ]
+        graded = engine.grade_many(batch)
+        for i, (drug, weight, dose, unit), record in zip(drug_positions, batch, graded):
+            correct_unit = engine.correct_units[record["drug"]]
+            result = DrugResult(
+                drug,
+                weight,
+                float(record["dose"]),
+                unit,
+                correct_unit,
+                float(record["min_dose"]),
+                float(record["max_dose"]),
+                bool(record["unit_ok"]),
+                bool(record["dose_ok"]),
+            )
+            errors = []
+            if self.answers[i] is None:
+                errors.append("Not answered")
+            else:
+                if not result.unit_ok:
+                    errors.append(f"Unit should be {correct_unit}")
+                if not result.dose_ok:
+                    errors.append(f"Dose should be {result.min_dose:.4g} to {result.max_dose:.4g} {correct_unit}")
+                journal.record_drug(result, self.latencies[i])
+            answer = f"{dose} {unit}" if self.answers[i] is not None else ""
+            rows[i] = ExamRow(f"{drug}, {weight} kg", answer, result.correct, self.latencies[i], "; ".join(errors))
+
+        for i, question in enumerate(self.questions):
+            if question.kind != "situation":
+                continue
+            answer = self.answers[i] or []
+            result = engine.grade_situation(question.expected, answer)
+            errors = []
+            if self.answers[i] is None:
+                errors.append("Not answered")
+            else:
+                if result.missed:
+                    errors.append(f"Missing: {', '.join(result.missed)}")
+                if result.extra:
+                    errors.append(f"Not indicated: {', '.join(result.extra)}")
+                journal.record_situation(question.item, answer, result.correct, self.latencies[i])
+            correct = result.correct and self.answers[i] is not None
+            rows[i] = ExamRow(question.item, ", ".join(answer), correct, self.latencies[i], "; ".join(errors))
+
+        self.rows = rows
+        return rows
+
+    @property
+    def score(self):
+        return sum(row.correct for row in self.rows or ())
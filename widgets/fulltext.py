@@ -0,0 +1,178 @@
+import bisect
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+
+from .autosave import autosaver
+from .constants import SITUATIONS_TEXT_INDEX
+from .engine import get_engine
+
+_TOKEN = re.compile(r"\w+")
+
+# BM25 parameters, the usual defaults
+K1 = 1.2
+B = 0.75
+# Share of common words for a description to count as a near-duplicate of another one
+SIMILARITY = 0.7
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.casefold())
+
+
+class FullTextIndex:
+    """Inverted index over free-text documents, ranked with BM25.
+
+    Documents are keyed by their own text, which is how situations are identified, and are
+    added and removed one at a time. The last query word also matches as a prefix, so the
+    search box finds "anaphylaxis" while "anaph" is still being typed.
+    """
+
+    def __init__(self):
+        # term -> {document: term frequency}
+        self.postings = {}
+        self.lengths = {}
+        self.total_length = 0
+        self._vocabulary = None
+        self._norms = None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def _changed(self):
+        self._vocabulary = None
+        self._norms = None
+
+    def add(self, document):
+        if document in self.lengths:
+            return
+        tokens = tokenize(document)
+        for term, frequency in Counter(tokens).items():
+            self.postings.setdefault(term, {})[document] = frequency
+        self.lengths[document] = len(tokens)
+        self.total_length += len(tokens)
+        self._changed()
+
+    def remove(self, document):
+        length = self.lengths.pop(document, None)
+        if length is None:
+            return
+        for term in set(tokenize(document)):
+            postings = self.postings[term]
+            del postings[document]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= length
+        self._changed()
+
+    def sync(self, documents):
+        # Applies only the difference to the given documents, returns whether anything changed
+        documents = set(documents)
+        removed = [document for document in self.lengths if document not in documents]
+        added = [document for document in documents if document not in self.lengths]
+        for document in removed:
+            self.remove(document)
+        for document in added:
+            self.add(document)
+        return bool(removed or added)
+
+    def _terms(self, query, prefix):
+        terms = tokenize(query)
+        if not prefix or not terms or query[-1:].isspace():
+            return set(terms)
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        last = terms.pop()
+        start = bisect.bisect_left(self._vocabulary, last)
+        end = bisect.bisect_left(self._vocabulary, last + "\uffff", start)
+        return set(terms) | set(self._vocabulary[start:end])
+
+    def search(self, query, limit=10, prefix=True):
+        """Returns up to limit (document, score) pairs, best first, every match for limit=None."""
+        if not self.lengths:
+            return []
+        if self._norms is None:
+            # Length normalization per document, only recomputed after the index changed
+            average = self.total_length / len(self.lengths) or 1
+            self._norms = {document: K1 * (1 - B + B * length / average) for document, length in self.lengths.items()}
+        norms = self._norms
+        count = len(self.lengths)
+        scores = {}
+        for term in self._terms(query, prefix):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for document, frequency in postings.items():
+                scores[document] = scores.get(document, 0.0) + idf * frequency * (K1 + 1) / (
+                    frequency + norms[document]
+                )
+        if limit is None:
+            return sorted(scores.items(), key=lambda item: -item[1])
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def similar(self, text, exclude=(), limit=5):
+        # Documents sharing most of their words with text, the best BM25 hits are the candidates
+        words = set(tokenize(text))
+        if not words:
+            return []
+        similar = []
+        for document, _ in self.search(text, limit + len(exclude), prefix=False):
+            if document in exclude or document == text:
+                continue
+            other = set(tokenize(document))
+            if len(words & other) / len(words | other) >= SIMILARITY:
+                similar.append(document)
+        return similar[:limit]
+
+    def to_json(self):
+        documents = list(self.lengths)
+        ids = {document: i for i, document in enumerate(documents)}
+        postings = {
+            term: [[ids[document], frequency] for document, frequency in entries.items()]
+            for term, entries in self.postings.items()
+        }
+        return {"documents": documents, "postings": postings}
+
+    @classmethod
+    def from_json(cls, content):
+        index = cls()
+        documents = content["documents"]
+        index.lengths = dict.fromkeys(documents, 0)
+        for term, entries in content["postings"].items():
+            index.postings[term] = {documents[i]: frequency for i, frequency in entries}
+            for i, frequency in entries:
+                index.lengths[documents[i]] += frequency
+        index.total_length = sum(index.lengths.values())
+        return index
+
+    @classmethod
+    def load(cls, file_path):
+        if not os.path.exists(file_path):
+            return cls()
+        try:
+            with open(file_path, "r") as f:
+                return cls.from_json(json.loads(f.read()))
+        except (ValueError, KeyError, IndexError, TypeError):
+            # A damaged index is only a cache, it is rebuilt from the registry
+            return cls()
+
+
+_index = None
+_engine = None
+
+
+def get_text_index():
+    # Follows the situation registry incrementally and stores itself next to it after changes
+    global _index, _engine
+    if _index is None:
+        _index = FullTextIndex.load(SITUATIONS_TEXT_INDEX)
+    engine = get_engine()
+    if engine is not _engine:
+        _engine = engine
+        if _index.sync(engine.situation_names):
+            autosaver.schedule(SITUATIONS_TEXT_INDEX, _index.to_json(), backup=False)
+    return _index
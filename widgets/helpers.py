@@ -1,66 +1,150 @@
+import bisect
 import json
 import os
 
-from PyQt6.QtCore import QEvent, Qt
+from PyQt6.QtCore import QEvent, QFileSystemWatcher, QObject, Qt, QTimer, pyqtSignal
 from PyQt6.QtGui import QFontMetrics, QStandardItem
-from PyQt6.QtWidgets import QComboBox, QStyledItemDelegate
+from PyQt6.QtWidgets import QComboBox, QLabel, QStyledItemDelegate
 
-from .constants import DRUGS_REGISTRY, SITUATIONS_REGISTRY
-
-units = ["mg", "µg", "mg/kgKG", "µg/kgKG", "mg/kgKG/h", "µg/kgKG/h", "ml", "ml/kgKG"]
+from .autosave import autosaver
+from .engine import get_engine
+from .storage import get_store
+from .tracing import tracer
 
 
 def read_current_drugs():
-    with open(DRUGS_REGISTRY, "r") as f:
-        current_drugs = json.loads(f.read())
-    return current_drugs
+    return get_store().load_drugs()
 
 
 def read_current_situations():
-    with open(SITUATIONS_REGISTRY, "r") as f:
-        current_situations = json.loads(f.read())
-    return current_situations
-
-
-def make_float(string):
-    if isinstance(string, str):
-        string = string.replace(",", ".")
-    return float(string)
+    return get_store().load_situations()
 
 
 def check_answer(drug, weigth, dose, unit):
-    dose = make_float(dose)
-    message = ""
-
-    with open(DRUGS_REGISTRY, "r") as f:
-        current_content = json.loads(f.read())
-    info = current_content[drug]
+    return drug_message(get_engine().grade(drug, weigth, dose, unit))
 
-    if info["unit"].endswith("KG"):
-        info["unit"] = info["unit"].split("/")[0]
 
-    if unit != info["unit"]:
-        message += f'Wrong unit. The correct unit is {info["unit"]}\n'
+def drug_message(result):
+    message = ""
 
-    min_dose = make_float(info["min_dose"])
-    max_dose = make_float(info["max_dose"])
-    if not unit.endswith("/h"):
-        min_dose *= weigth
-        max_dose *= weigth
+    if not result.unit_ok:
+        message += f"Wrong unit. The correct unit is {result.correct_unit}\n"
 
-    if min_dose <= dose <= max_dose:
+    if result.dose_ok:
         message += "Correct dose!"
     else:
-        message += f"Wrong dose. Correct answer is between {min_dose} and {max_dose}"
+        message += f"Wrong dose. Correct answer is between {result.min_dose} and {result.max_dose}"
     return message
 
 
+def situation_message(result):
+    if result.correct:
+        return "Correct!"
+    correct_answer = "\n".join(result.expected)
+    message = f"Incorrect ({result.score:.0%} matching).\n"
+    if result.missed:
+        message += f"Missing: {', '.join(result.missed)}\n"
+    if result.extra:
+        message += f"Not indicated: {', '.join(result.extra)}\n"
+    return message + f"Correct answer is:\n\n{correct_answer}"
+
+
 def ensure_file(file_path, empty_data):
     if not os.path.exists(file_path):
         with open(file_path, "w") as f:
             f.write(json.dumps(empty_data))
 
 
+def set_view_model(view, model):
+    # setModel leaves the previous model and its selection model alive, they are released here
+    previous_model = view.model()
+    previous_selection = view.selectionModel()
+    view.setModel(model)
+    if previous_selection is not None:
+        previous_selection.deleteLater()
+    if previous_model is not None and previous_model is not model:
+        previous_model.deleteLater()
+
+
+class WidgetCounter(QObject):
+    """Application-wide event filter that counts widgets as they are parented, only used while tracing."""
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.ChildAdded and event.child().isWidgetType():
+            tracer.count("widgets created")
+        return False
+
+
+class TraceOverlay(QLabel):
+    """Shows the most recent span timings, refreshed from a timer so any thread may record spans."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        font = self.font()
+        font.setPointSizeF(font.pointSizeF() * 0.85)
+        self.setFont(font)
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(500)
+
+    def refresh(self):
+        spans = tracer.last_spans()[-5:]
+        self.setText("  ".join(f"{name} {duration:.1f} ms" for name, duration in spans))
+
+
+class PendingWritesLabel(QLabel):
+    """Tells whether registry changes are still waiting for the autosaver."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(250)
+
+    def refresh(self):
+        pending = autosaver.pending()
+        if autosaver.error:
+            self.setText(autosaver.error)
+        elif pending:
+            self.setText(f"Saving {pending} file{'s' if pending > 1 else ''}...")
+        else:
+            self.setText("")
+
+
+class RegistryWatcher(QObject):
+    """Pulls the changes other workstations make to a shared registry and announces them.
+
+    Network drives often do not deliver file system notifications, so the change log is
+    polled as well.
+    """
+
+    POLL_INTERVAL = 2000
+    changed = pyqtSignal()
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self._watcher = QFileSystemWatcher([store.folder], self)
+        self._watcher.directoryChanged.connect(self.check)
+        self._watcher.fileChanged.connect(self.check)
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.check)
+        self._timer.start(self.POLL_INTERVAL)
+        self._watch_log()
+
+    def _watch_log(self):
+        # The log is replaced after a compaction
+        if self._watcher.files() != [self.store.log_file]:
+            if self._watcher.files():
+                self._watcher.removePaths(self._watcher.files())
+            self._watcher.addPath(self.store.log_file)
+
+    def check(self):
+        if self.store.poll():
+            self._watch_log()
+            self.changed.emit()
+
+
 class CheckableComboBox(QComboBox):
 
     # Subclass Delegate to increase item height
@@ -70,6 +154,9 @@ class CheckableComboBox(QComboBox):
             size.setHeight(20)
             return size
 
+    # Role QStandardItem.setData stores under by default
+    DATA_ROLE = Qt.ItemDataRole.UserRole.value + 1
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -80,8 +167,15 @@ class CheckableComboBox(QComboBox):
         # Use custom delegate
         self.setItemDelegate(CheckableComboBox.Delegate())
 
+        # Checked rows in model order, mapped to their data, kept in sync incrementally
+        self._checked_rows = []
+        self._checked = {}
+        self._rows_by_data = {}
+        self._text = ""
+        self._elided_for = None
+
         # Update the text when an item is toggled
-        self.model().dataChanged.connect(self.updateText)
+        self._connect(self.model())
 
         # Hide and show popup when clicking the line edit
         self.lineEdit().installEventFilter(self)
@@ -90,6 +184,36 @@ class CheckableComboBox(QComboBox):
         # Prevent popup from closing when clicking on an item
         self.view().viewport().installEventFilter(self)
 
+    # Signals after which the rows of the bookkeeping no longer match the model
+    RESYNC_SIGNALS = ("rowsInserted", "rowsRemoved", "rowsMoved", "layoutChanged", "modelReset")
+
+    def _connect(self, model):
+        model.dataChanged.connect(self._update_checked)
+        for signal in self.RESYNC_SIGNALS:
+            getattr(model, signal).connect(self._resync)
+
+    def setModel(self, model):
+        # Any list model with check states will do, e.g. one shared by several editors
+        previous = self.model()
+        previous.dataChanged.disconnect(self._update_checked)
+        for signal in self.RESYNC_SIGNALS:
+            getattr(previous, signal).disconnect(self._resync)
+        super().setModel(model)
+        self._connect(model)
+        self._resync()
+
+    def _is_checked(self, row):
+        state = self.model().index(row, 0).data(Qt.ItemDataRole.CheckStateRole)
+        return state is not None and Qt.CheckState(state) == Qt.CheckState.Checked
+
+    def _set_checked(self, row, checked):
+        state = Qt.CheckState.Checked if checked else Qt.CheckState.Unchecked
+        self.model().setData(self.model().index(row, 0), state, Qt.ItemDataRole.CheckStateRole)
+
+    def _data(self, row):
+        # What currentData returns, the text itself for rows added with addItems
+        return self.model().index(row, 0).data(self.DATA_ROLE)
+
     def resizeEvent(self, event):
         # Recompute text to elide as needed
         self.updateText()
@@ -109,12 +233,9 @@ class CheckableComboBox(QComboBox):
         if object == self.view().viewport():
             if event.type() == QEvent.Type.MouseButtonRelease:
                 index = self.view().indexAt(event.pos())
-                item = self.model().item(index.row())
-
-                if item.checkState() == Qt.CheckState.Checked:
-                    item.setCheckState(Qt.CheckState.Unchecked)
-                else:
-                    item.setCheckState(Qt.CheckState.Checked)
+                if not index.isValid():
+                    return True
+                self._set_checked(index.row(), not self._is_checked(index.row()))
                 return True
         return False
 
@@ -135,39 +256,109 @@ class CheckableComboBox(QComboBox):
         self.killTimer(event.timerId())
         self.closeOnLineEditClick = False
 
-    def updateText(self):
-        texts = []
-        for i in range(self.model().rowCount()):
-            if self.model().item(i).checkState() == Qt.CheckState.Checked:
-                texts.append(self.model().item(i).text())
-        text = ", ".join(texts)
+    def _set_row_checked(self, row, checked):
+        if checked == (row in self._checked):
+            return False
+        if checked:
+            bisect.insort(self._checked_rows, row)
+            self._checked[row] = self._data(row)
+        else:
+            self._checked_rows.remove(row)
+            del self._checked[row]
+        return True
+
+    def _update_checked(self, top_left, bottom_right, roles=()):
+        if not roles or set(roles) != {Qt.ItemDataRole.CheckStateRole}:
+            # Text or data changed, which is rare next to toggling, the lookups are rebuilt
+            self._resync()
+            return
+        changed = False
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            changed |= self._set_row_checked(row, self._is_checked(row))
+        if changed:
+            self._text = None
+            self.updateText()
+
+    def _resync(self, *args):
+        # Rows were inserted, removed or moved, or the model was reset, rebuild the bookkeeping from scratch
+        self._checked_rows.clear()
+        self._checked.clear()
+        self._rows_by_data.clear()
+        for row in range(self.model().rowCount()):
+            self._rows_by_data[self._data(row)] = row
+            if self._is_checked(row):
+                self._set_row_checked(row, True)
+        self._text = None
+        self.updateText()
 
-        # Compute elided text (with "...")
+    @tracer.traced("CheckableComboBox.updateText")
+    def updateText(self):
+        if self._text is None:
+            self._text = ", ".join(self.model().index(row, 0).data() for row in self._checked_rows)
+
+        # Compute elided text (with "..."), only when the text or the available width changed
+        width = self.lineEdit().width()
+        if self._elided_for == (self._text, width):
+            return
+        self._elided_for = (self._text, width)
         metrics = QFontMetrics(self.lineEdit().font())
-        elidedText = metrics.elidedText(text, Qt.TextElideMode.ElideRight, self.lineEdit().width())
+        elidedText = metrics.elidedText(self._text, Qt.TextElideMode.ElideRight, width)
         self.lineEdit().setText(elidedText)
 
-    def addItem(self, text, checked=False):
+    def _create_item(self, text, checked):
         item = QStandardItem()
         item.setText(text)
         item.setData(text)
         item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsUserCheckable)
         state = Qt.CheckState.Checked if checked else Qt.CheckState.Unchecked
         item.setData(state, Qt.ItemDataRole.CheckStateRole)
-        self.model().appendRow(item)
+        return item
+
+    def addItem(self, text, checked=False):
+        self.addItems([text], [checked])
 
     def addItems(self, texts, checkedlist=None):
+        first_row = self.model().rowCount()
+        items = []
         for i, text in enumerate(texts):
             try:
                 checked = checkedlist[i]
             except (IndexError, TypeError):
                 checked = False
-            self.addItem(text, checked)
+            items.append(self._create_item(text, checked))
+
+        # Insert everything in one go. The view and the combo itself still need rowsInserted, only the
+        # full resync is skipped, the new rows are accounted for below
+        self.model().rowsInserted.disconnect(self._resync)
+        try:
+            self.model().invisibleRootItem().appendRows(items)
+        finally:
+            self.model().rowsInserted.connect(self._resync)
+
+        for row, item in enumerate(items, first_row):
+            self._rows_by_data[item.data()] = row
+            if item.checkState() == Qt.CheckState.Checked:
+                self._set_row_checked(row, True)
+        self._text = None
+        self.updateText()
+
+    def setCheckedData(self, data):
+        # Restore a saved selection, only the rows whose state differs are touched
+        wanted = {self._rows_by_data[value] for value in data if value in self._rows_by_data}
+        changes = [(row, False) for row in self._checked_rows if row not in wanted]
+        changes += [(row, True) for row in wanted if row not in self._checked]
+
+        self.model().dataChanged.disconnect(self._update_checked)
+        try:
+            for row, checked in changes:
+                self._set_checked(row, checked)
+                self._set_row_checked(row, checked)
+        finally:
+            self.model().dataChanged.connect(self._update_checked)
+        if changes:
+            self._text = None
+            self.updateText()
 
     def currentData(self):
         # Return the list of selected items data
-        res = []
-        for i in range(self.model().rowCount()):
-            if self.model().item(i).checkState() == Qt.CheckState.Checked:
-                res.append(self.model().item(i).data())
-        return res
+        return [self._checked[row] for row in self._checked_rows]
@@ -0,0 +1,73 @@
+class SituationIndex:
+    """Situations with their drugs stored as bitsets over interned drug ids.
+
+    Bit i of a situation's bitset is set when the drug with id i belongs to it. Drug names
+    that are referenced by situations but no longer registered still get an id, so they are
+    reported instead of silently disappearing.
+    """
+
+    def __init__(self, drug_names=(), situations=()):
+        self.drug_names = []
+        self.drug_ids = {}
+        for name in drug_names:
+            self.intern(name)
+
+        self.descriptions = []
+        self.bitsets = []
+        self.positions = {}
+        # drug id -> positions of the situations that use it
+        self.users = {}
+        for description, drugs in situations:
+            self.add(description, drugs)
+
+    def intern(self, name):
+        drug_id = self.drug_ids.get(name)
+        if drug_id is None:
+            drug_id = self.drug_ids[name] = len(self.drug_names)
+            self.drug_names.append(name)
+        return drug_id
+
+    def bitset(self, names):
+        bits = 0
+        for name in names:
+            bits |= 1 << self.intern(name)
+        return bits
+
+    def names(self, bits):
+        names = []
+        while bits:
+            low = bits & -bits
+            names.append(self.drug_names[low.bit_length() - 1])
+            bits ^= low
+        return names
+
+    def add(self, description, drugs):
+        position = len(self.descriptions)
+        bits = self.bitset(drugs)
+        self.descriptions.append(description)
+        self.bitsets.append(bits)
+        self.positions[description] = position
+        for name in drugs:
+            self.users.setdefault(self.drug_ids[name], set()).add(position)
+        return position
+
+    def drugs(self, description):
+        return self.names(self.bitsets[self.positions[description]])
+
+    def situations_using(self, drug):
+        drug_id = self.drug_ids.get(drug)
+        if drug_id is None:
+            return []
+        return [self.descriptions[position] for position in sorted(self.users.get(drug_id, ()))]
+
+    def compare(self, expected, answer):
+        # Returns (missed drugs, extra drugs, score), score being the Jaccard similarity
+        expected_bits = self.bitset(expected)
+        answer_bits = self.bitset(answer)
+        union = expected_bits | answer_bits
+        missed = expected_bits & ~answer_bits
+        extra = answer_bits & ~expected_bits
+        if not union:
+            return [], [], 1.0
+        score = (expected_bits & answer_bits).bit_count() / union.bit_count()
+        return self.names(missed), self.names(extra), score
@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from .autosave import atomic_write
+from .constants import ATTEMPTS_LOG, ATTEMPTS_SUMMARY
+
+KINDS = ("drugs", "situations")
+
+log = logging.getLogger(__name__)
+
+
+def _apply(aggregates, record):
+    # Aggregates per item are [attempts, correct answers, summed latency in seconds]
+    entry = aggregates[record["kind"]].setdefault(record["item"], [0, 0, 0.0])
+    entry[0] += 1
+    entry[1] += bool(record["correct"])
+    entry[2] += record["latency"]
+
+
+class AttemptJournal:
+    """Append-only JSONL log of answers, written from a background thread.
+
+    Running aggregates are kept in memory, and a summary of them is stored next to the log
+    together with the log offset it covers, so opening the journal only reads the new tail.
+    """
+
+    def __init__(self, log_file=ATTEMPTS_LOG, summary_file=ATTEMPTS_SUMMARY):
+        self.log_file = log_file
+        self.summary_file = summary_file
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self.aggregates = self._load()
+        # The writer thread keeps its own copy that only covers records already on disk
+        self._written = {kind: {item: list(entry) for item, entry in self.aggregates[kind].items()} for kind in KINDS}
+
+    def _load(self):
+        aggregates = {kind: {} for kind in KINDS}
+        offset = 0
+        if os.path.exists(self.summary_file):
+            with open(self.summary_file, "r") as f:
+                summary = json.loads(f.read())
+            offset = summary["offset"]
+            aggregates.update(summary["aggregates"])
+
+        if not os.path.exists(self.log_file):
+            return aggregates
+        if os.path.getsize(self.log_file) < offset:
+            # The log was replaced, the summary no longer describes it
+            aggregates, offset = {kind: {} for kind in KINDS}, 0
+        with open(self.log_file, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                _apply(aggregates, json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                log.warning("Skipping a damaged record in %s", self.log_file)
+        if end < len(data):
+            # A record cut short by a crash, removed so that the next one starts on a line of its own
+            log.warning("Dropping an incomplete record at the end of %s", self.log_file)
+            with open(self.log_file, "r+b") as f:
+                f.truncate(offset + end)
+        return aggregates
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="attempt-journal", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        f = None
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                if f is None:
+                    f = open(self.log_file, "a")
+                for record in batch:
+                    if record is not None:
+                        f.write(json.dumps(record) + "\n")
+                        _apply(self._written, record)
+                f.flush()
+                self._write_summary(f.tell())
+            except Exception:
+                # The answers stay counted in memory, the next batch reopens the log and tries again
+                log.exception("Could not journal %d answers to %s", len(batch), self.log_file)
+                if f is not None:
+                    try:
+                        f.close()
+                    except OSError:
+                        pass
+                    f = None
+            finally:
+                # flush() waits for these, whatever happened to the batch
+                for _ in batch:
+                    self._queue.task_done()
+            if None in batch:
+                if f is not None:
+                    f.close()
+                return
+
+    def _write_summary(self, offset):
+        atomic_write(self.summary_file, json.dumps({"offset": offset, "aggregates": self._written}))
+
+    def _record(self, record):
+        with self._lock:
+            _apply(self.aggregates, record)
+        self._start()
+        self._queue.put(record)
+
+    def record_drug(self, result, latency):
+        self._record(
+            {
+                "kind": "drugs",
+                "item": result.drug,
+                "weight": result.weight,
+                "dose": result.dose,
+                "unit": result.unit,
+                "correct": result.correct,
+                "latency": latency,
+                "timestamp": time.time(),
+            }
+        )
+
+    def record_situation(self, description, answer, correct, latency):
+        self._record(
+            {
+                "kind": "situations",
+                "item": description,
+                "answer": list(answer),
+                "correct": correct,
+                "latency": latency,
+                "timestamp": time.time(),
+            }
+        )
+
+    def stats(self, kind):
+        # Returns {item: (attempts, accuracy, mean latency)} straight from the running aggregates
+        with self._lock:
+            return {
+                item: (attempts, correct / attempts, latency / attempts)
+                for item, (attempts, correct, latency) in self.aggregates[kind].items()
+            }
+
+    def flush(self):
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+_journal = None
+
+
+def get_journal():
+    global _journal
+    if _journal is None:
+        _journal = AttemptJournal()
+    return _journal
+
+
+def close_journal():
+    if _journal is not None:
+        _journal.close()
@@ -0,0 +1,353 @@
+from PyQt6.QtCore import (
+    QAbstractListModel,
+    QAbstractTableModel,
+    QModelIndex,
+    QRegularExpression,
+    Qt,
+)
+from PyQt6.QtGui import QRegularExpressionValidator
+from PyQt6.QtWidgets import QComboBox, QLineEdit, QPlainTextEdit, QStyledItemDelegate
+
+from .constants import units
+from .helpers import CheckableComboBox
+
+
+class RowTableModel(QAbstractTableModel):
+    """Table over a list of rows under fixed column headers, read-only unless a subclass says otherwise."""
+
+    HEADERS = []
+
+    def __init__(self, rows, parent=None):
+        super().__init__(parent)
+        self._rows = rows
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        return self.cells(self._rows[index.row()])[index.column()]
+
+    def cells(self, row):
+        # The displayed text of each column
+        raise NotImplementedError
+
+
+class RegistryTableModel(RowTableModel):
+    """Editable registry table that remembers which rows were touched since the last save."""
+
+    def __init__(self, rows, originals, parent=None):
+        super().__init__(rows, parent)
+        # Key each row had when it was loaded, None for rows added in this session
+        self._originals = originals
+        self._dirty = set()
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return self._rows[index.row()][index.column()]
+        return None
+
+    def flags(self, index):
+        return super().flags(index) | Qt.ItemFlag.ItemIsEditable
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid() or role != Qt.ItemDataRole.EditRole:
+            return False
+        row = self._rows[index.row()]
+        if isinstance(value, str):
+            value = value.strip()
+        if row[index.column()] == value:
+            return False
+        row[index.column()] = value
+        self._dirty.add(index.row())
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def _empty_row(self):
+        return [""] * len(self.HEADERS)
+
+    def _values(self, row):
+        return self._rows[row]
+
+    def add_row(self):
+        position = len(self._rows)
+        self.beginInsertRows(QModelIndex(), position, position)
+        self._rows.append(self._empty_row())
+        self._originals.append(None)
+        self.endInsertRows()
+        return position
+
+    def key(self, row):
+        return self._rows[row][0]
+
+    def is_dirty(self, row):
+        return row in self._dirty
+
+    def is_modified(self):
+        return bool(self._dirty)
+
+    def edited_rows(self):
+        # Yields (row, previous key, current values) for every row edited since the last save
+        for row in sorted(self._dirty):
+            yield row, self._originals[row], self._values(row)
+
+    def dirty_rows(self):
+        for _, previous, values in self.edited_rows():
+            yield previous, values
+
+    def mark_clean(self):
+        for row in self._dirty:
+            self._originals[row] = self._rows[row][0] or None
+        self._dirty.clear()
+
+
+class DrugTableModel(RegistryTableModel):
+    HEADERS = ["Substance Name", "Unit", "Minimum dose", "Maximum dose", "Concentration (mg/ml)"]
+    NAME, UNIT, MIN_DOSE, MAX_DOSE, CONCENTRATION = range(5)
+
+    def __init__(self, drugs, parent=None):
+        rows = [
+            [name, info["unit"], str(info["min_dose"]), str(info["max_dose"]), str(info.get("concentration", ""))]
+            for name, info in drugs.items()
+        ]
+        super().__init__(rows, list(drugs), parent)
+
+    def _empty_row(self):
+        return ["", units[0], "", "", ""]
+
+
+class DrugListModel(QAbstractListModel):
+    """Single list of substance names shared by every situation row, row number doubles as drug id.
+
+    The drug editor of the row being edited shows it directly, so the check states belong to
+    that row until the next one is opened.
+    """
+
+    def __init__(self, names, parent=None):
+        super().__init__(parent)
+        self.names = list(names)
+        self.ids = {name: drug_id for drug_id, name in enumerate(self.names)}
+        self.checked = set()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.CheckStateRole:
+            return Qt.CheckState.Checked if index.row() in self.checked else Qt.CheckState.Unchecked
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole, CheckableComboBox.DATA_ROLE):
+            return self.names[index.row()]
+        return None
+
+    def flags(self, index):
+        return super().flags(index) | Qt.ItemFlag.ItemIsUserCheckable
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid() or role != Qt.ItemDataRole.CheckStateRole:
+            return False
+        if Qt.CheckState(value) == Qt.CheckState.Checked:
+            self.checked.add(index.row())
+        else:
+            self.checked.discard(index.row())
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def to_ids(self, names):
+        # Names that are no longer registered cannot be selected, so they are dropped
+        return frozenset(self.ids[name] for name in names if name in self.ids)
+
+    def to_names(self, drug_ids):
+        return [self.names[drug_id] for drug_id in sorted(drug_ids)]
+
+
+class DrugSearchModel(QAbstractListModel):
+    """Search results with a check box per substance, checked names survive new searches."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.results = []
+        # Kept in the order they were checked, which is the order a drill goes through them
+        self.checked = {}
+
+    def set_results(self, names):
+        self.beginResetModel()
+        self.results = names
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.results)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        name = self.results[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return name
+        if role == Qt.ItemDataRole.CheckStateRole:
+            return Qt.CheckState.Checked if name in self.checked else Qt.CheckState.Unchecked
+        return None
+
+    def flags(self, index):
+        return super().flags(index) | Qt.ItemFlag.ItemIsUserCheckable
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid() or role != Qt.ItemDataRole.CheckStateRole:
+            return False
+        name = self.results[index.row()]
+        if Qt.CheckState(value) == Qt.CheckState.Checked:
+            self.checked[name] = None
+        else:
+            self.checked.pop(name, None)
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def keep_checked(self, names):
+        # Drops checked substances that are no longer registered
+        self.checked = {name: None for name in self.checked if name in names}
+
+
+class SituationTableModel(RegistryTableModel):
+    HEADERS = ["Situation description", "Drugs"]
+    DESCRIPTION, DRUGS = range(2)
+
+    def __init__(self, situations, drug_list, parent=None):
+        self.drug_list = drug_list
+        # Untouched rows keep their stored names, edited rows hold a frozenset of drug ids
+        rows = [[description, list(drugs)] for description, drugs in situations]
+        super().__init__(rows, [description for description, _ in situations], parent)
+
+    def _empty_row(self):
+        return ["", frozenset()]
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        # Stored names and edited ids are compared as ids, reopening a row without changes keeps it clean
+        if index.isValid() and index.column() == self.DRUGS and frozenset(value) == self.selection(index.row()):
+            return False
+        return super().setData(index, value, role)
+
+    def selection(self, row):
+        drugs = self._rows[row][self.DRUGS]
+        return drugs if isinstance(drugs, frozenset) else self.drug_list.to_ids(drugs)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if index.column() == self.DRUGS:
+            if role == Qt.ItemDataRole.DisplayRole:
+                return ", ".join(self.drug_names(index.row()))
+            if role == Qt.ItemDataRole.EditRole:
+                return self.selection(index.row())
+            return None
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return self._rows[index.row()][self.DESCRIPTION]
+        return super().data(index, role)
+
+    def drug_names(self, row):
+        drugs = self._rows[row][self.DRUGS]
+        return self.drug_list.to_names(drugs) if isinstance(drugs, frozenset) else drugs
+
+    def _values(self, row):
+        return self._rows[row][self.DESCRIPTION], self.drug_names(row)
+
+
+class StatsTableModel(RowTableModel):
+    """Read-only view over the journal aggregates, one row per substance or situation."""
+
+    HEADERS = ["Item", "Attempts", "Accuracy", "Mean response time"]
+
+    def __init__(self, stats, parent=None):
+        super().__init__(sorted(stats.items()), parent)
+
+    def cells(self, row):
+        item, (attempts, accuracy, latency) = row
+        return [item, str(attempts), f"{accuracy:.0%}", f"{latency:.1f} s"]
+
+
+class ExamTableModel(RowTableModel):
+    """Read-only exam summary, one row per question in the order they were asked."""
+
+    HEADERS = ["Question", "Answer", "Result", "Response time"]
+
+    def cells(self, row):
+        result = "Correct" if row.correct else row.error or "Wrong"
+        return [row.question, row.answer, result, f"{row.latency:.1f} s"]
+
+
+class UnitDelegate(QStyledItemDelegate):
+    def createEditor(self, parent, option, index):
+        editor = QComboBox(parent)
+        editor.addItems(units)
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setCurrentText(index.data(Qt.ItemDataRole.EditRole))
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText(), Qt.ItemDataRole.EditRole)
+
+
+class DoseDelegate(QStyledItemDelegate):
+    # Accepts both decimal separators, make_float normalizes them on save. A lone separator is only
+    # intermediate input, rows are validated again before they are saved
+    VALIDATOR_PATTERN = QRegularExpression(r"^\d+([.,]\d*)?$|^[.,]\d+$")
+
+    def createEditor(self, parent, option, index):
+        editor = QLineEdit(parent)
+        editor.setValidator(QRegularExpressionValidator(self.VALIDATOR_PATTERN, editor))
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setText(index.data(Qt.ItemDataRole.EditRole))
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.text(), Qt.ItemDataRole.EditRole)
+
+
+class DescriptionDelegate(QStyledItemDelegate):
+    def createEditor(self, parent, option, index):
+        return QPlainTextEdit(parent)
+
+    def setEditorData(self, editor, index):
+        editor.setPlainText(index.data(Qt.ItemDataRole.EditRole))
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.toPlainText(), Qt.ItemDataRole.EditRole)
+
+    def updateEditorGeometry(self, editor, option, index):
+        # Give multi-line descriptions some room while they are being edited
+        rect = option.rect
+        rect.setHeight(max(rect.height(), 4 * option.fontMetrics.height()))
+        editor.setGeometry(rect)
+
+
+class DrugSelectionDelegate(QStyledItemDelegate):
+    """Opens a single checkable drug list for the situation being edited."""
+
+    def __init__(self, drug_list, parent=None):
+        super().__init__(parent)
+        self.drug_list = drug_list
+
+    def createEditor(self, parent, option, index):
+        # No items of its own, the editor shows the shared list
+        editor = CheckableComboBox(parent)
+        editor.setModel(self.drug_list)
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setCheckedData(self.drug_list.to_names(index.data(Qt.ItemDataRole.EditRole)))
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, self.drug_list.to_ids(editor.currentData()), Qt.ItemDataRole.EditRole)
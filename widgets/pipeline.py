@@ -0,0 +1,95 @@
+import random
+from collections import deque, namedtuple
+
+from .engine import MAX_WEIGHT, MIN_WEIGHT, get_engine
+
+# Questions kept ready per kind
+PREFETCH = 8
+
+DrugQuestion = namedtuple("DrugQuestion", "drug weight")
+SituationQuestion = namedtuple("SituationQuestion", "description drugs")
+
+
+class QuestionPipeline:
+    """Prepares the next questions ahead of time from seeded random generators.
+
+    Each kind of question has its own generator derived from the session seed, so the same
+    seed over the same registry replays a drill session exactly, whichever quizzes are mixed.
+    Prepared questions are dropped when the registry changes.
+    """
+
+    KINDS = ("drugs", "situations", "weights")
+
+    def __init__(self, seed=None, depth=PREFETCH):
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.depth = depth
+        self.rngs = {kind: random.Random(f"{self.seed}:{kind}") for kind in self.KINDS}
+        self.queues = {kind: deque() for kind in self.KINDS}
+        self._engine = None
+
+    def _current_engine(self):
+        engine = get_engine()
+        if engine is not self._engine:
+            self._engine = engine
+            for queue in self.queues.values():
+                queue.clear()
+        return engine
+
+    def _draw(self, kind, engine):
+        rng = self.rngs[kind]
+        if kind == "drugs":
+            return DrugQuestion(rng.choice(engine.names), rng.randint(MIN_WEIGHT, MAX_WEIGHT))
+        if kind == "situations":
+            return SituationQuestion(*rng.choice(engine.situations))
+        return rng.randint(MIN_WEIGHT, MAX_WEIGHT)
+
+    def fill(self, kind):
+        # Tops the queue up, meant to run while the current question is being answered
+        engine = self._current_engine()
+        if (kind == "drugs" and not engine.names) or (kind == "situations" and not engine.situations):
+            return
+        queue = self.queues[kind]
+        while len(queue) < self.depth:
+            queue.append(self._draw(kind, engine))
+
+    def next(self, kind):
+        # Returns None when the registry has nothing to ask
+        self._current_engine()
+        queue = self.queues[kind]
+        if not queue:
+            self.fill(kind)
+        return queue.popleft() if queue else None
+
+    def choose(self, kind, items):
+        # Draws from a narrowed down selection with the generator of that kind
+        return self.rngs[kind].choice(items)
+
+    def weighted(self, kind, sampler):
+        # Draws from a weighted sampler with the generator of that kind
+        return sampler.draw(self.rngs[kind])
+
+    def next_drug(self):
+        return self.next("drugs")
+
+    def next_situation(self):
+        return self.next("situations")
+
+    def next_weight(self):
+        return self.next("weights")
+
+
+_pipeline = None
+
+
+def get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = QuestionPipeline()
+    return _pipeline
+
+
+def start_pipeline(seed=None):
+    # Starts a new session, with a fresh random seed unless one is given to replay a session
+    global _pipeline
+    _pipeline = QuestionPipeline(seed)
+    return _pipeline
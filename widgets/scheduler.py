@@ -0,0 +1,98 @@
+import heapq
+import itertools
+import json
+import os
+import time
+
+from .adaptive import PerKind
+from .autosave import autosaver
+from .constants import REVIEW_DRUGS, REVIEW_SITUATIONS
+
+# Seconds until an item is due again, indexed by its Leitner box
+INTERVALS = [30, 5 * 60, 30 * 60, 24 * 3600, 3 * 24 * 3600, 7 * 24 * 3600, 21 * 24 * 3600]
+
+
+class ReviewScheduler:
+    """Leitner boxes with a heap keyed by due time.
+
+    A wrong answer sends the item back to the first box, a right one moves it up one box.
+    Outdated heap entries are skipped when they surface instead of being removed eagerly.
+    """
+
+    def __init__(self, kind, state_file):
+        self.kind = kind
+        self.state_file = state_file
+        self.state = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._items = None
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file, "r") as f:
+                self.state = {key: tuple(value) for key, value in json.loads(f.read()).items()}
+        self._rebuild_heap()
+
+    def flush(self):
+        if not self._dirty:
+            return
+        # A copy, the writer thread serializes it later while answers keep coming in
+        autosaver.schedule(self.state_file, dict(self.state), backup=False)
+        self._dirty = False
+
+    def _rebuild_heap(self):
+        self._heap = [(due, next(self._counter), key) for key, (box, due) in self.state.items()]
+        heapq.heapify(self._heap)
+
+    def sync(self, items):
+        # New items are due right away, items that left the registry are forgotten
+        if items is self._items:
+            return
+        self._items = items
+        items = set(items)
+        removed = self.state.keys() - items
+        for key in removed:
+            del self.state[key]
+        added = [key for key in items if key not in self.state]
+        for key in added:
+            self.state[key] = (0, 0)
+        if removed:
+            self._rebuild_heap()
+        else:
+            for key in added:
+                heapq.heappush(self._heap, (0, next(self._counter), key))
+        self._dirty |= bool(removed or added)
+
+    def next(self):
+        # Returns the item due the earliest, even if it is not due yet
+        while self._heap:
+            due, _, key = self._heap[0]
+            if key in self.state and self.state[key][1] == due:
+                return key
+            heapq.heappop(self._heap)
+        return None
+
+    def record(self, key, correct, now=None):
+        now = time.time() if now is None else now
+        box = self.state.get(key, (0, 0))[0]
+        box = min(box + 1, len(INTERVALS) - 1) if correct else 0
+        due = now + INTERVALS[box]
+        self.state[key] = (box, due)
+        heapq.heappush(self._heap, (due, next(self._counter), key))
+        self._dirty = True
+        # Drop the outdated entries once they make up most of the heap
+        if len(self._heap) > 2 * len(self.state) + 16:
+            self._rebuild_heap()
+
+
+_schedulers = PerKind(ReviewScheduler, {"drugs": REVIEW_DRUGS, "situations": REVIEW_SITUATIONS})
+
+
+def get_scheduler(kind):
+    return _schedulers.get(kind)
+
+
+def flush_schedulers():
+    _schedulers.flush()
@@ -1,26 +1,30 @@
-import json
-import random
+import time
 
+from PyQt6.QtCore import QTimer
 from PyQt6.QtWidgets import (
     QComboBox,
+    QFrame,
     QGridLayout,
+    QHBoxLayout,
+    QHeaderView,
     QLabel,
     QLineEdit,
+    QListView,
     QPushButton,
-    QTextEdit,
+    QTableView,
     QVBoxLayout,
-    QWidget,
 )
 
-from .constants import DRUGS_REGISTRY, SITUATIONS_REGISTRY
-from .helpers import (
-    CheckableComboBox,
-    check_answer,
-    make_float,
-    read_current_drugs,
-    read_current_situations,
-    units,
-)
+from .adaptive import get_sampler
+from .constants import units
+from .engine import get_engine
+from .fulltext import get_text_index
+from .helpers import CheckableComboBox, set_view_model
+from .journal import get_journal
+from .models import DrugSearchModel, ExamTableModel, StatsTableModel
+from .pipeline import get_pipeline
+from .scheduler import get_scheduler
+from .tracing import tracer
 
 
 def _create_unit_box():
@@ -29,16 +33,24 @@ def _create_unit_box():
     return unit
 
 
-class AnswerWindow(QWidget):
-    def __init__(self, message):
+class ResultPanel(QFrame):
+    """Non-modal panel under the screens with the outcome of the last answer, reused for every answer."""
+
+    def __init__(self):
         super().__init__()
-        self.layout = QVBoxLayout()
-        self.setLayout(self.layout)
-        self.label = QLabel(message)
-        self.layout.addWidget(self.label)
+        self.setFrameShape(QFrame.Shape.StyledPanel)
+        layout = QHBoxLayout(self)
+        self.label = QLabel()
+        self.label.setWordWrap(True)
+        layout.addWidget(self.label, 1)
         self.button = QPushButton("OK")
-        self.button.clicked.connect(self.close)
-        self.layout.addWidget(self.button)
+        self.button.clicked.connect(self.hide)
+        layout.addWidget(self.button)
+        self.hide()
+
+    def show_message(self, message):
+        self.label.setText(message)
+        self.show()
 
 
 class StartMenu(QVBoxLayout):
@@ -47,6 +59,12 @@ class StartMenu(QVBoxLayout):
         self.random_quiz = QPushButton("Start quiz with random substances")
         self.choice_quiz = QPushButton("Start quiz with chosen substances")
         self.situation_quiz = QPushButton("Start quiz with situations")
+        self.stats = QPushButton("Show statistics")
+        self.review_quiz = QPushButton("Review substances due for repetition")
+        self.review_situation_quiz = QPushButton("Review situations due for repetition")
+        self.weak_quiz = QPushButton("Practice weak substances")
+        self.weak_situation_quiz = QPushButton("Practice weak situations")
+        self.exam = QPushButton("Start timed exam")
         self.register_drug = QPushButton("Register substances")
         self.register_situation = QPushButton("Register situations")
 
@@ -54,6 +72,12 @@ class StartMenu(QVBoxLayout):
             self.random_quiz,
             self.choice_quiz,
             self.situation_quiz,
+            self.review_quiz,
+            self.review_situation_quiz,
+            self.weak_quiz,
+            self.weak_situation_quiz,
+            self.exam,
+            self.stats,
             self.register_drug,
             self.register_situation,
         ]
@@ -62,175 +86,135 @@ class StartMenu(QVBoxLayout):
             self.addWidget(button)
 
 
-class RegisterDrugs(QGridLayout):
+class SituationQuiz(QGridLayout):
     def __init__(self):
         super().__init__()
-        current_drugs = read_current_drugs()
-
-        labels = ["Substance Name", "Unit", "Minimum dose", "Maximum dose"]
-        for i, label in enumerate(labels):
-            self.addWidget(QLabel(label), 0, i)
+        self._drug_names = None
 
-        for drug, info in current_drugs.items():
-            line = self._create_form_line()
-            self._fill_up_line(line, drug, info)
-            self._add_line(line)
+        self.empty_labels = [
+            QLabel("No situations or substances registered!"),
+            QLabel("Register situations and substances on the home screen"),
+        ]
+        for row, label in enumerate(self.empty_labels, 1):
+            self.addWidget(label, row, 0)
 
-        line = self._create_form_line()
-        self._add_line(line)
+        self.header_labels = [QLabel("Situation description"), QLabel("Drugs")]
+        for i, label in enumerate(self.header_labels):
+            self.addWidget(label, 0, i)
+        self.description = QLabel()
+        self.drugs_box = CheckableComboBox()
+        self.addWidget(self.description, 1, 0)
+        self.addWidget(self.drugs_box, 1, 1)
 
-        self.save_button = QPushButton("Save")
-        self.add_new_line_button = QPushButton("Add new line")
-        self.add_new_line_button.clicked.connect(lambda: self._add_line(self._create_form_line()))
-        self.cancel_button = QPushButton("Cancel")
+        # Random questions can be narrowed down to the situations matching a topic
+        self.topic_label = QLabel("Topic")
+        self.topic_box = QLineEdit()
+        self.topic_box.setPlaceholderText("Any situation")
+        self.topic_box.setClearButtonEnabled(True)
+        self.topic_box.returnPressed.connect(self.redraw)
+        self.addWidget(self.topic_label, 3, 0)
+        self.addWidget(self.topic_box, 3, 1)
 
-    def _create_form_line(self):
-        name = QLineEdit()
-        unit = _create_unit_box()
-        min_dose = QLineEdit()
-        max_dose = QLineEdit()
-        return name, unit, min_dose, max_dose
-
-    def _fill_up_line(self, line, drug, info):
-        line[0].setText(drug)
-        line[1].setCurrentText(info["unit"])
-        line[2].setText(str(info["min_dose"]))
-        line[3].setText(str(info["max_dose"]))
-
-    def _add_line(self, line):
-        index = self.rowCount() + 1
-        for i in range(len(line)):
-            self.addWidget(line[i], index, i)
-
-    def save(self):
-        drugs = {}
-        for i in range(1, self.rowCount()):
-            if self.itemAtPosition(i, 0) is None or not self.itemAtPosition(i, 0).widget().text():
-                continue
-            name = self.itemAtPosition(i, 0).widget().text()
-            drugs[name] = {
-                "unit": self.itemAtPosition(i, 1).widget().currentText(),
-                "min_dose": make_float(self.itemAtPosition(i, 2).widget().text()),
-                "max_dose": make_float(self.itemAtPosition(i, 3).widget().text()),
-            }
-
-        with open(DRUGS_REGISTRY, "w") as f:
-            f.write(json.dumps(drugs))
-
-
-class RegisterSituation(QGridLayout):
-    def __init__(self):
-        super().__init__()
-        current_drugs = read_current_drugs()
-        current_situations = read_current_situations()
-        labels = ["Situation description", "Drugs"]
-        for i, label in enumerate(labels):
-            self.addWidget(QLabel(label), 0, i)
-
-        index = 1
-
-        for situation, drugs in current_situations:
-            description = QTextEdit()
-            description.setText(situation)
-            drugs_states = []
-            for d in current_drugs:
-                drugs_states.append(d in drugs)
-
-            drugs_box = CheckableComboBox()
-            drugs_box.addItems(current_drugs, drugs_states)
-
-            self.addWidget(description, index, 0)
-            self.addWidget(drugs_box, index, 1)
-            index += 1
-
-        self.add_line(current_drugs)
-
-        self.save_button = QPushButton("Save")
-        self.save_button.clicked.connect(self.save)
-        self.add_new_line_button = QPushButton("Add new line")
-        self.add_new_line_button.clicked.connect(lambda: self.add_line(current_drugs))
+        self.answer_button = QPushButton("Answer")
+        self.next_button = QPushButton("Next question")
         self.cancel_button = QPushButton("Cancel")
 
-    def add_line(self, current_drugs):
-        index = self.rowCount() + 1
-        situation = QTextEdit()
-        drugs = CheckableComboBox()
-        drugs.addItems(current_drugs)
-        self.addWidget(situation, index, 0)
-        self.addWidget(drugs, index, 1)
-        index += 1
-
-    def save(self):
-        situations = []
-        for i in range(1, self.rowCount()):
-            if self.itemAtPosition(i, 0) is None or not self.itemAtPosition(i, 0).widget().toPlainText():
-                continue
-            situation = self.itemAtPosition(i, 0).widget().toPlainText()
-            drugs = self.itemAtPosition(i, 1).widget().currentData()
-            situations.append((situation, drugs))
-
-        with open(SITUATIONS_REGISTRY, "w") as f:
-            f.write(json.dumps(situations))
-
-
-class SituationQuiz(QGridLayout):
-    def __init__(self):
-        super().__init__()
-        current_situations = read_current_situations()
-        current_drugs = read_current_drugs()
-        current_drugs = list(current_drugs.keys())
-        if not current_situations or not current_drugs:
-            self.draw_empty()
-        else:
+    def reset(self, mode="random", question=None):
+        # Called on every navigation, once the layout is installed on its page
+        self.mode = mode
+        self.question = question
+        # From the engine, which does not need the registries parsed
+        engine = get_engine()
+        current_situations = engine.situations
+        current_drugs = list(engine.names)
+        empty = not current_situations or not current_drugs
+
+        for label in self.empty_labels:
+            label.setVisible(empty)
+        for widget in self.header_labels + [self.description, self.drugs_box, self.answer_button]:
+            widget.setVisible(not empty)
+        for widget in (self.topic_label, self.topic_box):
+            widget.setVisible(not empty and mode == "random" and question is None)
+        self.next_button.hide()
+        if not empty:
             self.draw_question(current_situations, current_drugs)
 
-        self.cancel_button = QPushButton("Cancel")
+    def redraw(self):
+        # A new topic applies right away, unless the current question was already answered
+        if self.answer_button.isVisible() or not self.next_button.isVisible():
+            self.answer_button.show()
+            engine = get_engine()
+            self.draw_question(engine.situations, list(engine.names))
 
-    def draw_empty(self):
-        self.addWidget(QLabel("No situations or substances registered!"), 1, 0)
-        self.addWidget(QLabel("Register situations and substances on the home screen"), 2, 0)
-    
     def draw_question(self, current_situations, current_drugs):
-        random_item = random.choice(current_situations)
+        engine = get_engine()
+        topic = self.topic_box.text().strip()
+        if self.question is not None:
+            random_item = self.question
+        elif self.mode == "review":
+            scheduler = get_scheduler("situations")
+            scheduler.sync(engine.situation_names)
+            description = scheduler.next()
+            random_item = description, engine.situation_lookup[description]
+        elif self.mode == "weak":
+            sampler = get_sampler("situations")
+            sampler.sync(engine.situation_names)
+            description = get_pipeline().weighted("situations", sampler)
+            random_item = description, engine.situation_lookup[description]
+        elif topic and self.mode == "random":
+            matches = [description for description, _ in get_text_index().search(topic, limit=None)]
+            if not matches:
+                self.correct_answer = None
+                self.description.setText(f'No situation matches the topic "{topic}"')
+                self.answer_button.hide()
+                return
+            description = get_pipeline().choose("situations", matches)
+            random_item = description, engine.situation_lookup[description]
+        else:
+            random_item = get_pipeline().next_situation()
+            # The following questions are drawn once this one is on screen
+            QTimer.singleShot(0, lambda: get_pipeline().fill("situations"))
         self.correct_answer = random_item[1]
+        self.description.setText(random_item[0])
+        self.shown_at = time.monotonic()
+
+        # The drug list only has to be rebuilt when the registry changed
+        if self._drug_names != current_drugs:
+            self._drug_names = current_drugs
+            self.drugs_box.clear()
+            self.drugs_box.addItems(current_drugs)
+        else:
+            self.drugs_box.setCheckedData([])
 
-        labels = ["Situation description", "Drugs"]
-        for i, label in enumerate(labels):
-            self.addWidget(QLabel(label), 0, i)
-        description = QLabel(random_item[0])
-
-        self.drugs_box = CheckableComboBox()
-        self.drugs_box.addItems(current_drugs)
-
-        self.addWidget(description, 1, 0)
-        self.addWidget(self.drugs_box, 1, 1)
-
-        self.answer_button = QPushButton("Answer")
+    def show_answered(self):
+        self.answer_button.hide()
+        self.next_button.show()
 
+    def current_answer(self):
+        return self.drugs_box.currentData()
 
     def answer(self):
-        answer = self.drugs_box.currentData()
-        if self.correct_answer == answer:
-            message = "Correct!"
-        else:
-            correct_answer = "\n".join(self.correct_answer)
-            message = f"Incorrect.\nCorrect answer is:\n\n{correct_answer}"
-        self.answer_window = AnswerWindow(message)
-        self.answer_window.show()
+        answer = self.current_answer()
+        result = get_engine().grade_situation(self.correct_answer, answer)
+        latency = time.monotonic() - self.shown_at
+        get_journal().record_situation(self.description.text(), answer, result.correct, latency)
+        get_sampler("situations").record(self.description.text(), result.correct, latency)
+        if self.mode == "review":
+            get_scheduler("situations").record(self.description.text(), result.correct)
+        return result
 
 
 class DrugQuiz(QGridLayout):
-    def __init__(self, drug, quiz_type):
+    def __init__(self, drug=None, quiz_type=None):
         super().__init__()
 
-        self.quiz_type = quiz_type
-        self.drug = drug
         self.addWidget(QLabel("Substance name"), 0, 0)
-        self.addWidget(QLabel(drug), 1, 0)
+        self.drug_label = QLabel()
+        self.addWidget(self.drug_label, 1, 0)
 
         self.addWidget(QLabel("Patient weight"), 0, 1)
-        self.weigth = random.randint(40, 160)
-        self.addWidget(QLabel(f"{self.weigth} kg"), 1, 1)
+        self.weigth_label = QLabel()
+        self.addWidget(self.weigth_label, 1, 1)
 
         self.addWidget(QLabel("Dose"), 0, 2)
         self.dose = QLineEdit()
@@ -241,32 +225,145 @@ class DrugQuiz(QGridLayout):
         self.addWidget(self.unit, 1, 3)
 
         self.answer_button = QPushButton("Answer")
+        self.next_button = QPushButton("Next question")
         self.cancel_button = QPushButton("Cancel")
 
+        if drug is not None:
+            self.rebind(drug, quiz_type)
+
+    def rebind(self, drug, quiz_type, weigth=None):
+        # Swap in a new question without rebuilding any widget
+        self.quiz_type = quiz_type
+        self.drug = drug
+        if weigth is None:
+            weigth = get_pipeline().next_weight()
+            QTimer.singleShot(0, lambda: get_pipeline().fill("weights"))
+        self.weigth = weigth
+        self.drug_label.setText(drug)
+        self.weigth_label.setText(f"{self.weigth} kg")
+        self.dose.clear()
+        self.unit.setCurrentIndex(0)
+        self.answer_button.show()
+        self.next_button.hide()
+        self.shown_at = time.monotonic()
+
+    def show_answered(self):
+        self.answer_button.hide()
+        self.next_button.show()
+
+    def current_answer(self):
+        return self.dose.text(), self.unit.currentText()
+
     def answer(self):
-        message = check_answer(self.drug, self.weigth, self.dose.text(), self.unit.currentText())
-        self.answer_window = AnswerWindow(message)
-        self.answer_window.show()
+        result = get_engine().grade(self.drug, self.weigth, *self.current_answer())
+        latency = time.monotonic() - self.shown_at
+        get_journal().record_drug(result, latency)
+        get_sampler("drugs").record(self.drug, result.correct, latency)
+        if self.quiz_type == "review":
+            get_scheduler("drugs").record(self.drug, result.correct)
+        return result
 
 
 class ChooseDrugQuiz(QVBoxLayout):
+    # Matches shown per search, the list stays cheap to reset on every keystroke
+    MAX_RESULTS = 200
+
     def __init__(self):
         super().__init__()
-        all_options = read_current_drugs()
-        options = list(all_options.keys())
-        if not options:
-            self.draw_empty()
-        else:
-            self.draw_question(options)
+        self._index = None
+        self.empty_label = QLabel("No substances registered!\nRegister substances on the home screen")
+        self.addWidget(self.empty_label)
+
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("Search substances")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textChanged.connect(self.filter)
+        self.addWidget(self.search_box)
+
+        self.results = DrugSearchModel()
+        self.results.dataChanged.connect(self._update_selection_label)
+        self.results_view = QListView()
+        self.results_view.setUniformItemSizes(True)
+        self.results_view.setModel(self.results)
+        self.addWidget(self.results_view)
+        self.selection_label = QLabel()
+        self.addWidget(self.selection_label)
 
+        self.start_button = QPushButton("Start quiz")
         self.cancel_button = QPushButton("Cancel")
-    
-    def draw_empty(self):
-        self.addWidget(QLabel("No substances registered!\nRegister substances on the home screen"))
-    
-    def draw_options(self, options):
-        self.combo_options = QComboBox()
-        self.combo_options.addItems(options)
-        self.addWidget(self.combo_options)
 
-        self.start_button = QPushButton("Start quiz")
+    def reset(self):
+        engine = get_engine()
+        options = bool(engine.names)
+        for widget in (self.search_box, self.results_view, self.selection_label, self.start_button):
+            widget.setVisible(options)
+        self.empty_label.setVisible(not options)
+        if engine.search_index is not self._index:
+            self._index = engine.search_index
+            self.results.keep_checked(engine.index)
+            self.filter(self.search_box.text())
+        self.search_box.setFocus()
+
+    @tracer.traced("drug search")
+    def filter(self, text):
+        self.results.set_results(self._index.search(text, self.MAX_RESULTS))
+        if self.results.results:
+            self.results_view.setCurrentIndex(self.results.index(0))
+        self._update_selection_label()
+
+    def _update_selection_label(self):
+        shown = len(self.results.results)
+        text = f"{len(self.results.checked)} selected"
+        if shown == self.MAX_RESULTS:
+            text += f", showing the first {shown} matches"
+        self.selection_label.setText(text)
+
+    def chosen(self):
+        # The checked substances, or the highlighted one when nothing is checked
+        if self.results.checked:
+            return list(self.results.checked)
+        current = self.results_view.currentIndex()
+        return [self.results.results[current.row()]] if current.isValid() else []
+
+
+class StatsScreen(QVBoxLayout):
+    def __init__(self):
+        super().__init__()
+        self.views = {}
+        for kind, title in (("drugs", "Substances"), ("situations", "Situations")):
+            view = QTableView()
+            view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+            view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+            self.addWidget(QLabel(title))
+            self.addWidget(view)
+            self.views[kind] = view
+
+        self.cancel_button = QPushButton("Back")
+
+    def reset(self):
+        # Aggregates are maintained while answering, nothing is read back from the log here
+        journal = get_journal()
+        for kind, view in self.views.items():
+            set_view_model(view, StatsTableModel(journal.stats(kind), view))
+
+
+class ExamSummary(QVBoxLayout):
+    def __init__(self):
+        super().__init__()
+        self.score_label = QLabel()
+        self.addWidget(self.score_label)
+        self.view = QTableView()
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.addWidget(self.view)
+
+        self.cancel_button = QPushButton("Back")
+
+    def reset(self, exam):
+        rows = exam.rows
+        elapsed = exam.elapsed
+        self.score_label.setText(
+            f"Score {exam.score}/{len(rows)} ({exam.score / max(len(rows), 1):.0%}), "
+            f"answered {exam.position} questions in {int(elapsed // 60)}:{int(elapsed % 60):02d} (seed {exam.seed})"
+        )
+        set_view_model(self.view, ExamTableModel(rows, self.view))
@@ -0,0 +1,91 @@
+import bisect
+import re
+from collections import Counter
+
+_WORD = re.compile(r"\w+")
+
+# Share of the query trigrams a name must contain to count as a fuzzy match
+FUZZY_THRESHOLD = 0.5
+
+
+def _fold(text):
+    return " ".join(_WORD.findall(text.casefold()))
+
+
+def _trigrams(text, padded=True):
+    if padded:
+        text = f"  {text} "
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """Type-ahead search over substance names.
+
+    Word prefixes are kept in a sorted array and found with bisect, which answers the same
+    range queries as a prefix trie. A trigram index catches matches in the middle of a word
+    ("adrenal" finds "Noradrenaline") and, as a fallback, names with a typo in them.
+    Results are ordered by name prefix, word prefix, substring and then fuzzy matches.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.folded = [_fold(name) for name in self.names]
+        words = set()
+        self.trigrams = {}
+        for i, name in enumerate(self.folded):
+            for match in _WORD.finditer(name):
+                words.add((name[match.start() :], i))
+            for trigram in _trigrams(name):
+                self.trigrams.setdefault(trigram, set()).add(i)
+        # (rest of the name from the start of a word, name id), whole names are the word at 0
+        self.words = sorted(words)
+
+    def _prefixed(self, query, whole=False):
+        # Indexed from the bisected start, islice would step over every word before it
+        for position in range(bisect.bisect_left(self.words, (query,)), len(self.words)):
+            rest, i = self.words[position]
+            if not rest.startswith(query):
+                break
+            # Only the first word, the rest of the name from a later word may start with the query too
+            if not whole or len(rest) == len(self.folded[i]):
+                yield i
+
+    def _containing(self, query):
+        postings = sorted((self.trigrams.get(trigram, set()) for trigram in _trigrams(query, padded=False)), key=len)
+        # Intersecting from the rarest trigram keeps the candidate set small
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+        return sorted((i for i in candidates if query in self.folded[i]), key=self.folded.__getitem__)
+
+    def _fuzzy(self, query):
+        wanted = _trigrams(query)
+        hits = Counter()
+        for trigram in wanted:
+            hits.update(self.trigrams.get(trigram, ()))
+        needed = len(wanted) * FUZZY_THRESHOLD
+        return sorted((i for i, count in hits.items() if count >= needed), key=lambda i: (-hits[i], self.folded[i]))
+
+    def search(self, query, limit=None):
+        query = _fold(query)
+        if not query:
+            return self.names[:limit]
+
+        found = {}
+
+        def collect(ids):
+            # Returns True once the limit is reached, the cheaper tiers come first
+            for i in ids:
+                found.setdefault(i, None)
+                if limit is not None and len(found) >= limit:
+                    return True
+            return False
+
+        # Whole names starting with the query come out of the word array already sorted
+        if collect(self._prefixed(query, whole=True)):
+            return [self.names[i] for i in found]
+        if collect(sorted(self._prefixed(query), key=self.folded.__getitem__)):
+            return [self.names[i] for i in found]
+        if len(query) >= 3:
+            collect(self._containing(query)) or found or collect(self._fuzzy(query))
+        return [self.names[i] for i in found]
@@ -0,0 +1,331 @@
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from .autosave import atomic_write
+from .constants import DRUGS_REGISTRY, SHARED_FOLDER, SITUATIONS_REGISTRY
+from .errors import RegistryConflict
+from .tracing import span
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_FILE = "registry.lock"
+SNAPSHOT_FILE = "snapshot.json"
+# Changes a log takes before it is folded into a new snapshot
+COMPACT_AFTER = 1000
+
+
+@contextmanager
+def file_lock(file_path):
+    """Exclusive lock between processes and workstations sharing the folder of file_path."""
+    with open(file_path, "a+") as f:
+        if fcntl is not None:
+            # Record locks, unlike flock, also hold on network file systems
+            fcntl.lockf(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ten seconds, keep waiting
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _read_json(file_path, default):
+    if not os.path.exists(file_path):
+        return default
+    with open(file_path, "r") as f:
+        return json.loads(f.read())
+
+
+def apply_change(drugs, situations, change):
+    """Replays one log entry on the registries, situations being a dict description -> drugs."""
+    op = change["op"]
+    if op == "drug":
+        previous = change.get("previous")
+        if previous is not None and previous != change["name"]:
+            drugs.pop(previous, None)
+        drugs[change["name"]] = change["info"]
+    elif op == "delete_drug":
+        drugs.pop(change["name"], None)
+    elif op == "situation":
+        previous = change.get("previous")
+        if previous is not None and previous != change["description"] and previous in situations:
+            # A renamed situation keeps its place
+            renamed = {
+                (change["description"] if description == previous else description): listed
+                for description, listed in situations.items()
+            }
+            situations.clear()
+            situations.update(renamed)
+        situations[change["description"]] = change["drugs"]
+    elif op == "delete_situation":
+        situations.pop(change["description"], None)
+    elif op == "drugs":
+        drugs.clear()
+        drugs.update(change["drugs"])
+    elif op == "situations":
+        situations.clear()
+        situations.update((description, listed) for description, listed in change["situations"])
+
+
+def check_change(drugs, situations, change):
+    # Renaming onto another entry is refused before the change reaches the log, as the other engines do
+    op, previous = change["op"], change.get("previous")
+    if op == "drug" and previous not in (None, change["name"]) and change["name"] in drugs:
+        name = change["name"]
+        raise RegistryConflict(f'A substance named "{name}" is already registered')
+    if op == "situation" and previous not in (None, change["description"]) and change["description"] in situations:
+        description = change["description"]
+        raise RegistryConflict(f'A situation described as "{description}" is already registered')
+
+
+class SharedStore:
+    """Registry in a folder shared by several workstations, e.g. on a network drive.
+
+    Every change is appended to a versioned change log while holding a lock file, and each
+    station replays only the entries after the last one it has seen, reading the log from
+    where it stopped. Now and then the log is folded into a snapshot and a new log started,
+    stations that were away for longer start over from the snapshot.
+    """
+
+    def __init__(self, folder=SHARED_FOLDER, drugs_file=DRUGS_REGISTRY, situations_file=SITUATIONS_REGISTRY):
+        self.folder = folder
+        # The local registries seed an empty shared folder
+        self.drugs_file = drugs_file
+        self.situations_file = situations_file
+        self.station = socket.gethostname()
+        self.lock_file = os.path.join(folder, LOCK_FILE)
+        self.snapshot_file = os.path.join(folder, SNAPSHOT_FILE)
+        self.applied = 0
+        # Version of the snapshot the current log starts from, None until loaded
+        self.generation = None
+        self.offset = 0
+        self.changed_by = None
+        self._drugs = {}
+        self._situations = {}
+        self._situation_rows = None
+        self._pending = None
+        self._lock = threading.RLock()
+
+    def ensure(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with file_lock(self.lock_file):
+            if not os.path.exists(self.snapshot_file):
+                self._write_snapshot(0, _read_json(self.drugs_file, {}), _read_json(self.situations_file, []))
+        self.pull()
+
+    def _log_path(self, generation):
+        return os.path.join(self.folder, f"changes-{generation}.jsonl")
+
+    @property
+    def log_file(self):
+        return self._log_path(self.generation)
+
+    def _write_snapshot(self, version, drugs, situations):
+        # Called with the lock file held, the log exists before any station can be pointed to it
+        open(self._log_path(version), "a").close()
+        atomic_write(self.snapshot_file, json.dumps({"version": version, "drugs": drugs, "situations": situations}))
+
+    def _load_snapshot(self):
+        with span("registry load", file=SNAPSHOT_FILE):
+            with open(self.snapshot_file, "r") as f:
+                snapshot = json.loads(f.read())
+        self._drugs = snapshot["drugs"]
+        self._situations = dict((description, drugs) for description, drugs in snapshot["situations"])
+        self._situation_rows = None
+        self.applied = self.generation = snapshot["version"]
+        self.offset = 0
+
+    def _read_log(self):
+        # Complete entries written since the last pull, a line still being written is left for later
+        try:
+            with open(self._log_path(self.generation), "rb") as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        entries = []
+        for line in data[:end].splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Left over by a station that crashed while appending
+                continue
+        return entries
+
+    def pull(self):
+        """Applies the changes made by other stations, returns whether there were any."""
+        with self._lock:
+            before = self.applied
+            if self.generation is None:
+                self._load_snapshot()
+                before = None
+            drugs = situations = None
+            while True:
+                entries = self._read_log()
+                if entries is None:
+                    # The log was removed after a compaction long ago
+                    self._load_snapshot()
+                    before = drugs = situations = None
+                    continue
+                following = None
+                for entry in entries:
+                    if "next" in entry:
+                        following = entry["next"]
+                    elif entry["version"] > self.applied:
+                        if drugs is None:
+                            # Copied once per pull, readers may still hold the previous registries
+                            drugs, situations = dict(self._drugs), dict(self._situations)
+                        apply_change(drugs, situations, entry)
+                        self.applied = entry["version"]
+                        self.changed_by = entry.get("station")
+                if following is None:
+                    break
+                self.generation, self.offset = following, 0
+            if drugs is not None:
+                self._drugs, self._situations = drugs, situations
+                self._situation_rows = None
+            return self.applied != before
+
+    def poll(self):
+        # For timers on the GUI thread, skips this round while another thread is saving
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            return self.pull()
+        finally:
+            self._lock.release()
+
+    def _push(self, changes):
+        with span("registry save", changes=len(changes)):
+            with file_lock(self.lock_file):
+                # Catch up first, the versions continue from the latest one
+                self.pull()
+                drugs, situations = dict(self._drugs), dict(self._situations)
+                lines = []
+                version = self.applied
+                for change in changes:
+                    check_change(drugs, situations, change)
+                    version += 1
+                    entry = dict(change, version=version, station=self.station, time=time.time())
+                    apply_change(drugs, situations, entry)
+                    lines.append(json.dumps(entry) + "\n")
+                with open(self._log_path(self.generation), "ab") as f:
+                    if f.tell() > self.offset:
+                        # Ends the line a crashed station left unfinished
+                        f.write(b"\n")
+                    f.write("".join(lines).encode())
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self.offset = f.tell()
+                self.applied = version
+                self._drugs, self._situations = drugs, situations
+                self._situation_rows = None
+                if self.applied - self.generation >= COMPACT_AFTER:
+                    self._compact()
+
+    def _compact(self):
+        # Called with the lock file held and everything pulled
+        previous = self.generation
+        self._write_snapshot(self.applied, self._drugs, self.load_situations())
+        with open(self._log_path(previous), "ab") as f:
+            f.write(json.dumps({"next": self.applied}).encode() + b"\n")
+        self.generation, self.offset = self.applied, 0
+        # Stations still reading the previous log follow it to the new one, older logs go
+        kept = {os.path.basename(self._log_path(previous)), os.path.basename(self._log_path(self.generation))}
+        for name in os.listdir(self.folder):
+            if name.startswith("changes-") and name not in kept:
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except OSError:
+                    pass
+
+    def version(self):
+        # Moves when changes are pulled or pushed, pulling is left to the watcher
+        return self.applied
+
+    def snapshot(self):
+        # The registries are kept in memory between pulls
+        return None
+
+    def load_drugs(self):
+        if self.generation is None:
+            self.pull()
+        return self._drugs
+
+    def load_situations(self):
+        if self.generation is None:
+            self.pull()
+        situations = self._situation_rows
+        if situations is None:
+            situations = self._situation_rows = [
+                [description, drugs] for description, drugs in self._situations.items()
+            ]
+        return situations
+
+    @contextmanager
+    def transaction(self):
+        # Changes made inside the block go to the log together, in one locked append
+        with self._lock:
+            if self._pending is not None:
+                yield self
+                return
+            self._pending = []
+            try:
+                yield self
+                if self._pending:
+                    self._push(self._pending)
+            finally:
+                self._pending = None
+
+    def _change(self, change):
+        with self.transaction():
+            self._pending.append(change)
+
+    def save_drugs(self, drugs):
+        self._change({"op": "drugs", "drugs": dict(drugs)})
+
+    def save_situations(self, situations):
+        self._change(
+            {"op": "situations", "situations": [[description, list(drugs)] for description, drugs in situations]}
+        )
+
+    def upsert_drug(self, name, info, previous=None):
+        stored = {"unit": info["unit"], "min_dose": info["min_dose"], "max_dose": info["max_dose"]}
+        if info.get("concentration") is not None:
+            stored["concentration"] = info["concentration"]
+        self._change({"op": "drug", "name": name, "info": stored, "previous": previous})
+
+    def delete_drug(self, name):
+        self._change({"op": "delete_drug", "name": name})
+
+    def upsert_situation(self, description, drugs, previous=None):
+        self._change({"op": "situation", "description": description, "drugs": list(drugs), "previous": previous})
+
+    def delete_situation(self, description):
+        self._change({"op": "delete_situation", "description": description})
+
+    def flush(self):
+        # Every change is in the log once its transaction ends
+        pass
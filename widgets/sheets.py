@@ -0,0 +1,188 @@
+import argparse
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from .constants import APP_FOLDER
+from .engine import MAX_WEIGHT, MIN_WEIGHT, get_engine
+from .storage import get_store
+from .tracing import span
+
+QUESTIONS_PER_SHEET = 10
+# Sheets handed to a worker process at once, rendering one is far cheaper than shipping it
+CHUNK_SIZE = 25
+
+# A4 in points
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 56
+LINE_HEIGHT = 28
+# Below the title and the name field, above the footer
+MAX_QUESTIONS = (PAGE_HEIGHT - 2 * MARGIN) // LINE_HEIGHT - 3
+
+SheetQuestion = namedtuple("SheetQuestion", "drug weight unit min_dose max_dose")
+Sheet = namedtuple("Sheet", "number seed questions")
+
+
+def make_sheets(count, seed, questions=QUESTIONS_PER_SHEET, engine=None):
+    """Draws the questions of every sheet with their accepted range, as DrugQuiz grades them."""
+    if questions > MAX_QUESTIONS:
+        raise ValueError(f"At most {MAX_QUESTIONS} questions fit on a sheet")
+    engine = engine or get_engine()
+    if not engine.names:
+        raise ValueError("No substances registered")
+    rng = random.Random(f"{seed}:sheets")
+    sheets = []
+    for number in range(1, count + 1):
+        drawn = []
+        for _ in range(questions):
+            drug = rng.choice(engine.names)
+            weight = rng.randint(MIN_WEIGHT, MAX_WEIGHT)
+            unit = engine.correct_units[engine.index[drug]]
+            drawn.append(SheetQuestion(drug, weight, unit, *engine.dose_range(drug, weight)))
+        sheets.append(Sheet(number, seed, drawn))
+    return sheets
+
+
+def _escape(text):
+    # PDF string literal in the encoding of the standard fonts
+    encoded = text.encode("cp1252", "replace")
+    return encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def _text(x, y, text, size=11, font=b"F1"):
+    return b"BT /%s %d Tf %d %d Td (%s) Tj ET\n" % (font, size, x, y, _escape(text))
+
+
+def _dose(value):
+    return f"{value:.4g}"
+
+
+def render_sheet(sheet):
+    """Returns the page contents of the question sheet and of its answer key."""
+    title = f"Dosing drill, sheet {sheet.number}"
+    footer = f"Seed {sheet.seed}, sheet {sheet.number}"
+    top = PAGE_HEIGHT - MARGIN
+
+    page = [_text(MARGIN, top, title, 16, b"F2"), _text(MARGIN, top - LINE_HEIGHT, "Name: ____________________")]
+    key = [_text(MARGIN, top, f"{title}, answer key", 16, b"F2")]
+    y = top - 3 * LINE_HEIGHT
+    for number, question in enumerate(sheet.questions, 1):
+        prompt = f"{number}. {question.drug}, patient of {question.weight} kg"
+        page.append(_text(MARGIN, y, f"{prompt}:  ____________ {question.unit}"))
+        if question.min_dose == question.max_dose:
+            accepted = _dose(question.min_dose)
+        else:
+            accepted = f"{_dose(question.min_dose)} to {_dose(question.max_dose)}"
+        key.append(_text(MARGIN, y, f"{prompt}:  {accepted} {question.unit}"))
+        y -= LINE_HEIGHT
+    for contents in (page, key):
+        contents.append(_text(MARGIN, MARGIN // 2, footer, 8))
+    return b"".join(page), b"".join(key)
+
+
+def render_chunk(sheets):
+    # Runs in the worker processes
+    return [render_sheet(sheet) for sheet in sheets]
+
+
+class PdfWriter:
+    """Just enough PDF for pages of text in the standard Helvetica fonts."""
+
+    FONTS = {b"F1": b"Helvetica", b"F2": b"Helvetica-Bold"}
+
+    def __init__(self):
+        self.pages = []
+
+    def add_page(self, contents):
+        self.pages.append(contents)
+
+    def to_bytes(self):
+        # Objects 1 and 2 are the catalog and the page tree, the fonts follow, then a page and its contents each
+        fonts = {name: 3 + i for i, name in enumerate(self.FONTS)}
+        first_page = 3 + len(fonts)
+        kids = b" ".join(b"%d 0 R" % (first_page + 2 * i) for i in range(len(self.pages)))
+        resources = b" ".join(b"/%s %d 0 R" % (name, number) for name, number in fonts.items())
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.pages)),
+        ]
+        objects += [
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % base
+            for base in self.FONTS.values()
+        ]
+        for i, contents in enumerate(self.pages):
+            objects.append(
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << %s >> >> /Contents %d 0 R >>"
+                % (PAGE_WIDTH, PAGE_HEIGHT, resources, first_page + 2 * i + 1)
+            )
+            objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(contents), contents))
+
+        output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(len(output))
+            output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+        xref = len(output)
+        output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+        output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+        return bytes(output)
+
+    def write(self, file_path):
+        with open(file_path, "wb") as f:
+            f.write(self.to_bytes())
+
+
+def generate(count, seed, folder, questions=QUESTIONS_PER_SHEET, jobs=None):
+    """Writes quiz-sheets.pdf and answer-keys.pdf to folder, returns their paths."""
+    with span("sheet questions", count=count):
+        sheets = make_sheets(count, seed, questions)
+    chunks = [sheets[i : i + CHUNK_SIZE] for i in range(0, len(sheets), CHUNK_SIZE)]
+    with span("sheet rendering", count=count):
+        if jobs == 1 or len(chunks) == 1:
+            rendered = [render_chunk(chunk) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                rendered = list(pool.map(render_chunk, chunks))
+
+    sheet_pdf, key_pdf = PdfWriter(), PdfWriter()
+    for chunk in rendered:
+        for page, key in chunk:
+            sheet_pdf.add_page(page)
+            key_pdf.add_page(key)
+    os.makedirs(folder, exist_ok=True)
+    paths = os.path.join(folder, "quiz-sheets.pdf"), os.path.join(folder, "answer-keys.pdf")
+    sheet_pdf.write(paths[0])
+    key_pdf.write(paths[1])
+    return paths
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="main.py sheets", description="Print dosing drills from the registry, with their answer keys"
+    )
+    parser.add_argument("--count", type=int, default=30, help="number of sheets")
+    parser.add_argument("--seed", type=int, help="seed for the questions, the same seed prints the same sheets")
+    parser.add_argument("--questions", type=int, default=QUESTIONS_PER_SHEET, help="questions per sheet")
+    parser.add_argument("--output", default="quiz-sheets", help="folder for the PDF files")
+    parser.add_argument("--jobs", type=int, help="worker processes, all cores by default")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    seed = random.randrange(2**32) if args.seed is None else args.seed
+    started = time.perf_counter()
+    os.makedirs(APP_FOLDER, exist_ok=True)
+    get_store().ensure()
+    try:
+        paths = generate(args.count, seed, args.output, args.questions, args.jobs)
+    except ValueError as error:
+        print(f"ERROR {error}", file=sys.stderr)
+        return 1
+    print(f"Wrote {args.count} sheets with seed {seed} in {time.perf_counter() - started:.2f} s:", *paths, sep="\n")
+    return 0
@@ -0,0 +1,370 @@
+import bisect
+import logging
+import math
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Mapping, Sequence
+
+from .autosave import atomic_write
+from .index import SituationIndex
+from .units import UNITS
+
+MAGIC = b"DMQS"
+FORMAT = 1
+# Magic, format, registered drugs, interned names, situations, then (mtime, size) of both JSON sources
+HEADER = struct.Struct("<4sIIIIqqqq")
+SECTION = struct.Struct("<QQ")
+
+log = logging.getLogger(__name__)
+# Name and type code of every packed section, in file order
+SECTIONS = (
+    ("name_offsets", "I"),
+    ("names", "B"),
+    # Registered drug ids sorted by name, to look names up without a dict
+    ("name_order", "I"),
+    ("unit_offsets", "I"),
+    ("units", "B"),
+    ("unit_codes", "B"),
+    # Ranges in canonical units, as QuizEngine keeps them, NaN for no concentration
+    ("min_doses", "d"),
+    ("max_doses", "d"),
+    ("concentrations", "d"),
+    ("situation_offsets", "I"),
+    ("situations", "B"),
+    # Situation ids sorted by description, the last one first where a description repeats
+    ("situation_order", "I"),
+    # Drug ids of every situation, situation i has adjacency[adjacency_offsets[i]:adjacency_offsets[i + 1]]
+    ("adjacency_offsets", "I"),
+    ("adjacency", "I"),
+)
+
+
+def source_signature(file_path):
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _strings(values):
+    offsets = array("I", [0])
+    blob = bytearray()
+    for value in values:
+        blob += value.encode()
+        offsets.append(len(blob))
+    return offsets, blob
+
+
+def compile_snapshot(drugs, situations, sources):
+    """Packs the registries into the snapshot format, returns the bytes to write."""
+    from .engine import _concentration, make_float
+
+    names = list(drugs)
+    ids = {name: i for i, name in enumerate(names)}
+    adjacency_offsets = array("I", [0])
+    adjacency = array("I")
+    for _, listed in situations:
+        for name in listed:
+            if name not in ids:
+                # Referenced by a situation but not registered, kept so grading still reports it
+                ids[name] = len(names)
+                names.append(name)
+            adjacency.append(ids[name])
+        adjacency_offsets.append(len(adjacency))
+
+    infos = list(drugs.values())
+    unit_names = sorted({info["unit"] for info in infos})
+    unit_codes = {unit: code for code, unit in enumerate(unit_names)}
+    parsed = [UNITS[info["unit"]] for info in infos]
+    concentrations = [_concentration(info) or math.nan for info in infos]
+    name_offsets, name_blob = _strings(names)
+    unit_offsets, unit_blob = _strings(unit_names)
+    descriptions = [description for description, _ in situations]
+    situation_offsets, situation_blob = _strings(descriptions)
+    sections = {
+        "name_offsets": name_offsets,
+        "names": name_blob,
+        "name_order": array("I", sorted(range(len(infos)), key=names.__getitem__)),
+        "unit_offsets": unit_offsets,
+        "units": unit_blob,
+        "unit_codes": array("B", [unit_codes[info["unit"]] for info in infos]),
+        "min_doses": array("d", [make_float(info["min_dose"]) * unit.scale for info, unit in zip(infos, parsed)]),
+        "max_doses": array("d", [make_float(info["max_dose"]) * unit.scale for info, unit in zip(infos, parsed)]),
+        "concentrations": array("d", concentrations),
+        "situation_offsets": situation_offsets,
+        "situations": situation_blob,
+        "situation_order": array("I", sorted(range(len(descriptions)), key=lambda i: (descriptions[i], -i))),
+        "adjacency_offsets": adjacency_offsets,
+        "adjacency": adjacency,
+    }
+
+    (drugs_mtime, drugs_size), (situations_mtime, situations_size) = sources
+    header = HEADER.pack(
+        MAGIC,
+        FORMAT,
+        len(infos),
+        len(names),
+        len(situations),
+        drugs_mtime,
+        drugs_size,
+        situations_mtime,
+        situations_size,
+    )
+    directory_size = SECTION.size * len(SECTIONS)
+    position = HEADER.size + directory_size
+    directory = bytearray()
+    body = bytearray()
+    for name, _ in SECTIONS:
+        # Every section starts on an 8 byte boundary so it can be cast in place
+        padding = -position % 8
+        body += bytes(padding)
+        position += padding
+        data = bytes(sections[name])
+        directory += SECTION.pack(position, len(data))
+        body += data
+        position += len(data)
+    return header + directory + body
+
+
+class StringTable(Sequence):
+    """Strings decoded from the mapped file only when asked for."""
+
+    def __init__(self, offsets, blob, count=None):
+        self._offsets = offsets
+        self._blob = blob
+        self._count = len(offsets) - 1 if count is None else count
+        # Strings decoded so far, a drug name comes back in every situation that lists it
+        self._decoded = {}
+
+    def __len__(self):
+        return self._count
+
+    def decode(self, i):
+        # Without the checks of indexing, for lookups that only use valid ids
+        text = self._decoded.get(i)
+        if text is None:
+            text = self._decoded[i] = str(self._blob[self._offsets[i] : self._offsets[i + 1]], "utf-8")
+        return text
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._count))]
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self.decode(i)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+
+class SortedIndex(Mapping):
+    """String -> id by binary search over the ids stored sorted by their string, nothing to build."""
+
+    def __init__(self, strings, order):
+        self._strings = strings
+        self._order = order
+        # Keys found so far, questions keep coming back to the same ones
+        self._found = {}
+
+    def get(self, key, default=None):
+        found = self._found.get(key)
+        if found is not None:
+            return found
+        decode, order = self._strings.decode, self._order
+        position = bisect.bisect_left(range(len(order)), key, key=lambda j: decode(order[j]))
+        if position < len(order) and decode(order[position]) == key:
+            found = self._found[key] = order[position]
+            return found
+        return default
+
+    def __getitem__(self, key):
+        found = self.get(key)
+        if found is None:
+            raise KeyError(key)
+        return found
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(self._strings)
+
+
+class SituationTable(Sequence):
+    """(description, drug names) of every situation, decoded when read."""
+
+    def __init__(self, descriptions, offsets, adjacency, names):
+        self.descriptions = descriptions
+        self._offsets = offsets
+        self._adjacency = adjacency
+        self._names = names
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    def drugs(self, i):
+        decode = self._names.decode
+        return [decode(drug_id) for drug_id in self._adjacency[self._offsets[i] : self._offsets[i + 1]]]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.descriptions[i], self.drugs(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class SituationLookup(Mapping):
+    """Description -> drug names over a SituationTable."""
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def get(self, description, default=None):
+        i = self._index.get(description)
+        return default if i is None else self._table.drugs(i)
+
+    def __getitem__(self, description):
+        return self._table.drugs(self._index[description])
+
+    def __contains__(self, description):
+        return description in self._index
+
+    def __len__(self):
+        return len(self._table)
+
+    def __iter__(self):
+        return iter(self._table.descriptions)
+
+
+class CodedColumn(Sequence):
+    """Per drug values stored as small codes into a table."""
+
+    def __init__(self, codes, table):
+        self._codes = codes
+        self._table = table
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __getitem__(self, i):
+        return self._table[self._codes[i]]
+
+    def __iter__(self):
+        table = self._table
+        return (table[code] for code in self._codes)
+
+
+class OptionalColumn(Sequence):
+    """Floats with NaN standing for a missing value, read back as None."""
+
+    def __init__(self, values):
+        self._values = values
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, i):
+        value = self._values[i]
+        return None if math.isnan(value) else value
+
+    def __iter__(self):
+        return (None if math.isnan(value) else value for value in self._values)
+
+
+class RegistrySnapshot:
+    """A compiled registry mapped into memory, the arrays are read in place without copies."""
+
+    def __init__(self, file_path):
+        with open(file_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = buffer = memoryview(self._mmap)
+        try:
+            (magic, version, self.drug_count, name_count, self.situation_count, *sources) = HEADER.unpack_from(buffer)
+        except struct.error:
+            raise ValueError(f"{file_path} is not a registry snapshot")
+        if magic != MAGIC or version != FORMAT:
+            raise ValueError(f"{file_path} is not a registry snapshot of format {FORMAT}")
+        self.sources = (tuple(sources[:2]), tuple(sources[2:]))
+        self.sections = {}
+        for i, (name, code) in enumerate(SECTIONS):
+            offset, length = SECTION.unpack_from(buffer, HEADER.size + i * SECTION.size)
+            self.sections[name] = buffer[offset : offset + length].cast(code)
+
+        sections = self.sections
+        self.all_names = StringTable(sections["name_offsets"], sections["names"])
+        self.names = StringTable(sections["name_offsets"], sections["names"], self.drug_count)
+        self.index = SortedIndex(self.names, sections["name_order"])
+        self.unit_names = list(StringTable(sections["unit_offsets"], sections["units"]))
+        descriptions = StringTable(sections["situation_offsets"], sections["situations"])
+        self.situations = SituationTable(
+            descriptions, sections["adjacency_offsets"], sections["adjacency"], self.all_names
+        )
+        self.situation_lookup = SituationLookup(self.situations, SortedIndex(descriptions, sections["situation_order"]))
+
+    def close(self):
+        # Unmaps the file, Windows cannot replace it while it is mapped. Nothing read from the
+        # snapshot may be used afterwards, the views raise ValueError once released
+        if self._mmap.closed:
+            return
+        try:
+            for view in self.sections.values():
+                view.release()
+            self._buffer.release()
+            self._mmap.close()
+        except BufferError:
+            # Something still holds a view of its own, the mapping goes once that is collected
+            log.warning("The registry snapshot is still in use and stays mapped")
+
+    def situation_index(self):
+        # Bitsets straight from the stored drug ids, which are interned in the same order
+        index = SituationIndex()
+        index.drug_names = list(self.all_names)
+        index.drug_ids = {name: drug_id for drug_id, name in enumerate(index.drug_names)}
+        offsets, adjacency = self.sections["adjacency_offsets"], self.sections["adjacency"]
+        for position, description in enumerate(self.situations.descriptions):
+            bits = 0
+            for drug_id in adjacency[offsets[position] : offsets[position + 1]]:
+                bits |= 1 << drug_id
+                index.users.setdefault(drug_id, set()).add(position)
+            index.descriptions.append(description)
+            index.bitsets.append(bits)
+            index.positions[description] = position
+        return index
+
+
+def load_snapshot(file_path, drugs_file, situations_file, load):
+    """Maps the snapshot of the two registries, compiled again first when they changed since.
+
+    load(file_path) returns a parsed registry. Returns None when no snapshot can be used, the
+    caller then works from the JSON documents.
+    """
+    try:
+        sources = source_signature(drugs_file), source_signature(situations_file)
+        try:
+            snapshot = RegistrySnapshot(file_path)
+        except (OSError, ValueError):
+            # Not written yet, or by another format
+            pass
+        else:
+            if snapshot.sources == sources:
+                return snapshot
+            snapshot.close()
+        atomic_write(file_path, compile_snapshot(load(drugs_file), load(situations_file), sources))
+        return RegistrySnapshot(file_path)
+    except (OSError, ValueError, KeyError) as error:
+        # A registry the engine cannot read either, a file system that cannot map it, or on
+        # Windows a snapshot that is still mapped by an engine in use
+        log.warning("Not using the registry snapshot %s: %s", file_path, error)
+        return None
@@ -0,0 +1,392 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from .autosave import atomic_write, autosaver
+from .cache import registry_cache
+from .constants import (
+    DRUGS_REGISTRY,
+    REGISTRY_DATABASE,
+    REGISTRY_SNAPSHOT,
+    SHARED_FOLDER,
+    SITUATIONS_REGISTRY,
+    STORAGE_ENGINE,
+)
+from .errors import RegistryConflict
+from .shared import SharedStore
+from .snapshot import load_snapshot
+from .tracing import span, tracer
+
+
+class JsonStore:
+    """Default engine, keeps the registries as the plain JSON files in APP_FOLDER.
+
+    Saved documents are served from the registry cache right away and written to disk by the
+    debounced autosaver.
+    """
+
+    def __init__(self, drugs_file=DRUGS_REGISTRY, situations_file=SITUATIONS_REGISTRY, snapshot_file=REGISTRY_SNAPSHOT):
+        self.drugs_file = drugs_file
+        self.situations_file = situations_file
+        self.snapshot_file = snapshot_file
+        self._pending = None
+        self._lock = threading.RLock()
+
+    def ensure(self):
+        for file_path, empty_data in ((self.drugs_file, {}), (self.situations_file, [])):
+            if not os.path.exists(file_path):
+                atomic_write(file_path, json.dumps(empty_data))
+
+    def load_drugs(self):
+        return registry_cache.load(self.drugs_file)
+
+    def load_situations(self):
+        return registry_cache.load(self.situations_file)
+
+    def version(self):
+        # Also moves once saved documents reach the disk, so the engine moves over to the snapshot
+        return registry_cache.version(self.drugs_file), registry_cache.version(self.situations_file), self._pinned()
+
+    def _pinned(self):
+        return any(registry_cache.pinned(path) for path in (self.drugs_file, self.situations_file))
+
+    def snapshot(self):
+        # Compiled registries for the quiz engine, which spare parsing them. None while a saved
+        # document is not on disk yet, it is compiled from the cached documents once it is
+        if self._pinned():
+            return None
+        return load_snapshot(self.snapshot_file, self.drugs_file, self.situations_file, registry_cache.load)
+
+    def _write(self, file_path, content):
+        registry_cache.put(file_path, content)
+        autosaver.schedule(file_path, content, on_written=registry_cache.settle)
+
+    def flush(self):
+        autosaver.flush()
+
+    @contextmanager
+    def transaction(self):
+        # Row changes made inside the block are flushed with a single write per file
+        with self._lock:
+            if self._pending is not None:
+                yield self
+                return
+            self._pending = {}
+            try:
+                yield self
+                for file_path, content in self._pending.items():
+                    self._write(file_path, content)
+            finally:
+                self._pending = None
+
+    def _working_copy(self, file_path):
+        if self._pending is not None and file_path in self._pending:
+            return self._pending[file_path]
+        content = registry_cache.load(file_path)
+        content = dict(content) if isinstance(content, dict) else [list(row) for row in content]
+        if self._pending is not None:
+            self._pending[file_path] = content
+        return content
+
+    def _commit(self, file_path, content):
+        if self._pending is None:
+            self._write(file_path, content)
+
+    def save_drugs(self, drugs):
+        with self.transaction():
+            self._pending[self.drugs_file] = dict(drugs)
+
+    def save_situations(self, situations):
+        with self.transaction():
+            self._pending[self.situations_file] = [[description, list(drugs)] for description, drugs in situations]
+
+    def upsert_drug(self, name, info, previous=None):
+        with self._lock:
+            drugs = self._working_copy(self.drugs_file)
+            if previous is not None and previous != name:
+                if name in drugs:
+                    raise RegistryConflict(f'A substance named "{name}" is already registered')
+                drugs.pop(previous, None)
+            drugs[name] = {"unit": info["unit"], "min_dose": info["min_dose"], "max_dose": info["max_dose"]}
+            if info.get("concentration") is not None:
+                drugs[name]["concentration"] = info["concentration"]
+            self._commit(self.drugs_file, drugs)
+
+    def delete_drug(self, name):
+        with self._lock:
+            drugs = self._working_copy(self.drugs_file)
+            drugs.pop(name, None)
+            self._commit(self.drugs_file, drugs)
+
+    def upsert_situation(self, description, drugs, previous=None):
+        with self._lock:
+            situations = self._working_copy(self.situations_file)
+            key = description if previous is None else previous
+            if key != description and any(row[0] == description for row in situations):
+                raise RegistryConflict(f'A situation described as "{description}" is already registered')
+            for row in situations:
+                if row[0] == key:
+                    row[0], row[1] = description, list(drugs)
+                    break
+            else:
+                situations.append([description, list(drugs)])
+            self._commit(self.situations_file, situations)
+
+    def delete_situation(self, description):
+        with self._lock:
+            situations = self._working_copy(self.situations_file)
+            situations[:] = [row for row in situations if row[0] != description]
+            self._commit(self.situations_file, situations)
+
+
+class SqliteStore:
+    """Transactional engine with one row per substance and per situation/drug link."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS drugs (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            unit TEXT NOT NULL,
+            min_dose REAL NOT NULL,
+            max_dose REAL NOT NULL,
+            concentration REAL
+        );
+        CREATE TABLE IF NOT EXISTS situations (
+            id INTEGER PRIMARY KEY,
+            description TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS situation_drugs (
+            situation_id INTEGER NOT NULL REFERENCES situations(id) ON DELETE CASCADE,
+            drug_name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (situation_id, drug_name)
+        );
+        CREATE INDEX IF NOT EXISTS situation_drugs_by_drug ON situation_drugs (drug_name);
+    """
+
+    def __init__(self, database=REGISTRY_DATABASE, drugs_file=DRUGS_REGISTRY, situations_file=SITUATIONS_REGISTRY):
+        self.database = database
+        self.drugs_file = drugs_file
+        self.situations_file = situations_file
+        self._connection = None
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._writes = 0
+        self._cache = {}
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.database, isolation_level=None, check_same_thread=False)
+            # The migration writes through this connection, it is only kept once set up completely
+            self._connection = connection
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.execute("PRAGMA foreign_keys=ON")
+                connection.executescript(self.SCHEMA)
+                self._upgrade()
+                self._migrate()
+            except BaseException:
+                self._connection = None
+                connection.close()
+                raise
+        return self._connection
+
+    def ensure(self):
+        self.connection
+
+    def _upgrade(self):
+        # Databases created before drug concentrations were registered
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(drugs)")}
+        if "concentration" not in columns:
+            self._connection.execute("ALTER TABLE drugs ADD COLUMN concentration REAL")
+
+    def _migrate(self):
+        # One-time import of the JSON registries written by the default engine
+        migrated = self._connection.execute("SELECT value FROM meta WHERE key = 'migrated'").fetchone()
+        if migrated:
+            return
+        with self.transaction():
+            if os.path.exists(self.drugs_file):
+                with open(self.drugs_file, "r") as f:
+                    for name, info in json.loads(f.read()).items():
+                        self.upsert_drug(name, info)
+            if os.path.exists(self.situations_file):
+                with open(self.situations_file, "r") as f:
+                    for description, drugs in json.loads(f.read()):
+                        self.upsert_situation(description, drugs)
+            self._connection.execute("INSERT INTO meta (key, value) VALUES ('migrated', '1')")
+
+    def version(self):
+        # data_version moves when another connection commits, _writes covers our own commits
+        data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        return data_version, self._writes
+
+    def _cached(self, key, loader):
+        version = self.version()
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        content = loader()
+        self._cache[key] = (version, content)
+        return content
+
+    def load_drugs(self):
+        @tracer.traced("registry load")
+        def loader():
+            rows = self.connection.execute(
+                "SELECT name, unit, min_dose, max_dose, concentration FROM drugs ORDER BY id"
+            )
+            drugs = {}
+            for name, unit, min_dose, max_dose, concentration in rows:
+                drugs[name] = {"unit": unit, "min_dose": min_dose, "max_dose": max_dose}
+                if concentration is not None:
+                    drugs[name]["concentration"] = concentration
+            return drugs
+
+        return self._cached("drugs", loader)
+
+    def load_situations(self):
+        @tracer.traced("registry load")
+        def loader():
+            situations = {}
+            for (situation_id, description) in self.connection.execute(
+                "SELECT id, description FROM situations ORDER BY id"
+            ):
+                situations[situation_id] = [description, []]
+            links = self.connection.execute(
+                "SELECT situation_id, drug_name FROM situation_drugs ORDER BY situation_id, position"
+            )
+            for situation_id, drug_name in links:
+                situations[situation_id][1].append(drug_name)
+            return list(situations.values())
+
+        return self._cached("situations", loader)
+
+    def snapshot(self):
+        # Rows are read from the database as needed already
+        return None
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            outermost = self._depth == 0
+            if outermost:
+                self.connection.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if outermost:
+                    self._connection.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if outermost:
+                with span("registry save"):
+                    self._connection.execute("COMMIT")
+                self._writes += 1
+
+    def save_drugs(self, drugs):
+        with self.transaction():
+            self.connection.execute("DELETE FROM drugs")
+            for name, info in drugs.items():
+                self.upsert_drug(name, info)
+
+    def save_situations(self, situations):
+        with self.transaction():
+            self.connection.execute("DELETE FROM situations")
+            for description, drugs in situations:
+                self.upsert_situation(description, drugs)
+
+    def upsert_drug(self, name, info, previous=None):
+        from .engine import _concentration, make_float
+
+        with self.transaction():
+            # Doses as the engine reads them, JSON registries may hold decimal commas
+            values = (
+                name,
+                info["unit"],
+                make_float(info["min_dose"]),
+                make_float(info["max_dose"]),
+                _concentration(info),
+            )
+            if previous is not None and previous != name:
+                if self.connection.execute("SELECT 1 FROM drugs WHERE name = ?", (name,)).fetchone():
+                    raise RegistryConflict(f'A substance named "{name}" is already registered')
+                updated = self.connection.execute(
+                    "UPDATE drugs SET name = ?, unit = ?, min_dose = ?, max_dose = ?, concentration = ? "
+                    "WHERE name = ?",
+                    values + (previous,),
+                )
+                if updated.rowcount:
+                    return
+            self.connection.execute(
+                "INSERT INTO drugs (name, unit, min_dose, max_dose, concentration) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET unit = excluded.unit, min_dose = excluded.min_dose, "
+                "max_dose = excluded.max_dose, concentration = excluded.concentration",
+                values,
+            )
+
+    def delete_drug(self, name):
+        with self.transaction():
+            self.connection.execute("DELETE FROM drugs WHERE name = ?", (name,))
+
+    def upsert_situation(self, description, drugs, previous=None):
+        with self.transaction():
+            key = description if previous is None else previous
+            if (
+                key != description
+                and self.connection.execute("SELECT 1 FROM situations WHERE description = ?", (description,)).fetchone()
+            ):
+                raise RegistryConflict(f'A situation described as "{description}" is already registered')
+            row = self.connection.execute("SELECT id FROM situations WHERE description = ?", (key,)).fetchone()
+            if row is None:
+                situation_id = self.connection.execute(
+                    "INSERT INTO situations (description) VALUES (?)", (description,)
+                ).lastrowid
+            else:
+                situation_id = row[0]
+                self.connection.execute(
+                    "UPDATE situations SET description = ? WHERE id = ?", (description, situation_id)
+                )
+                self.connection.execute("DELETE FROM situation_drugs WHERE situation_id = ?", (situation_id,))
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO situation_drugs (situation_id, drug_name, position) VALUES (?, ?, ?)",
+                [(situation_id, drug, position) for position, drug in enumerate(drugs)],
+            )
+
+    def delete_situation(self, description):
+        with self.transaction():
+            self.connection.execute("DELETE FROM situations WHERE description = ?", (description,))
+
+    def flush(self):
+        # Every commit is already durable
+        pass
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+ENGINES = {"json": JsonStore, "sqlite": SqliteStore, "shared": SharedStore}
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        try:
+            engine = ENGINES[STORAGE_ENGINE]
+        except KeyError:
+            raise ValueError(f"Unknown storage engine {STORAGE_ENGINE!r}, expected one of {sorted(ENGINES)}")
+        if engine is SharedStore and not SHARED_FOLDER:
+            raise ValueError("The shared storage engine needs DMQ_SHARED_FOLDER")
+        _store = engine()
+    return _store
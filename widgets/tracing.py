@@ -0,0 +1,122 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+# Set to a file path (or to 1 for dmq-trace.json in the working directory) to record a trace
+TRACE_ENV = "DMQ_TRACE"
+DEFAULT_TRACE_FILE = "dmq-trace.json"
+
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer._finish(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+class Tracer:
+    """Opt-in recorder of named spans and counters, written out in the Chrome trace format.
+
+    The file opens in chrome://tracing, Perfetto and speedscope. While disabled, span() hands
+    back a shared no-op context manager so instrumented hot paths stay cheap.
+    """
+
+    def __init__(self, recent=20):
+        self.enabled = False
+        self.output = None
+        self.events = []
+        self.counters = {}
+        self.recent = deque(maxlen=recent)
+        self._origin = time.perf_counter_ns()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def enable(self, output=DEFAULT_TRACE_FILE):
+        if not self.enabled:
+            atexit.register(self.write)
+        self.enabled = True
+        self.output = output
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def traced(self, name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _finish(self, name, start, end, args):
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start - self._origin) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+            self.recent.append((name, (end - start) / 1e6))
+
+    def count(self, name, increment=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            value = self.counters[name] = self.counters.get(name, 0) + increment
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "C",
+                    "ts": (time.perf_counter_ns() - self._origin) / 1000,
+                    "pid": self._pid,
+                    "args": {name: value},
+                }
+            )
+
+    def last_spans(self):
+        with self._lock:
+            return list(self.recent)
+
+    def write(self, output=None):
+        output = output or self.output
+        if not self.enabled or not output:
+            return
+        with self._lock:
+            events = list(self.events)
+        with open(output, "w") as f:
+            f.write(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+
+tracer = Tracer()
+span = tracer.span
+
+if os.environ.get(TRACE_ENV):
+    value = os.environ[TRACE_ENV]
+    tracer.enable(DEFAULT_TRACE_FILE if value == "1" else value)
@@ -0,0 +1,222 @@
+import codecs
+import csv
+import itertools
+import logging
+import sqlite3
+import zipfile
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+from .constants import units
+from .engine import make_float
+from .storage import get_store
+from .tracing import span
+
+COLUMNS = ["name", "unit", "min_dose", "max_dose", "concentration"]
+# Headers as written by the substance editor are accepted as well
+HEADER_ALIASES = {
+    "substance name": "name",
+    "minimum dose": "min_dose",
+    "maximum dose": "max_dose",
+    "concentration (mg/ml)": "concentration",
+}
+
+# Rows validated and committed per transaction
+CHUNK_SIZE = 500
+# What Excel on Windows writes CSVs in, tried when a file is not UTF-8
+FALLBACK_ENCODING = "cp1252"
+
+log = logging.getLogger(__name__)
+
+
+def _normalize_header(header):
+    header = (header or "").strip().lower()
+    return HEADER_ALIASES.get(header, header.replace(" ", "_"))
+
+
+def _open_xlsx():
+    # openpyxl is optional, only spreadsheets need it
+    try:
+        import openpyxl
+    except ImportError:
+        raise RuntimeError("Reading and writing .xlsx files needs the openpyxl package")
+    return openpyxl
+
+
+def count_rows(file_path):
+    # Data rows without the header, used to scale the progress bar
+    if file_path.lower().endswith(".xlsx"):
+        workbook = _open_xlsx().load_workbook(file_path, read_only=True)
+        try:
+            return max((workbook.active.max_row or 1) - 1, 0)
+        finally:
+            workbook.close()
+    with open(file_path, "rb") as f:
+        return max(sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 16), b"")) - 1, 0)
+
+
+def csv_encoding(file_path):
+    # Decodes the whole file up front, rows are committed as they are read so a late error could not be retried
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    try:
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 16), b""):
+                decoder.decode(block)
+            decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+    return "utf-8-sig"
+
+
+def read_rows(file_path):
+    """Yields (line number, {column: value}) lazily from a CSV or XLSX file."""
+    if file_path.lower().endswith(".xlsx"):
+        workbook = _open_xlsx().load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [_normalize_header(str(value) if value is not None else "") for value in next(rows, [])]
+            for line, values in enumerate(rows, 2):
+                yield line, dict(zip(header, values))
+        finally:
+            workbook.close()
+        return
+
+    with open(file_path, "r", newline="", encoding=csv_encoding(file_path)) as f:
+        reader = csv.reader(f)
+        header = [_normalize_header(value) for value in next(reader, [])]
+        for values in reader:
+            yield reader.line_num, dict(zip(header, values))
+
+
+def validate_row(row):
+    name = str(row.get("name") or "").strip()
+    if not name:
+        raise ValueError("missing substance name")
+    unit = str(row.get("unit") or "").strip()
+    if unit not in units:
+        raise ValueError(f"unknown unit {unit!r}, expected one of {', '.join(units)}")
+    try:
+        min_dose = make_float(row.get("min_dose"))
+        max_dose = make_float(row.get("max_dose"))
+    except (TypeError, ValueError):
+        raise ValueError("doses must be numbers")
+    if min_dose > max_dose:
+        raise ValueError("minimum dose is larger than maximum dose")
+    info = {"unit": unit, "min_dose": min_dose, "max_dose": max_dose}
+    # The concentration column is optional
+    if row.get("concentration") not in (None, ""):
+        try:
+            info["concentration"] = make_float(row["concentration"])
+        except (TypeError, ValueError):
+            raise ValueError("concentration must be a number")
+        if info["concentration"] <= 0:
+            raise ValueError("concentration must be positive")
+    return name, info
+
+
+def write_rows(file_path, drugs):
+    """Writes the registry row by row, yields the number of rows written so far."""
+    rows = (
+        [name, info["unit"], info["min_dose"], info["max_dose"], info.get("concentration", "")]
+        for name, info in drugs.items()
+    )
+    if file_path.lower().endswith(".xlsx"):
+        workbook = _open_xlsx().Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(COLUMNS)
+        for count, row in enumerate(rows, 1):
+            sheet.append(row)
+            if count % CHUNK_SIZE == 0:
+                yield count
+        workbook.save(file_path)
+        yield len(drugs)
+        return
+
+    with open(file_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        count = 0
+        while True:
+            chunk = list(itertools.islice(rows, CHUNK_SIZE))
+            if not chunk:
+                break
+            writer.writerows(chunk)
+            count += len(chunk)
+            yield count
+
+
+class TransferSignals(QObject):
+    progress = pyqtSignal(int, int)
+    row_error = pyqtSignal(int, str)
+    done = pyqtSignal(int, int)
+    failed = pyqtSignal(str)
+
+
+class ImportWorker(QRunnable):
+    """Parses a formulary file in chunks on a pool thread and commits each valid chunk."""
+
+    def __init__(self, file_path):
+        super().__init__()
+        self.file_path = file_path
+        self.signals = TransferSignals()
+        self.cancelled = False
+
+    def run(self):
+        imported = failed = 0
+        store = get_store()
+        try:
+            total = count_rows(self.file_path)
+            rows = read_rows(self.file_path)
+            while not self.cancelled:
+                chunk = list(itertools.islice(rows, CHUNK_SIZE))
+                if not chunk:
+                    break
+                valid = []
+                for line, row in chunk:
+                    try:
+                        valid.append(validate_row(row))
+                    except ValueError as error:
+                        failed += 1
+                        self.signals.row_error.emit(line, str(error))
+                with span("import chunk", rows=len(valid)), store.transaction():
+                    for name, info in valid:
+                        store.upsert_drug(name, info)
+                imported += len(valid)
+                self.signals.progress.emit(imported + failed, max(total, imported + failed))
+        except UnicodeDecodeError:
+            self.signals.failed.emit(f"{self.file_path} is neither UTF-8 nor {FALLBACK_ENCODING} text")
+            return
+        except (OSError, RuntimeError, ValueError, csv.Error, zipfile.BadZipFile, sqlite3.Error) as error:
+            self.signals.failed.emit(str(error))
+            return
+        except Exception as error:
+            # Nothing may escape a pool thread, PyQt ends the application on an uncaught exception there
+            log.exception("Importing %s failed", self.file_path)
+            self.signals.failed.emit(str(error) or type(error).__name__)
+            return
+        self.signals.done.emit(imported, failed)
+
+
+class ExportWorker(QRunnable):
+    def __init__(self, file_path):
+        super().__init__()
+        self.file_path = file_path
+        self.signals = TransferSignals()
+        self.cancelled = False
+
+    def run(self):
+        written = 0
+        try:
+            drugs = get_store().load_drugs()
+            for written in write_rows(self.file_path, drugs):
+                if self.cancelled:
+                    break
+                self.signals.progress.emit(written, len(drugs))
+        except (OSError, RuntimeError, sqlite3.Error) as error:
+            self.signals.failed.emit(str(error))
+            return
+        except Exception as error:
+            log.exception("Exporting to %s failed", self.file_path)
+            self.signals.failed.emit(str(error) or type(error).__name__)
+            return
+        self.signals.done.emit(written, 0)
@@ -0,0 +1,57 @@
+from collections import namedtuple
+
+from .constants import units
+
+# Amounts with their dimension and factor to the canonical unit of it, mg for mass, ml for volume
+BASE_UNITS = {"mg": ("mass", 1.0), "µg": ("mass", 1e-3), "ml": ("volume", 1.0)}
+PER_WEIGHT = "kgKG"
+PER_HOUR = "h"
+
+
+class Unit(namedtuple("Unit", "name quantity scale per_weight per_hour")):
+    """A dose unit broken down once, so grading is plain arithmetic afterwards."""
+
+    __slots__ = ()
+
+    @property
+    def dimension(self):
+        # What is left once the patient weight has been applied, e.g. ("mass", True) for mg/h
+        return self.quantity, self.per_hour
+
+    def to_canonical(self, value, weight):
+        return value * self.scale * (weight if self.per_weight else 1)
+
+    def from_canonical(self, value, weight):
+        return value / (self.scale * (weight if self.per_weight else 1))
+
+
+def parse_unit(name):
+    base, *divisors = name.split("/")
+    if base not in BASE_UNITS or any(divisor not in (PER_WEIGHT, PER_HOUR) for divisor in divisors):
+        raise ValueError(f"Unknown unit {name!r}")
+    quantity, scale = BASE_UNITS[base]
+    return Unit(name, quantity, scale, PER_WEIGHT in divisors, PER_HOUR in divisors)
+
+
+UNITS = {name: parse_unit(name) for name in units}
+
+
+def answer_unit(unit):
+    # Per-weight amounts are answered as the absolute amount for the given patient
+    if unit.endswith(PER_WEIGHT):
+        return unit.split("/")[0]
+    return unit
+
+
+def conversion_factor(source, target, concentration=None):
+    """Factor taking a canonical amount in source's dimension to target's, None if there is none.
+
+    Mass and volume convert into each other through the concentration of the drug in mg/ml.
+    """
+    if source.per_hour != target.per_hour:
+        return None
+    if source.quantity == target.quantity:
+        return 1.0
+    if not concentration:
+        return None
+    return concentration if source.quantity == "volume" else 1 / concentration